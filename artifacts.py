@@ -0,0 +1,55 @@
+import os, json, time, queue, threading, logging
+
+# Directory for per-query debug files (SERP text, combined page text, prompt, answer); empty turns them off
+ARTIFACTS_DIR = os.getenv("DEBUG_ARTIFACTS") or ""
+# Files waiting for the writer; past this they are dropped rather than slowing queries down
+ARTIFACTS_MAX_QUEUE = int(os.getenv("DEBUG_ARTIFACTS_QUEUE") or 256)
+
+
+class ArtifactSink:
+	# Writes debug files from one background thread. put() never blocks the event loop: it only enqueues,
+	# and when the writer falls behind the file is counted in `dropped` instead.
+	def __init__(self, root: str, max_queue: int):
+		self.root = root
+		self.queue: queue.Queue = queue.Queue(max(1, max_queue))
+		self.seq = 0
+		self.written = 0
+		self.dropped = 0
+		self.thread = threading.Thread(target=self._run, name="artifacts", daemon=True)
+		self.thread.start()
+
+	def namespace(self) -> str:
+		# one directory per query run; the pid keeps web workers apart
+		self.seq += 1
+		return "%s-%d-%d" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid(), self.seq)
+
+	def put(self, ns: str, name: str, data: str | dict) -> None:
+		if isinstance(data, dict):
+			data = json.dumps(data, ensure_ascii=False, indent=1)
+		try:
+			self.queue.put_nowait((ns, name, data))
+		except queue.Full:
+			self.dropped += 1
+
+	def _run(self) -> None:
+		while True:
+			item = self.queue.get()
+			if item is None:
+				return
+			ns, name, data = item
+			try:
+				d = os.path.join(self.root, ns)
+				os.makedirs(d, exist_ok=True)
+				with open(os.path.join(d, name), "w", encoding="utf-8") as f:
+					f.write(data)
+				self.written += 1
+			except OSError:
+				logging.warning("artifact write failed: %s/%s", ns, name, exc_info=True)
+
+	def close(self, timeout: float = 5.0) -> None:
+		# files already queued are written first
+		try:
+			self.queue.put(None, timeout=timeout)
+		except queue.Full:
+			pass
+		self.thread.join(timeout)
@@ -0,0 +1,1125 @@
+import os, sys, json, time, base64, asyncio, argparse, resource, subprocess
+
+BENCH_PATH = os.path.abspath(__file__)
+
+
+def _peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+	return resource.getrusage(who).ru_maxrss / 1024.0
+
+def _print_rows(rows: list[dict]) -> None:
+	if not rows:
+		return
+	cols = list(rows[0].keys())
+	widths = [max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in cols]
+	print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+	for r in rows:
+		print("  ".join(str(r.get(c, "")).ljust(w) for c, w in zip(cols, widths)))
+
+def _check(ok: bool, what: str) -> None:
+	# regression checks end the run with a non-zero exit status
+	if not ok:
+		sys.exit(f"FAIL: {what}")
+
+
+# --- framing: legacy base64 JSON lines vs binary frames (inline and shm) ---
+
+FRAMING_MODES = ("legacy", "binary", "shm")
+
+def _framing_writer(mode: str, count: int, size: int) -> None:
+	from fetch_proto import write_frame, STATUS_OK, STATUS_DONE
+	body = os.urandom(size)
+	url = "https://example.com/some/page.html"
+	out = sys.stdout.buffer
+	for i in range(count):
+		if mode == "legacy":
+			content_b64 = base64.b64encode(body).decode("ascii")
+			header = {"q": 1, "i": i, "url": url, "final_url": url, "status": "ok", "content_len": len(content_b64)}
+			print(json.dumps(header), flush=True)
+			sys.stdout.write(content_b64 + "\n")
+			sys.stdout.flush()
+		else:
+			write_frame(out, 1, i, STATUS_OK, url, url, body)
+	if mode != "legacy":
+		write_frame(out, 1, 0, STATUS_DONE)
+
+async def _framing_reader(mode: str, count: int, size: int) -> dict:
+	from fetch_proto import read_frame
+	env = dict(os.environ)
+	env["FETCH_SHM_THRESHOLD"] = "1" if mode == "shm" else "0"
+	proc = await asyncio.create_subprocess_exec(
+		sys.executable, "-u", BENCH_PATH, "framing-writer", mode, str(count), str(size),
+		stdout=asyncio.subprocess.PIPE, env=env, limit=1 << 20,
+	)
+	t0 = time.perf_counter()
+	got = 0
+	total = 0
+	while got < count:
+		if mode == "legacy":
+			line = await proc.stdout.readline()
+			if not line:
+				break
+			row = json.loads(line.decode("utf-8", errors="ignore"))
+			content_len = int(row.get("content_len") or 0)
+			payload = await proc.stdout.readexactly(content_len + 1)
+			body = base64.b64decode(payload[:-1].decode("ascii", errors="ignore"))
+		else:
+			row = await read_frame(proc.stdout)
+			if row is None or row["status"] == "done":
+				break
+			body = row["body"]
+		got += 1
+		total += len(body)
+	elapsed = time.perf_counter() - t0
+	await proc.wait()
+	return {
+		"mode": mode,
+		"frames": got,
+		"MiB": round(total / 1048576, 1),
+		"sec": round(elapsed, 3),
+		"MiB/s": round(total / 1048576 / elapsed, 1) if elapsed > 0 else 0,
+		"reader_rss_mb": round(_peak_rss_mb(), 1),
+		"writer_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+	}
+
+def cmd_framing(args) -> None:
+	if args.mode:
+		print(json.dumps(asyncio.run(_framing_reader(args.mode, args.count, args.size))))
+		return
+	rows = []
+	for mode in FRAMING_MODES:
+		# each mode in a fresh interpreter so peak RSS is not shared between runs
+		out = subprocess.run(
+			[sys.executable, BENCH_PATH, "framing", "--mode", mode, "--count", str(args.count), "--size", str(args.size)],
+			check=True, capture_output=True, text=True,
+		).stdout
+		rows.append(json.loads(out.strip().splitlines()[-1]))
+	_print_rows(rows)
+
+
+# --- serp: async client against a stub SERP server, with an event loop lag probe ---
+
+async def _loop_lag_probe(stop: asyncio.Event, interval: float, lags: list) -> None:
+	loop = asyncio.get_running_loop()
+	while not stop.is_set():
+		t0 = loop.time()
+		await asyncio.sleep(interval)
+		lags.append(loop.time() - t0 - interval)
+
+async def _bench_serp(args) -> list[dict]:
+	import stubs
+	from serp_client import SerpClient
+	app = stubs.serp_app(delay=args.delay)
+	runner, base = await stubs.start(app)
+	rows = []
+	try:
+		async with SerpClient(base, 36, ttl=60, max_entries=1024) as client:
+			for rnd in ("cold", "warm"):
+				lags: list = []
+				stop = asyncio.Event()
+				probe = asyncio.create_task(_loop_lag_probe(stop, 0.01, lags))
+				hits0 = app["hits"]
+				t0 = time.perf_counter()
+				queries = [f"кто директор компании {k % args.distinct}" for k in range(args.queries)]
+				await asyncio.gather(*[client.search(q) for q in queries])
+				elapsed = time.perf_counter() - t0
+				stop.set()
+				await probe
+				rows.append({
+					"round": rnd,
+					"queries": len(queries),
+					"upstream_calls": app["hits"] - hits0,
+					"cache_hits": client.cache.hits,
+					"collapsed": client.flight.shared,
+					"sec": round(elapsed, 3),
+					"max_loop_lag_ms": round(max(lags or [0]) * 1000, 1),
+				})
+	finally:
+		await runner.cleanup()
+	return rows
+
+def cmd_serp(args) -> None:
+	rows = asyncio.run(_bench_serp(args))
+	_print_rows(rows)
+	distinct = min(args.distinct, args.queries)
+	cold, warm = rows
+	_check(cold["upstream_calls"] <= distinct, f"cold round made {cold['upstream_calls']} upstream calls for {distinct} distinct queries")
+	_check(warm["upstream_calls"] == 0, f"warm round made {warm['upstream_calls']} upstream calls, all should be cached")
+	lag = max(r["max_loop_lag_ms"] for r in rows)
+	_check(lag <= args.max_lag_ms, f"event loop lag {lag} ms over {args.max_lag_ms} ms: something blocks the loop")
+
+
+# --- extract: bs4 vs lxml HTML-to-text engines over a corpus of saved pages ---
+
+def cmd_extract(args) -> None:
+	import glob
+	from html_text import strip_html_to_text
+	paths = sorted(glob.glob(os.path.join(args.corpus, "*.html")))
+	_check(bool(paths), f"no *.html pages in {args.corpus}")
+	pages = []
+	for pth in paths:
+		with open(pth, "rb") as f:
+			pages.append(f.read())
+	total = sum(len(b) for b in pages)
+	outputs = {}
+	rows = []
+	for engine in ("bs4", "lxml"):
+		t0 = time.perf_counter()
+		for _ in range(args.repeat):
+			outputs[engine] = [strip_html_to_text(b, engine) for b in pages]
+		elapsed = (time.perf_counter() - t0) / args.repeat
+		rows.append({
+			"engine": engine,
+			"pages": len(pages),
+			"MiB": round(total / 1048576, 2),
+			"ms_total": round(elapsed * 1000, 1),
+			"ms_per_page": round(elapsed * 1000 / len(pages), 2),
+			"MiB/s": round(total / 1048576 / elapsed, 1) if elapsed > 0 else 0,
+		})
+	_print_rows(rows)
+	same = 0
+	for pth, a, b in zip(paths, outputs["bs4"], outputs["lxml"]):
+		if a == b:
+			same += 1
+			continue
+		la, lb = set(a.splitlines()), set(b.splitlines())
+		print(f"mismatch {os.path.basename(pth)}: only_bs4={len(la - lb)} only_lxml={len(lb - la)} lines")
+	print(f"parity: {same}/{len(pages)} pages identical")
+	# expect.json next to the pages: {"<page>.html": {"contains": [...], "absent": [...]}}, checked for both engines
+	expect = {}
+	if os.path.exists(os.path.join(args.corpus, "expect.json")):
+		with open(os.path.join(args.corpus, "expect.json"), "r", encoding="utf-8") as f:
+			expect = json.load(f)
+	wrong = []
+	for pth, a, b in zip(paths, outputs["bs4"], outputs["lxml"]):
+		want = expect.get(os.path.basename(pth)) or {}
+		for engine, text in (("bs4", a), ("lxml", b)):
+			wrong += [f"{os.path.basename(pth)} {engine}: missing {s!r}" for s in want.get("contains") or [] if s not in text]
+			wrong += [f"{os.path.basename(pth)} {engine}: kept {s!r}" for s in want.get("absent") or [] if s in text]
+	for w in wrong:
+		print(w)
+	_check(same == len(pages), f"bs4 and lxml differ on {len(pages) - same} of {len(pages)} pages")
+	_check(not wrong, f"{len(wrong)} expectation(s) failed")
+
+
+# --- tokens: full encode + slice (old _trim_to_token_limit) vs early-stopping TokenBudget ---
+
+TOKEN_MODES = ("legacy", "budget")
+
+def _sample_text(size: int) -> str:
+	line = "Генеральный директор компании назначен советом директоров, сообщила пресс-служба 12.03.2024."
+	out = []
+	n = 0
+	k = 0
+	while n < size:
+		ln = f"{line} #{k}"
+		out.append(ln)
+		n += len(ln) + 1
+		k += 1
+	return "\n".join(out)
+
+def _tokens_run(mode: str, size: int, limit: int, repeat: int) -> dict:
+	import tokens
+	text = _sample_text(size)
+	tokens.prewarm()
+	t0 = time.perf_counter()
+	for _ in range(repeat):
+		if mode == "legacy":
+			enc = tokens.tiktoken.get_encoding(tokens.ENCODING)
+			toks = enc.encode(text)
+			kept = enc.decode(toks[:limit])
+		else:
+			kept = tokens.TokenBudget(limit).take(text)
+	elapsed = (time.perf_counter() - t0) / repeat
+	return {
+		"mode": mode,
+		"input_chars": len(text),
+		"kept_chars": len(kept),
+		"ms_per_call": round(elapsed * 1000, 2),
+		"peak_rss_mb": round(_peak_rss_mb(), 1),
+	}
+
+def cmd_tokens(args) -> None:
+	if args.mode:
+		print(json.dumps(_tokens_run(args.mode, args.size, args.limit, args.repeat)))
+		return
+	rows = []
+	for mode in TOKEN_MODES:
+		out = subprocess.run(
+			[sys.executable, BENCH_PATH, "tokens", "--mode", mode, "--size", str(args.size), "--limit", str(args.limit), "--repeat", str(args.repeat)],
+			check=True, capture_output=True, text=True,
+		).stdout
+		rows.append(json.loads(out.strip().splitlines()[-1]))
+	_print_rows(rows)
+
+
+# --- llm: streaming first-line client against a fake OpenAI-compatible server ---
+
+async def _bench_llm(args) -> list[dict]:
+	import stubs
+	from llm_client import LlmClient
+	app = stubs.llm_app(token_delay=args.token_delay, reject_every=args.reject_every)
+	runner, base = await stubs.start(app)
+	messages = [{"role": "user", "content": "кто сейчас генеральный директор"}]
+	rows = []
+	try:
+		async with LlmClient(base, "", "fake", args.concurrency, args.rpm, 30) as client:
+			lats: list = []
+
+			async def one() -> str:
+				t0 = time.perf_counter()
+				ans = await client.first_line(messages, max_tokens=512)
+				lats.append(time.perf_counter() - t0)
+				return ans
+
+			t0 = time.perf_counter()
+			answers = await asyncio.gather(*[one() for _ in range(args.requests)])
+			elapsed = time.perf_counter() - t0
+			lats.sort()
+			rows.append({
+				"requests": args.requests,
+				"answers_ok": sum(1 for a in answers if a == "Иван Петрович Сидоров"),
+				"upstream_calls": app["hits"],
+				"rejected_429": app["rejected"],
+				"sec": round(elapsed, 3),
+				"p50_ms": round(lats[len(lats) // 2] * 1000, 1),
+				"max_ms": round(lats[-1] * 1000, 1),
+				"full_stream_ms": round(args.token_delay * 204 * 1000, 1),
+			})
+	finally:
+		await runner.cleanup()
+	return rows
+
+def cmd_llm(args) -> None:
+	_print_rows(asyncio.run(_bench_llm(args)))
+
+
+# --- telegram: outbound dispatcher load test against a stub Bot API that enforces limits ---
+
+async def _bench_telegram(args) -> list[dict]:
+	import stubs
+	from telegram import TelegramClient
+	app = stubs.telegram_app(chat_interval=args.chat_interval, global_rps=30)
+	runner, base = await stubs.start(app)
+	rows = []
+	try:
+		tg = TelegramClient("TOKEN", base, args.global_rps, args.chat_interval)
+		tg.start()
+
+		async def conversation(chat_id: int) -> None:
+			# the same call pattern as _process_update, with a short pipeline in the middle
+			await tg.send_message(chat_id, "👋 Hi! Send me a query.")
+			status_id = await tg.send_message(chat_id, "Ищу")
+			tg.edit_message_text(chat_id, status_id, "Ищу.")
+			tg.edit_message_text(chat_id, status_id, "Думаю")
+			await asyncio.sleep(args.pipeline_sec)
+			await tg.send_message(chat_id, "Иван Петрович Сидоров")
+			await tg.delete_message(chat_id, status_id)
+
+		t0 = time.perf_counter()
+		await asyncio.gather(*[conversation(1000 + c) for c in range(args.chats)])
+		elapsed = time.perf_counter() - t0
+		await tg.close()
+		rows.append({
+			"chats": args.chats,
+			"api_calls": app["calls"],
+			"stub_429": app["rejected"],
+			"client_retries": tg.retried,
+			"coalesced": tg.coalesced,
+			"sec": round(elapsed, 2),
+			"calls_per_sec": round(app["calls"] / elapsed, 1) if elapsed > 0 else 0,
+		})
+	finally:
+		await runner.cleanup()
+	return rows
+
+def cmd_telegram(args) -> None:
+	_print_rows(asyncio.run(_bench_telegram(args)))
+
+
+# --- scheduler: burst of interactive and /test jobs through the bounded scheduler ---
+
+async def _bench_scheduler(args) -> list[dict]:
+	from scheduler import Scheduler, PRIO_INTERACTIVE, PRIO_BATCH
+	sched = Scheduler(args.workers, args.max_queue, args.per_chat)
+	sched.start()
+	running = {"all": 0, "peak": 0}
+	per_chat: dict = {}
+	per_chat_peak = 0
+	waits = {PRIO_INTERACTIVE: [], PRIO_BATCH: []}
+
+	def make(prio: int, chat_id):
+		t_submit = time.perf_counter()
+
+		async def job() -> None:
+			nonlocal per_chat_peak
+			waits[prio].append(time.perf_counter() - t_submit)
+			running["all"] += 1
+			running["peak"] = max(running["peak"], running["all"])
+			if chat_id is not None:
+				per_chat[chat_id] = per_chat.get(chat_id, 0) + 1
+				per_chat_peak = max(per_chat_peak, per_chat[chat_id])
+			try:
+				await asyncio.sleep(args.job_sec)
+			finally:
+				running["all"] -= 1
+				if chat_id is not None:
+					per_chat[chat_id] -= 1
+		return job
+
+	futures = []
+	shed = {PRIO_INTERACTIVE: 0, PRIO_BATCH: 0}
+	t0 = time.perf_counter()
+	for k in range(args.jobs):
+		# every third job is /test traffic, the rest come from a handful of chats sending bursts
+		if k % 3 == 2:
+			prio, chat_id = PRIO_BATCH, None
+		else:
+			prio, chat_id = PRIO_INTERACTIVE, k % args.chats
+		fut = sched.submit(make(prio, chat_id), chat_id, prio, "bench")
+		if fut is None:
+			shed[prio] += 1
+		else:
+			futures.append(fut)
+	await asyncio.gather(*futures)
+	elapsed = time.perf_counter() - t0
+	await sched.close()
+	rows = []
+	for prio, name in ((PRIO_INTERACTIVE, "interactive"), (PRIO_BATCH, "test")):
+		w = sorted(waits[prio]) or [0.0]
+		rows.append({
+			"class": name,
+			"run": len(waits[prio]),
+			"shed": shed[prio],
+			"wait_p50_ms": round(w[len(w) // 2] * 1000, 1),
+			"wait_p95_ms": round(w[int(len(w) * 0.95)] * 1000, 1),
+			"wait_max_ms": round(w[-1] * 1000, 1),
+			"peak_running": running["peak"],
+			"peak_per_chat": per_chat_peak,
+			"sec": round(elapsed, 2),
+		})
+	return rows
+
+def cmd_scheduler(args) -> None:
+	_print_rows(asyncio.run(_bench_scheduler(args)))
+
+
+# --- tls: TlsBrowser fetch throughput vs executor size against local HTTPS stubs ---
+
+async def _bench_tls(args) -> list[dict]:
+	import tempfile
+	import stubs
+	from tls_browser import TlsBrowser
+	tmp = tempfile.mkdtemp(prefix="bench-tls-")
+	ctx = stubs.self_signed_context(tmp)
+	servers = []
+	try:
+		for h in range(args.hosts):
+			servers.append(await stubs.start(stubs.site_app(args.page_bytes, args.delay), f"127.0.0.{h + 1}", ssl_context=ctx))
+		urls = [f"{servers[k % args.hosts][1]}/p/{k}.html" for k in range(args.requests)]
+		rows = []
+		default_threads = min(32, (os.cpu_count() or 1) + 4)
+		for threads in [int(t) for t in args.threads.split(",")]:
+			async with TlsBrowser("Mozilla/5.0", None, concurrency=threads, per_host=args.per_host, insecure=True) as browser:
+				await browser.get(urls[0], {}, timeout=10, follow=True)
+				lats: list = []
+
+				async def one(url: str) -> bool:
+					t0 = time.perf_counter()
+					res = await browser.get(url, {}, timeout=10, follow=True, max_bytes=1 << 24)
+					lats.append(time.perf_counter() - t0)
+					return res.get("status") == 200
+
+				t0 = time.perf_counter()
+				ok = await asyncio.gather(*[one(u) for u in urls], return_exceptions=True)
+				elapsed = time.perf_counter() - t0
+			lats.sort()
+			rows.append({
+				"threads": threads,
+				"default_executor": default_threads,
+				"hosts": args.hosts,
+				"per_host": args.per_host,
+				"ok": sum(1 for r in ok if r is True),
+				"sec": round(elapsed, 2),
+				"req_per_sec": round(len(urls) / elapsed, 1),
+				"p50_ms": round(lats[len(lats) // 2] * 1000, 1) if lats else 0,
+			})
+		return rows
+	finally:
+		for runner, _ in servers:
+			await runner.cleanup()
+
+def cmd_tls(args) -> None:
+	_print_rows(asyncio.run(_bench_tls(args)))
+
+
+# --- bodycap: per-fetch peak memory with the body cap, content-type and extension filters ---
+
+def _vm_hwm_mb() -> float:
+	# peak RSS of this process image; unlike ru_maxrss it is not inherited from the parent across exec
+	with open("/proc/self/status") as f:
+		for line in f:
+			if line.startswith("VmHWM:"):
+				return int(line.split()[1]) / 1024.0
+	return _peak_rss_mb()
+
+def _bodycap_run(url: str, max_bytes: int) -> None:
+	# runs in a fresh process so the peak reflects this one fetch
+	from tls_browser import TlsBrowser
+
+	async def go() -> dict:
+		async with TlsBrowser("Mozilla/5.0", None, concurrency=1, insecure=True) as browser:
+			rss0 = _vm_hwm_mb()
+			t0 = time.perf_counter()
+			res = await browser.get(url, {}, timeout=30, follow=True, max_bytes=max_bytes)
+			return {
+				"sec": round(time.perf_counter() - t0, 3),
+				"raw_bytes": res.get("raw_bytes") or 0,
+				"kept_bytes": len(res.get("content") or b""),
+				"skipped": res.get("skipped") or "",
+				"capped": res.get("aborted_at_cap"),
+				"rss_before_mb": round(rss0, 1),
+				"peak_rss_mb": round(_vm_hwm_mb(), 1),
+			}
+	print(json.dumps(asyncio.run(go())))
+
+async def _bench_bodycap(args) -> list[dict]:
+	import tempfile
+	import stubs
+	ctx = stubs.self_signed_context(tempfile.mkdtemp(prefix="bench-tls-"))
+	runner, base = await stubs.start(stubs.site_app(delay=0), ssl_context=ctx)
+	big = args.size_mb * 1048576
+	cases = [
+		("html_small", f"{base}/page.html?size=200000"),
+		("html_over_cap", f"{base}/page.html?size={big}"),
+		("pdf_by_type", f"{base}/doc?size={big}&type=application/pdf"),
+		("pdf_by_extension", f"{base}/report.pdf?size={big}"),
+	]
+	rows = []
+	try:
+		for name, url in cases:
+			proc = await asyncio.create_subprocess_exec(
+				sys.executable, BENCH_PATH, "bodycap-run", url, str(args.max_bytes),
+				stdout=asyncio.subprocess.PIPE,
+			)
+			out, _ = await proc.communicate()
+			row = {"case": name}
+			row.update(json.loads(out.decode("utf-8").strip().splitlines()[-1]))
+			rows.append(row)
+	finally:
+		await runner.cleanup()
+	return rows
+
+def cmd_bodycap(args) -> None:
+	_print_rows(asyncio.run(_bench_bodycap(args)))
+
+
+# --- hoststats: which fetch results count as latency/failure samples for a host ---
+
+def cmd_hoststats(args) -> None:
+	import tempfile
+	from host_stats import HostStats
+	from fetch_batch_worker import record_result
+	host = "example.com"
+	with tempfile.TemporaryDirectory() as tmp:
+		stats = HostStats(os.path.join(tmp, "host_stats.sqlite3"))
+		record_result(stats, host, "ok", {"status": 200, "elapsed_ms": 400.0}, 6)
+		record_result(stats, host, "fail", None, 6)
+		record_result(stats, host, "fail", None, 6)
+		before = list(stats._row(host))
+		# what TlsBrowser.get returns for a .pdf link: nothing was requested
+		record_result(stats, host, "skipped", {"status": None, "url": f"https://{host}/a.pdf", "content": b"", "headers": {}, "skipped": "extension", "raw_bytes": 0}, 6)
+		after_skip = list(stats._row(host))
+		record_result(stats, host, "fail", None, 6)
+		after = list(stats._row(host))
+		stats.close()
+	_print_rows([
+		{"step": "2 fails", "ewma_ms": round(before[0], 1), "fails": before[3], "open": before[5] > 0},
+		{"step": "+ skipped .pdf", "ewma_ms": round(after_skip[0], 1), "fails": after_skip[3], "open": after_skip[5] > 0},
+		{"step": "+ 1 fail", "ewma_ms": round(after[0], 1), "fails": after[3], "open": after[5] > 0},
+	])
+	_check(after_skip == before, "a skipped link changed the host's stats")
+	_check(after[5] > 0, "the circuit did not open after 3 failures in a row")
+
+
+# --- passages: link-order trimming vs BM25 passage selection on pages with the answer deep inside ---
+
+PASSAGE_NEEDLE = "Генеральным директором ООО «Ромашка» с марта 2024 года является Иван Петрович Сидоров."
+PASSAGE_FILLER = (
+	"Компания предлагает широкий ассортимент продукции для дома и офиса по выгодным ценам.",
+	"Подпишитесь на рассылку, чтобы первыми узнавать о скидках, акциях и новых поступлениях.",
+	"Доставка по всей России осуществляется транспортными компаниями в течение 3-5 рабочих дней.",
+	"Рынок строительных материалов в прошлом квартале вырос на 4 процента по данным аналитиков.",
+	"Отзывы покупателей помогают нам становиться лучше, оставьте свой отзыв о работе магазина.",
+)
+
+def _passage_pages(pages: int, page_chars: int, needle_page: int) -> list[str]:
+	out = []
+	for p in range(pages):
+		lines = []
+		n = 0
+		k = 0
+		while n < page_chars:
+			ln = f"{PASSAGE_FILLER[(p + k) % len(PASSAGE_FILLER)]} Страница {p}, пункт {k}."
+			lines.append(ln)
+			n += len(ln) + 1
+			k += 1
+		if p == needle_page:
+			lines.insert(len(lines) * 3 // 4, PASSAGE_NEEDLE)
+		out.append("\n".join(lines))
+	return out
+
+def cmd_passages(args) -> None:
+	import tokens
+	from passages import PassageIndex
+	sep = "\n\n-----\n\n"
+	serp = "ООО «Ромашка» — официальный сайт. Контакты и реквизиты компании."
+	pages = _passage_pages(args.pages, args.page_chars, args.needle_page)
+	tokens.prewarm()
+	rows = []
+	t0 = time.perf_counter()
+	linear = tokens.TokenBudget(args.budget).take(serp + sep + sep.join(pages))
+	rows.append({
+		"mode": "link_order",
+		"prompt_tokens": tokens.count(linear),
+		"needle_kept": PASSAGE_NEEDLE in linear,
+		"index_ms": 0,
+		"select_ms": round((time.perf_counter() - t0) * 1000, 1),
+		"passages": "",
+	})
+	t0 = time.perf_counter()
+	index = PassageIndex(args.query)
+	index.add(-1, serp)
+	for i, page in enumerate(pages):
+		index.add(i, page)
+	t1 = time.perf_counter()
+	ranked, info = index.select(args.budget, sep)
+	t2 = time.perf_counter()
+	rows.append({
+		"mode": "bm25_passages",
+		"prompt_tokens": tokens.count(ranked),
+		"needle_kept": PASSAGE_NEEDLE in ranked,
+		"index_ms": round((t1 - t0) * 1000, 1),
+		"select_ms": round((t2 - t1) * 1000, 1),
+		"passages": f"{info['kept']}/{info['passages']}",
+	})
+	_print_rows(rows)
+
+
+# --- dedup: near-duplicate paragraph/page removal on syndicated copies of one article ---
+
+def _syndicated_pages(pages: int, copies: int, paragraphs: int, seed: int = 7) -> tuple[list[str], set[str]]:
+	import random
+	rnd = random.Random(seed)
+	vocab = [f"{w}{k}" for w in ("компания", "директор", "рынок", "совет", "акция", "сделка", "регион", "выручка") for k in range(300)]
+
+	def para() -> str:
+		return " ".join(rnd.choice(vocab) for _ in range(rnd.randint(20, 60))) + "."
+
+	article = [para() for _ in range(paragraphs)]
+	out = []
+	unique = set()
+	for p in range(pages):
+		if p < copies:
+			# a mirror: same article with a word swapped here and there and chrome of its own
+			body = []
+			for a in article:
+				words = a.split()
+				if rnd.random() < 0.5:
+					words[rnd.randrange(len(words))] = rnd.choice(vocab)
+				body.append(" ".join(words))
+			body.insert(0, f"Источник {p}: перепечатка материала, все права принадлежат авторам.")
+		else:
+			body = [para() for _ in range(paragraphs)]
+			unique.update(body)
+		out.append("\n".join(body))
+	return out, unique
+
+def cmd_dedup(args) -> None:
+	import tokens
+	from dedup import Deduper
+	pages, unique = _syndicated_pages(args.pages, args.copies, args.paragraphs)
+	text_in = "\n".join(pages)
+	tokens.prewarm()
+	t0 = time.perf_counter()
+	d = Deduper(args.threshold)
+	kept = [d.filter(p) for p in pages]
+	elapsed = time.perf_counter() - t0
+	text_out = "\n".join(k for k in kept if k)
+	kept_lines = set(text_out.splitlines())
+	_print_rows([{
+		"input_kb": round(len(text_in.encode("utf-8")) / 1024, 1),
+		"paragraphs": d.paragraphs,
+		"dropped": d.dropped_paragraphs,
+		"pages_dropped": d.dropped_pages,
+		"unique_lost": sum(1 for u in unique if u not in kept_lines),
+		"tokens_in": tokens.count(text_in),
+		"tokens_out": tokens.count(text_out),
+		"tokens_saved": tokens.count(d.dropped_text()),
+		"ms": round(elapsed * 1000, 1),
+	}])
+
+
+# --- replay: whole pipeline (answer_query) over a JSONL query file against local SERP, site and LLM stubs ---
+
+REPLAY_STAGES = ("serp", "fetch", "extract", "tokenize", "llm", "total", "query")
+
+def _replay_queries(path: str, limit: int) -> list[str]:
+	# one query per line: {"query": ...} (or "q"/"text") or plain text
+	out = []
+	with open(path, "r", encoding="utf-8") as f:
+		for line in f:
+			line = line.strip()
+			if not line:
+				continue
+			try:
+				obj = json.loads(line)
+			except ValueError:
+				obj = line
+			if isinstance(obj, dict):
+				obj = obj.get("query") or obj.get("q") or obj.get("text") or ""
+			if isinstance(obj, str) and obj.strip():
+				out.append(obj.strip())
+			if limit and len(out) >= limit:
+				break
+	return out
+
+def _pct(values: list[float], q: float) -> float:
+	return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+def _replay_run() -> None:
+	# runs in a fresh process per concurrency level, so caches start cold and VmHWM is this run's peak
+	cfg = json.loads(sys.stdin.read())
+	from aiohttp import web
+	import metrics
+	metrics.STAGE_SECONDS.keep_samples()
+	import main
+
+	async def go() -> dict:
+		t0 = time.perf_counter()
+		runner = web.AppRunner(main.create_app())
+		await runner.setup()
+		if main.WARMUP is not None:
+			await main.WARMUP
+		startup = time.perf_counter() - t0
+		sem = asyncio.Semaphore(cfg["concurrency"])
+		lats: list = []
+		failed = 0
+
+		async def one(q: str) -> None:
+			nonlocal failed
+			async with sem:
+				t = time.perf_counter()
+				try:
+					ans = await main.answer_query(q, fresh=True)
+				except Exception:
+					ans = ""
+				lats.append(time.perf_counter() - t)
+				failed += 0 if ans else 1
+
+		t0 = time.perf_counter()
+		if cfg["batch"]:
+			# the /batch path: SERP read-ahead and one fetch per URL across the whole run
+			async for row in main.run_batch(cfg["queries"], cfg["concurrency"], fresh=True):
+				lats.append(row["ms"] / 1000.0)
+				failed += 0 if row.get("answer") else 1
+		else:
+			await asyncio.gather(*[one(q) for q in cfg["queries"]])
+		elapsed = time.perf_counter() - t0
+		rss = _vm_hwm_mb()
+		fetch_mem = main.FETCH_POOL.mem_stats() if main.FETCH_POOL else {}
+		await runner.cleanup()
+		stages = {k[0]: v for k, v in metrics.STAGE_SECONDS.samples().items()}
+		stages["query"] = lats
+		return {
+			"queries": len(lats),
+			"failed": failed,
+			"sec": round(elapsed, 2),
+			"qps": round(len(lats) / elapsed, 2) if elapsed else 0,
+			"startup_sec": round(startup, 2),
+			"peak_rss_mb": round(rss, 1),
+			"peak_child_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+			"budget_peak_mb": round(main.MEM_BUDGET.peak / 1048576, 1),
+			"fetch_budget_peak_mb": round((fetch_mem.get("peak") or 0) / 1048576, 1),
+			"budget_waits": main.MEM_BUDGET.waits + (fetch_mem.get("waits") or 0),
+			"stages": stages,
+		}
+	print(json.dumps(asyncio.run(go())))
+
+async def _bench_replay(args) -> tuple[list[dict], list[dict]]:
+	import tempfile
+	import stubs
+	tmp = tempfile.mkdtemp(prefix="bench-replay-")
+	ctx = stubs.self_signed_context(tmp) if args.https else None
+	corpus = stubs.load_corpus(args.corpus) if args.corpus else None
+	queries = _replay_queries(args.queries, args.limit)
+	servers = []
+	site_apps = []
+	try:
+		for h in range(args.hosts):
+			app = stubs.site_app(args.page_bytes, args.delay, args.delay_sigma, args.size_sigma, corpus)
+			site_apps.append(app)
+			servers.append(await stubs.start(app, f"127.0.0.{h + 1}", ssl_context=ctx))
+		servers.append(await stubs.start(stubs.serp_app(args.serp_delay, args.links, [b for _, b in servers], args.common_links)))
+		servers.append(await stubs.start(stubs.llm_app(token_delay=args.token_delay)))
+		serp_base, llm_base = servers[-2][1], servers[-1][1]
+		summary = []
+		stages = []
+		for conc in [int(c) for c in args.concurrency.split(",")]:
+			workdir = os.path.join(tmp, f"c{conc}")
+			os.makedirs(workdir)
+			env = dict(
+				os.environ,
+				YANDEX_SERP_URL=serp_base, LLM_BASE_URL=llm_base, GROQ_API_KEY="stub", LLM_RPM="0",
+				PAGE_CACHE_DIR=os.path.join(workdir, "pages"), FETCH_HOST_STATS=os.path.join(workdir, "host_stats.sqlite3"),
+				RESULT_CACHE_PATH="", FETCH_INSECURE="1" if args.https else "0", LOG_LEVEL="WARNING",
+			)
+			if args.mem_budget_mb:
+				env["MEM_BUDGET_BYTES"] = str(args.mem_budget_mb * 1048576)
+			proc = await asyncio.create_subprocess_exec(
+				sys.executable, BENCH_PATH, "replay-run",
+				stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env, cwd=workdir,
+			)
+			hits0 = sum(app["hits"] for app in site_apps)
+			out, _ = await proc.communicate(json.dumps({"queries": queries, "concurrency": conc, "batch": args.batch}).encode("utf-8"))
+			res = json.loads(out.decode("utf-8").strip().splitlines()[-1])
+			res["site_requests"] = sum(app["hits"] for app in site_apps) - hits0
+			for name in REPLAY_STAGES:
+				v = sorted(res["stages"].get(name) or ())
+				if v:
+					stages.append({
+						"concurrency": conc,
+						"stage": name,
+						"n": len(v),
+						"p50_ms": round(_pct(v, 0.5) * 1000, 1),
+						"p95_ms": round(_pct(v, 0.95) * 1000, 1),
+						"p99_ms": round(_pct(v, 0.99) * 1000, 1),
+					})
+			del res["stages"]
+			summary.append({"concurrency": conc, **res})
+		return summary, stages
+	finally:
+		for runner, _ in servers:
+			await runner.cleanup()
+
+def cmd_replay(args) -> None:
+	summary, stages = asyncio.run(_bench_replay(args))
+	_print_rows(stages)
+	print()
+	_print_rows(summary)
+
+
+# --- startup: time from starting main.py to its first answer, with and without the background warm-up ---
+
+STARTUP_MODES = ("lazy", "warm")
+
+async def _startup_once(env: dict, port: int, query: str, at: str) -> dict:
+	# at: the first query is sent as soon as the port accepts ("listen") or once /_health says ok ("ready")
+	from aiohttp import ClientSession, ClientTimeout
+	base = f"http://127.0.0.1:{port}"
+	t0 = time.perf_counter()
+	proc = await asyncio.create_subprocess_exec(
+		sys.executable, os.path.join(os.path.dirname(BENCH_PATH), "main.py"),
+		env=env, cwd=env["PAGE_CACHE_DIR"], stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+	)
+	row = {}
+	try:
+		async with ClientSession(timeout=ClientTimeout(total=120)) as http:
+			async def poll(until: str) -> None:
+				while until not in row:
+					try:
+						async with http.get(base + "/_health") as resp:
+							now = round(time.perf_counter() - t0, 3)
+							row.setdefault("listen_s", now)
+							if resp.status == 200:
+								row.setdefault("ready_s", now)
+					except OSError:
+						pass
+					if until not in row:
+						await asyncio.sleep(0.01)
+
+			await poll("listen_s" if at == "listen" else "ready_s")
+			row["ok"] = True
+			for k, q in enumerate((query, query + " 2")):
+				t = time.perf_counter()
+				async with http.get(base + "/test", params={"q": q, "fresh": "1"}) as resp:
+					row["ok"] = row["ok"] and resp.status == 200 and bool(await resp.text())
+				if k == 0:
+					row["first_ms"] = round((time.perf_counter() - t) * 1000, 1)
+					row["first_answer_s"] = round(time.perf_counter() - t0, 3)
+				else:
+					row["next_ms"] = round((time.perf_counter() - t) * 1000, 1)
+			await poll("ready_s")
+	finally:
+		proc.terminate()
+		await proc.wait()
+	return row
+
+async def _bench_startup(args) -> list[dict]:
+	import socket, tempfile, statistics
+	import stubs
+	tmp = tempfile.mkdtemp(prefix="bench-startup-")
+	servers = [await stubs.start(stubs.site_app(args.page_bytes, args.delay))]
+	servers.append(await stubs.start(stubs.serp_app(args.serp_delay, args.links, servers[0][1])))
+	servers.append(await stubs.start(stubs.llm_app(token_delay=args.token_delay)))
+	rows = []
+	try:
+		for mode in STARTUP_MODES:
+			for at in (("listen", "ready") if mode == "warm" else ("listen",)):
+				runs = []
+				for r in range(args.runs):
+					with socket.socket() as sk:
+						sk.bind(("127.0.0.1", 0))
+						port = sk.getsockname()[1]
+					workdir = os.path.join(tmp, f"{mode}-{at}-{r}")
+					os.makedirs(workdir)
+					env = dict(
+						os.environ,
+						PORT=str(port), WEB_HOST="127.0.0.1", WEB_WORKERS="1", STARTUP_WARMUP="1" if mode == "warm" else "0",
+						YANDEX_SERP_URL=servers[1][1], LLM_BASE_URL=servers[2][1], GROQ_API_KEY="stub", LLM_RPM="0",
+						PAGE_CACHE_DIR=workdir, FETCH_HOST_STATS=os.path.join(workdir, "host_stats.sqlite3"),
+						CHAT_STATE_PATH="", RESULT_CACHE_PATH="", LOG_LEVEL="WARNING",
+					)
+					runs.append(await _startup_once(env, port, f"startup query {r}", at))
+				row = {"mode": mode, "first_query_at": at, "runs": len(runs)}
+				for k in ("listen_s", "ready_s", "first_answer_s", "first_ms", "next_ms"):
+					v = [x[k] for x in runs if x.get(k) is not None]
+					row[k] = round(statistics.median(v), 3) if v else ""
+				row["ok"] = all(x.get("ok") for x in runs)
+				rows.append(row)
+		return rows
+	finally:
+		for runner, _ in servers:
+			await runner.cleanup()
+
+def cmd_startup(args) -> None:
+	_print_rows(asyncio.run(_bench_startup(args)))
+
+
+# --- refresh: Zipf-distributed repeat queries with a short result TTL, with and without the hot-query refresher ---
+
+def _refresh_run() -> None:
+	# one app per mode in a fresh process; queries arrive on the schedule given, as they would from users
+	cfg = json.loads(sys.stdin.read())
+	from aiohttp import web
+	import main
+
+	async def go() -> dict:
+		runner = web.AppRunner(main.create_app())
+		await runner.setup()
+		if main.WARMUP is not None:
+			await main.WARMUP
+		lats: list = []
+		failed = 0
+
+		async def one(q: str) -> None:
+			nonlocal failed
+			t = time.perf_counter()
+			try:
+				ans = await main.answer_query(q)
+			except Exception:
+				ans = ""
+			lats.append(time.perf_counter() - t)
+			failed += 0 if ans else 1
+
+		t0 = time.perf_counter()
+		c0 = time.process_time()
+		tasks = []
+		for at, q in cfg["schedule"]:
+			await asyncio.sleep(max(0.0, t0 + at - time.perf_counter()))
+			tasks.append(asyncio.create_task(one(q)))
+		await asyncio.gather(*tasks)
+		cpu = time.process_time() - c0
+		qc = main._get_query_cache()
+		refresh = main.REFRESHER.stats() if main.REFRESHER else {}
+		await runner.cleanup()
+		lats.sort()
+		return {
+			"queries": len(lats),
+			"failed": failed,
+			"cache_hit": round(qc.hits / max(1, qc.hits + qc.misses), 2),
+			"p50_ms": round(_pct(lats, 0.5) * 1000, 1),
+			"p90_ms": round(_pct(lats, 0.9) * 1000, 1),
+			"p99_ms": round(_pct(lats, 0.99) * 1000, 1),
+			"refreshed": refresh.get("refreshed", 0),
+			"deferred": refresh.get("deferred", 0),
+			"app_cpu_s": round(cpu, 2),
+		}
+	print(json.dumps(asyncio.run(go())))
+
+async def _bench_refresh(args) -> list[dict]:
+	import random, tempfile
+	import stubs
+	rnd = random.Random(11)
+	names = [f"генеральный директор ООО Компания {k}" for k in range(args.distinct)]
+	weights = [1 / (k + 1) ** args.zipf for k in range(args.distinct)]
+	schedule = []
+	at = 0.0
+	while at < args.duration:
+		schedule.append((round(at, 3), rnd.choices(names, weights)[0]))
+		at += rnd.expovariate(args.rps)
+	tmp = tempfile.mkdtemp(prefix="bench-refresh-")
+	servers = [await stubs.start(stubs.site_app(args.page_bytes, args.delay))]
+	servers.append(await stubs.start(stubs.serp_app(args.serp_delay, args.links, servers[0][1])))
+	llm = stubs.llm_app(token_delay=args.token_delay)
+	servers.append(await stubs.start(llm))
+	rows = []
+	try:
+		for mode in ("off", "on"):
+			workdir = os.path.join(tmp, mode)
+			os.makedirs(workdir)
+			env = dict(
+				os.environ,
+				YANDEX_SERP_URL=servers[1][1], LLM_BASE_URL=servers[2][1], GROQ_API_KEY="stub", LLM_RPM="0",
+				PAGE_CACHE_DIR=os.path.join(workdir, "pages"), FETCH_HOST_STATS=os.path.join(workdir, "host_stats.sqlite3"),
+				CHAT_STATE_PATH="", RESULT_CACHE_PATH="", LOG_LEVEL="WARNING",
+				RESULT_CACHE_TTL_SEC=str(args.ttl), REFRESH="1" if mode == "on" else "0",
+				REFRESH_AHEAD_SEC=str(args.ahead), REFRESH_INTERVAL_SEC=str(args.interval), REFRESH_TOP_N=str(args.top_n),
+			)
+			proc = await asyncio.create_subprocess_exec(
+				sys.executable, BENCH_PATH, "refresh-run",
+				stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env, cwd=workdir,
+			)
+			hits0 = llm["hits"]
+			out, _ = await proc.communicate(json.dumps({"schedule": schedule}).encode("utf-8"))
+			res = json.loads(out.decode("utf-8").strip().splitlines()[-1])
+			# first asks of each query miss either way
+			rows.append({"refresher": mode, **res, "first_asks": len({q for _, q in schedule}), "llm_calls": llm["hits"] - hits0})
+		return rows
+	finally:
+		for runner, _ in servers:
+			await runner.cleanup()
+
+def cmd_refresh(args) -> None:
+	_print_rows(asyncio.run(_bench_refresh(args)))
+
+
+def main() -> None:
+	if len(sys.argv) > 1 and sys.argv[1] == "framing-writer":
+		_framing_writer(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+		return
+	if len(sys.argv) > 1 and sys.argv[1] == "bodycap-run":
+		_bodycap_run(sys.argv[2], int(sys.argv[3]))
+		return
+	if len(sys.argv) > 1 and sys.argv[1] == "replay-run":
+		_replay_run()
+		return
+	if len(sys.argv) > 1 and sys.argv[1] == "refresh-run":
+		_refresh_run()
+		return
+	ap = argparse.ArgumentParser(description="Local micro-benchmarks for the leads bot pipeline")
+	sub = ap.add_subparsers(dest="cmd", required=True)
+	p = sub.add_parser("framing", help="fetch worker pipe format: base64 JSON lines vs binary frames")
+	p.add_argument("--mode", choices=FRAMING_MODES)
+	p.add_argument("--count", type=int, default=64)
+	p.add_argument("--size", type=int, default=4194304)
+	p.set_defaults(func=cmd_framing)
+	p = sub.add_parser("serp", help="async SERP client: cache, single-flight and event loop responsiveness (exits non-zero on a regression)")
+	p.add_argument("--queries", type=int, default=200)
+	p.add_argument("--distinct", type=int, default=20)
+	p.add_argument("--delay", type=float, default=0.5)
+	p.add_argument("--max-lag-ms", type=float, default=100, help="fail above this event loop lag; a blocking SERP call stalls it for about --delay")
+	p.set_defaults(func=cmd_serp)
+	p = sub.add_parser("extract", help="HTML-to-text: bs4 vs lxml engine speed and output parity (exits non-zero on a mismatch)")
+	p.add_argument("--corpus", default=os.path.join(os.path.dirname(BENCH_PATH), "fixtures", "extract"), help="pages to compare, e.g. the page cache (htmls)")
+	p.add_argument("--repeat", type=int, default=3)
+	p.set_defaults(func=cmd_extract)
+	p = sub.add_parser("tokens", help="token trimming: full encode vs early-stopping budget")
+	p.add_argument("--mode", choices=TOKEN_MODES)
+	p.add_argument("--size", type=int, default=2000000)
+	p.add_argument("--limit", type=int, default=5400)
+	p.add_argument("--repeat", type=int, default=5)
+	p.set_defaults(func=cmd_tokens)
+	p = sub.add_parser("llm", help="streaming LLM client: first-line latency, concurrency limit and 429 retries")
+	p.add_argument("--requests", type=int, default=40)
+	p.add_argument("--concurrency", type=int, default=8)
+	p.add_argument("--rpm", type=int, default=0)
+	p.add_argument("--token-delay", type=float, default=0.01)
+	p.add_argument("--reject-every", type=int, default=5)
+	p.set_defaults(func=cmd_llm)
+	p = sub.add_parser("telegram", help="Telegram send queue: rate limits, 429 retries and edit coalescing")
+	p.add_argument("--chats", type=int, default=200)
+	p.add_argument("--global-rps", type=float, default=25)
+	p.add_argument("--chat-interval", type=float, default=1.0)
+	p.add_argument("--pipeline-sec", type=float, default=0.5)
+	p.set_defaults(func=cmd_telegram)
+	p = sub.add_parser("scheduler", help="job scheduler: shedding, priorities, per-chat limit and queue wait")
+	p.add_argument("--jobs", type=int, default=300)
+	p.add_argument("--chats", type=int, default=20)
+	p.add_argument("--workers", type=int, default=8)
+	p.add_argument("--max-queue", type=int, default=64)
+	p.add_argument("--per-chat", type=int, default=1)
+	p.add_argument("--job-sec", type=float, default=0.05)
+	p.set_defaults(func=cmd_scheduler)
+	p = sub.add_parser("tls", help="TlsBrowser: fetch throughput vs executor threads against local HTTPS stubs")
+	p.add_argument("--threads", default="4,8,16,32,64")
+	p.add_argument("--requests", type=int, default=400)
+	p.add_argument("--hosts", type=int, default=8)
+	p.add_argument("--per-host", type=int, default=6)
+	p.add_argument("--page-bytes", type=int, default=50000)
+	p.add_argument("--delay", type=float, default=0.1)
+	p.set_defaults(func=cmd_tls)
+	p = sub.add_parser("bodycap", help="TlsBrowser: peak memory per fetch with body cap and content-type/extension filters")
+	p.add_argument("--size-mb", type=int, default=64)
+	p.add_argument("--max-bytes", type=int, default=16777216)
+	p.set_defaults(func=cmd_bodycap)
+	p = sub.add_parser("passages", help="prompt assembly: link-order trimming vs BM25 passage ranking")
+	p.add_argument("--query", default="генеральный директор ООО Ромашка")
+	p.add_argument("--pages", type=int, default=10)
+	p.add_argument("--page-chars", type=int, default=20000)
+	p.add_argument("--needle-page", type=int, default=3)
+	p.add_argument("--budget", type=int, default=5500)
+	p.set_defaults(func=cmd_passages)
+	p = sub.add_parser("hoststats", help="host stats: only requests that went out count as samples (exits non-zero on failure)")
+	p.set_defaults(func=cmd_hoststats)
+	p = sub.add_parser("dedup", help="near-duplicate paragraph/page removal across syndicated copies")
+	p.add_argument("--pages", type=int, default=20)
+	p.add_argument("--copies", type=int, default=8)
+	p.add_argument("--paragraphs", type=int, default=40)
+	p.add_argument("--threshold", type=float, default=0.7)
+	p.set_defaults(func=cmd_dedup)
+	p = sub.add_parser("replay", help="whole pipeline: stage latency percentiles, QPS and peak RSS replaying a query file against local stubs")
+	p.add_argument("--queries", required=True, help="JSONL/text file with one query per line")
+	p.add_argument("--limit", type=int, default=0)
+	p.add_argument("--concurrency", default="1,4,16")
+	p.add_argument("--hosts", type=int, default=8)
+	p.add_argument("--links", type=int, default=10)
+	p.add_argument("--serp-delay", type=float, default=0.3)
+	p.add_argument("--corpus", default="", help="directory of recorded .html pages, e.g. the page cache")
+	p.add_argument("--page-bytes", type=int, default=50000)
+	p.add_argument("--size-sigma", type=float, default=0.8)
+	p.add_argument("--delay", type=float, default=0.2)
+	p.add_argument("--delay-sigma", type=float, default=0.8)
+	p.add_argument("--token-delay", type=float, default=0.005)
+	p.add_argument("--https", action="store_true")
+	p.add_argument("--common-links", type=int, default=0, help="SERP links shared by every query")
+	p.add_argument("--batch", action="store_true", help="run the queries through run_batch (/batch) instead of one by one")
+	p.add_argument("--mem-budget-mb", type=int, default=0, help="MEM_BUDGET_BYTES for the run, 0 keeps the default")
+	p.set_defaults(func=cmd_replay)
+	p = sub.add_parser("startup", help="cold start: time to listen, to ready and to the first answer, lazy vs background warm-up")
+	p.add_argument("--runs", type=int, default=3)
+	p.add_argument("--links", type=int, default=10)
+	p.add_argument("--serp-delay", type=float, default=0.1)
+	p.add_argument("--page-bytes", type=int, default=50000)
+	p.add_argument("--delay", type=float, default=0.05)
+	p.add_argument("--token-delay", type=float, default=0.005)
+	p.set_defaults(func=cmd_startup)
+	p = sub.add_parser("refresh", help="hot-query refresher: cache hit ratio, latency and LLM calls under repeat traffic with a short TTL")
+	p.add_argument("--duration", type=float, default=90)
+	p.add_argument("--rps", type=float, default=1.0)
+	p.add_argument("--distinct", type=int, default=30)
+	p.add_argument("--zipf", type=float, default=1.1)
+	p.add_argument("--ttl", type=int, default=20, help="RESULT_CACHE_TTL_SEC")
+	p.add_argument("--ahead", type=float, default=8, help="REFRESH_AHEAD_SEC")
+	p.add_argument("--interval", type=float, default=2, help="REFRESH_INTERVAL_SEC")
+	p.add_argument("--top-n", type=int, default=10)
+	p.add_argument("--links", type=int, default=10)
+	p.add_argument("--serp-delay", type=float, default=0.3)
+	p.add_argument("--page-bytes", type=int, default=50000)
+	p.add_argument("--delay", type=float, default=0.2)
+	p.add_argument("--token-delay", type=float, default=0.005)
+	p.set_defaults(func=cmd_refresh)
+	args = ap.parse_args()
+	args.func(args)
+
+if __name__ == "__main__":
+	main()
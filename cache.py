@@ -0,0 +1,70 @@
+import time, asyncio
+from collections import OrderedDict
+
+
+class TtlCache:
+	def __init__(self, ttl: float, max_entries: int):
+		self.ttl = ttl
+		self.max_entries = max(1, max_entries)
+		self.data: OrderedDict = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key, default=None):
+		item = self.data.get(key)
+		if item is None:
+			self.misses += 1
+			return default
+		expires, value = item
+		if expires < time.monotonic():
+			del self.data[key]
+			self.misses += 1
+			return default
+		self.data.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def set(self, key, value, ttl: float | None = None) -> None:
+		self.data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+		self.data.move_to_end(key)
+		while len(self.data) > self.max_entries:
+			self.data.popitem(last=False)
+
+	def ttl_left(self, key) -> float | None:
+		# seconds until the entry expires, without counting a lookup or touching the LRU order
+		item = self.data.get(key)
+		if item is None or item[0] < time.monotonic():
+			return None
+		return item[0] - time.monotonic()
+
+	def pop(self, key, default=None):
+		item = self.data.pop(key, None)
+		return default if item is None else item[1]
+
+	def __len__(self) -> int:
+		return len(self.data)
+
+
+class SingleFlight:
+	# Concurrent calls for one key share a single run of fn. The run is its own task, so a caller that is
+	# cancelled only stops waiting; the others still get the result.
+	def __init__(self):
+		self.calls: dict = {}
+		self.shared = 0
+
+	def _done(self, key, task: asyncio.Task) -> None:
+		if self.calls.get(key) is task:
+			del self.calls[key]
+		# mark retrieved so a failure nobody waits for any more does not log "exception was never retrieved"
+		if not task.cancelled():
+			task.exception()
+
+	async def do(self, key, fn):
+		task = self.calls.get(key)
+		if task is None:
+			task = asyncio.ensure_future(fn())
+			self.calls[key] = task
+			task.add_done_callback(lambda t: self._done(key, t))
+		else:
+			self.shared += 1
+		return await asyncio.shield(task)
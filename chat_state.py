@@ -0,0 +1,54 @@
+import os, time, sqlite3, threading, logging
+
+# Shared by all web workers; empty keeps the state in memory, per process
+STATE_PATH = os.getenv("CHAT_STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_state.sqlite3"))
+
+# Telegram redelivers an update for up to a day when the webhook does not answer
+UPDATE_RETAIN_SEC = 86400
+PRUNE_EVERY_SEC = 3600
+
+
+class ChatState:
+	# Greeted chats and already-claimed Telegram update ids. INSERT OR IGNORE decides which worker wins,
+	# so an update that reaches two workers (a webhook retry, a restart) is handled once.
+	def __init__(self, path: str):
+		self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("PRAGMA synchronous=NORMAL")
+		self.db.execute("CREATE TABLE IF NOT EXISTS updates (update_id INTEGER PRIMARY KEY, seen REAL NOT NULL)")
+		self.db.execute("CREATE TABLE IF NOT EXISTS greeted (chat_id INTEGER PRIMARY KEY, at REAL NOT NULL)")
+		self.lock = threading.Lock()
+		# chats known to be greeted; a chat never leaves the table, so this needs no invalidation
+		self.greeted: set[int] = set()
+		self.pruned = 0.0
+
+	def close(self) -> None:
+		with self.lock:
+			self.db.close()
+
+	def claim_update(self, update_id: int) -> bool:
+		now = time.time()
+		try:
+			with self.lock:
+				cur = self.db.execute("INSERT OR IGNORE INTO updates (update_id, seen) VALUES (?, ?)", (update_id, now))
+				if now - self.pruned >= PRUNE_EVERY_SEC:
+					self.pruned = now
+					self.db.execute("DELETE FROM updates WHERE seen < ?", (now - UPDATE_RETAIN_SEC,))
+			return cur.rowcount == 1
+		except sqlite3.Error:
+			# better to answer twice than to drop the update
+			logging.warning("chat state: claim_update failed", exc_info=True)
+			return True
+
+	def first_greeting(self, chat_id: int) -> bool:
+		if chat_id in self.greeted:
+			return False
+		try:
+			with self.lock:
+				cur = self.db.execute("INSERT OR IGNORE INTO greeted (chat_id, at) VALUES (?, ?)", (chat_id, time.time()))
+		except sqlite3.Error:
+			logging.warning("chat state: first_greeting failed", exc_info=True)
+			self.greeted.add(chat_id)
+			return True
+		self.greeted.add(chat_id)
+		return cur.rowcount == 1
@@ -0,0 +1,78 @@
+import re
+
+WORD_RE = re.compile(r"\w+", re.U)
+
+# Bottom-k sketch: the K smallest hashes of a paragraph's word 2-shingles. Paragraphs that share one of
+# their first BUCKETS hashes are compared, and the sketch of their union estimates Jaccard similarity.
+# Everything heavy is a set/sort in C, so a few hundred KB of text takes milliseconds.
+K = 32
+BUCKETS = 4
+# a very common word pair can put many paragraphs in one bucket; compare against at most this many
+MAX_CANDIDATES = 64
+
+
+def _sketch(words: list[str]) -> list[int]:
+	return sorted({hash(p) for p in zip(words, words[1:])})[:K]
+
+def _similarity(a: list[int], b: list[int]) -> float:
+	sa, sb = set(a), set(b)
+	union = sorted(sa | sb)[:K]
+	return sum(1 for h in union if h in sa and h in sb) / len(union)
+
+
+class Deduper:
+	# Drops paragraphs (lines) that repeat, exactly or nearly, something already seen for this query,
+	# and whole pages once most of their text turned out to be copies.
+	def __init__(self, threshold: float = 0.7, page_threshold: float = 0.8):
+		self.threshold = threshold
+		self.page_threshold = page_threshold
+		self.exact: set[str] = set()
+		self.sketches: list[list[int]] = []
+		self.buckets: dict[int, list[int]] = {}
+		self.paragraphs = 0
+		self.dropped_paragraphs = 0
+		self.dropped_pages = 0
+		self.dropped: list[str] = []
+
+	def _seen(self, line: str) -> bool:
+		words = WORD_RE.findall(line.lower())
+		key = " ".join(words)
+		if key in self.exact:
+			return True
+		self.exact.add(key)
+		if len(words) < 4:
+			return False
+		sk = _sketch(words)
+		cands = set()
+		for h in sk[:BUCKETS]:
+			cands.update(self.buckets.get(h, ()))
+		for c in sorted(cands)[:MAX_CANDIDATES]:
+			if _similarity(sk, self.sketches[c]) >= self.threshold:
+				return True
+		idx = len(self.sketches)
+		self.sketches.append(sk)
+		for h in sk[:BUCKETS]:
+			self.buckets.setdefault(h, []).append(idx)
+		return False
+
+	def filter(self, text: str) -> str:
+		kept = []
+		gone = []
+		for line in (text or "").splitlines():
+			if not line.strip():
+				continue
+			self.paragraphs += 1
+			(gone if self._seen(line) else kept).append(line)
+		self.dropped_paragraphs += len(gone)
+		self.dropped.extend(gone)
+		gone_chars = sum(len(x) for x in gone)
+		total = gone_chars + sum(len(x) for x in kept)
+		if total and gone_chars >= self.page_threshold * total:
+			# a mirror with a few lines of its own: the leftovers are mostly chrome, drop them too
+			self.dropped_pages += 1
+			self.dropped.extend(kept)
+			return ""
+		return "\n".join(kept)
+
+	def dropped_text(self) -> str:
+		return "\n".join(self.dropped)
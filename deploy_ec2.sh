@@ -58,7 +58,12 @@ WorkingDirectory=$APP_DIR
 Environment=PYTHONUNBUFFERED=1
 Environment=PHANTOM_PATH=$PHANTOM_PATH
 Environment=PATH=/usr/local/go/bin:/usr/bin:/bin
+# tiktoken keeps its BPE files under /tmp by default, so they were downloaded again after every reboot
+Environment=TIKTOKEN_CACHE_DIR=$APP_DIR/.tiktoken_cache
 ExecStart=$VENV_DIR/bin/python $APP_DIR/main.py
+# with WEB_WORKERS > 1 in .env main.py supervises the workers itself: stop signals go to it alone
+KillMode=mixed
+TimeoutStopSec=30
 Restart=always
 RestartSec=5
 
@@ -0,0 +1,52 @@
+import time, asyncio, logging, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from metrics import STAGE_SECONDS
+
+
+def _extract(body: bytes) -> tuple[str, float]:
+	# bs4/lxml are only loaded where extraction runs: the workers, or this process when the pool is off
+	from html_text import timed_strip_html_to_text
+	return timed_strip_html_to_text(body)
+
+
+class ExtractPool:
+	def __init__(self, workers: int, max_pending: int):
+		self.workers = max(0, workers)
+		self.sem = asyncio.Semaphore(max(1, max_pending))
+		self.executor: ProcessPoolExecutor | None = None
+		self.pending = 0
+
+	async def start(self) -> None:
+		if self.workers <= 0:
+			logging.info("extract pool disabled, extracting inline")
+			return
+		# spawn, not fork: the parent runs an event loop and helper threads
+		self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+		loop = asyncio.get_running_loop()
+		await asyncio.gather(*[loop.run_in_executor(self.executor, _extract, b"<html></html>") for _ in range(self.workers)])
+		logging.info("extract pool started: workers=%d", self.workers)
+
+	async def close(self) -> None:
+		if self.executor is not None:
+			ex = self.executor
+			self.executor = None
+			await asyncio.to_thread(ex.shutdown, True, cancel_futures=True)
+
+	async def extract(self, body: bytes, label: str = "") -> str:
+		self.pending += 1
+		t0 = time.monotonic()
+		try:
+			async with self.sem:
+				if self.executor is None:
+					text, cpu = _extract(body)
+				else:
+					text, cpu = await asyncio.get_running_loop().run_in_executor(self.executor, _extract, body)
+		finally:
+			self.pending -= 1
+		wall = time.monotonic() - t0
+		STAGE_SECONDS.labels("extract").observe(wall)
+		logging.info(
+			"extract %s bytes=%d cpu_ms=%.1f wall_ms=%.1f queue=%d",
+			label, len(body), cpu * 1000, wall * 1000, self.pending
+		)
+		return text
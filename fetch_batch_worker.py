@@ -1,54 +1,152 @@
-import sys, json, base64, asyncio
+import os, sys, json, asyncio
+from urllib.parse import urlsplit
 from tls_browser import TlsBrowser
+from host_stats import HostStats, STATS_PATH
+from membudget import MemBudget
+from fetch_proto import write_frame, STATUS_CODES, STATUS_DONE
 
-async def run(cfg: dict) -> None:
+HEADERS = {
+	"accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+	"accept-language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+UA = "Mozilla/5.0"
+PER_HOST = int(os.getenv("FETCH_PER_HOST") or 6)
+# skip certificate checks; only for local stubs with self-signed certificates (bench.py replay --https)
+INSECURE = (os.getenv("FETCH_INSECURE") or "0") == "1"
+
+OUT = sys.stdout.buffer
+# budget bytes of bodies handed over through a file, held until the app reports the file taken
+SHM_HELD: dict[str, int] = {}
+
+def record_result(stats: HostStats, host: str, status: str, res: dict | None, timeout: float) -> None:
+	# only a request that went out is a sample; a link skipped before any request (by its extension) is not
+	if status == "timeout":
+		stats.record(host, False, timeout * 1000.0)
+	elif status == "fail":
+		stats.record(host, False, 0.0)
+	elif res and res.get("status") is not None and res.get("elapsed_ms") is not None:
+		# error pages and challenges answer fast but are a failure as far as we are concerned
+		http = res["status"]
+		stats.record(host, not (isinstance(http, int) and http >= 400), res["elapsed_ms"])
+
+async def run_job(browser: TlsBrowser, stats: HostStats | None, cfg: dict) -> None:
+	budget = browser.budget
+	qid = cfg.get("id")
 	urls = cfg.get("urls") or []
-	concurrency = int(cfg.get("concurrency") or 10)
 	per_url_timeout = int(cfg.get("per_url_timeout") or 6)
 	max_bytes = int(cfg.get("max_bytes") or 16777216)
-	headers = {
-		"accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-		"accept-language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-	}
-	ua = "Mozilla/5.0"
-	sem = asyncio.Semaphore(concurrency)
+	validators = cfg.get("validators") or {}
 
-	async with TlsBrowser(user_agent=ua, proxy=None) as browser:
-		async def one(i: int, url: str) -> None:
-			async with sem:
-				status = "ok"
-				final_url = url
+	async def one(i: int, url: str) -> None:
+		status = "ok"
+		final_url = url
+		body = b""
+		meta = {}
+		headers = HEADERS
+		cond = validators.get(str(i)) or {}
+		if cond.get("etag") or cond.get("last_modified"):
+			headers = dict(HEADERS)
+			if cond.get("etag"):
+				headers["if-none-match"] = cond["etag"]
+			if cond.get("last_modified"):
+				headers["if-modified-since"] = cond["last_modified"]
+		host = (urlsplit(url).hostname or "").lower()
+		timeout = per_url_timeout
+		res = None
+		held = 0
+		if stats is not None:
+			if stats.is_open(host):
+				write_frame(OUT, qid, i, STATUS_CODES["skipped"], url, url, b"", {"skipped": "circuit"})
+				return
+			timeout = stats.timeout_for(host, per_url_timeout)
+		try:
+			# the deadline starts once the browser has a slot for this host, not while queued behind others
+			res = await browser.get(url, headers=headers, timeout=timeout, follow=True, max_bytes=max_bytes)
+			held = (res or {}).get("reserved") or 0
+			final_url = (res or {}).get("url") or url
+			content_val = (res or {}).get("content")
+			body = content_val if isinstance(content_val, (bytes, bytearray)) else (bytes(content_val or b"") if content_val is not None else b"")
+			resp_headers = (res or {}).get("headers") or {}
+			meta = {"etag": resp_headers.get("etag") or "", "last_modified": resp_headers.get("last-modified") or "", "raw_bytes": (res or {}).get("raw_bytes") or 0}
+			if (res or {}).get("skipped"):
+				status = "skipped"
+				meta = {"skipped": res["skipped"], "content_type": resp_headers.get("content-type") or ""}
+			elif (res or {}).get("status") == 304:
+				status = "not_modified"
 				body = b""
-				try:
-					res = await asyncio.wait_for(
-						browser.get(url, headers=headers, timeout=per_url_timeout, follow=True, max_bytes=max_bytes),
-						timeout=per_url_timeout + 1,
-					)
-					final_url = (res or {}).get("url") or url
-					content_val = (res or {}).get("content")
-					body = content_val if isinstance(content_val, (bytes, bytearray)) else (bytes(content_val or b"") if content_val is not None else b"")
-				except asyncio.TimeoutError:
-					status = "timeout"
-				except Exception:
-					status = "fail"
-				content_b64 = base64.b64encode(body).decode("ascii") if body else ""
-				header = {
-					"i": i,
-					"url": url,
-					"final_url": final_url,
-					"status": status,
-					"content_len": len(content_b64),
-				}
-				print(json.dumps(header), flush=True)
-				if content_b64:
-					sys.stdout.write(content_b64 + "\n")
-					sys.stdout.flush()
+		except asyncio.TimeoutError:
+			status = "timeout"
+		except Exception as e:
+			# tls_client reports its own deadline as a generic error
+			msg = str(e).lower()
+			status = "timeout" if "timeout" in msg or "deadline exceeded" in msg else "fail"
+		if stats is not None:
+			record_result(stats, host, status, res, timeout)
+		shm = ""
+		try:
+			shm = write_frame(OUT, qid, i, STATUS_CODES[status], url, final_url, body, meta)
+		finally:
+			# once framed the body is the app process's to account for; a body in a file still takes
+			# memory (/dev/shm) until the app has read it
+			if held and shm:
+				SHM_HELD[shm] = held
+			elif held:
+				budget.release(held)
+	try:
 		await asyncio.gather(*[one(i, u) for i, u in enumerate(urls)])
+	finally:
+		if stats is not None:
+			stats.flush()
+	# the done frame carries this worker's memory budget figures for monitoring
+	write_frame(OUT, qid, 0, STATUS_DONE, meta={"mem": budget.stats()} if budget is not None else None)
+
+async def serve(concurrency: int, mem_budget: int = 0) -> None:
+	# One job per stdin line: {"id": ..., "urls": [...], "validators": {"<i>": {...}}} starts a job, {"id": ..., "cancel": true} aborts it,
+	# {"shm_taken": path} says the app has read a body file.
+	# Results are tagged with the job id so several queries can share one long-lived process.
+	loop = asyncio.get_running_loop()
+	reader = asyncio.StreamReader(limit=1 << 24)
+	await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+	jobs: dict = {}
+	stats = None
+	if STATS_PATH:
+		try:
+			stats = HostStats(STATS_PATH)
+		except Exception as e:
+			sys.stderr.write(f"host stats disabled: {e}\n")
+	budget = MemBudget(mem_budget) if mem_budget > 0 else None
+	async with TlsBrowser(user_agent=UA, proxy=None, concurrency=concurrency, per_host=PER_HOST, insecure=INSECURE, budget=budget) as browser:
+		while True:
+			line = await reader.readline()
+			if not line:
+				break
+			try:
+				cfg = json.loads(line.decode("utf-8", errors="ignore"))
+			except Exception:
+				continue
+			if cfg.get("shm_taken"):
+				n = SHM_HELD.pop(cfg["shm_taken"], 0)
+				if n and budget is not None:
+					budget.release(n)
+				continue
+			qid = cfg.get("id")
+			if cfg.get("cancel"):
+				task = jobs.pop(qid, None)
+				if task:
+					task.cancel()
+				continue
+			task = asyncio.create_task(run_job(browser, stats, cfg))
+			jobs[qid] = task
+			task.add_done_callback(lambda t, q=qid: jobs.pop(q, None) if jobs.get(q) is t else None)
+		if jobs:
+			await asyncio.gather(*jobs.values(), return_exceptions=True)
+	if stats is not None:
+		stats.close()
 
 if __name__ == "__main__":
-	cfg_text = sys.stdin.read()
 	try:
-		cfg = json.loads(cfg_text)
+		concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+		mem_budget = int(sys.argv[2]) if len(sys.argv) > 2 else 0
 	except Exception:
 		sys.exit(2)
-	asyncio.run(run(cfg))
+	asyncio.run(serve(concurrency, mem_budget))
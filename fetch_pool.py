@@ -0,0 +1,230 @@
+import os, sys, json, time, asyncio, itertools, logging
+from fetch_proto import read_frame, shm_cleanup
+from membudget import MemBudget, MEM_EXTRACT_FACTOR
+
+WORKER_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "fetch_batch_worker.py"))
+# A worker that dies before its first frame is restarted after a delay that doubles with each such crash in
+# a row; after RESTART_LIMIT of them the pool stops restarting and submit() fails
+RESTART_DELAY_SEC = 0.5
+RESTART_MAX_DELAY_SEC = 30
+RESTART_LIMIT = 8
+
+
+class FetchJob:
+	def __init__(self, pool: "FetchPool", worker: "_Worker", qid: int):
+		self.pool = pool
+		self.worker = worker
+		self.qid = qid
+		self.queue: asyncio.Queue = asyncio.Queue()
+		self.done = False
+
+	async def next(self) -> dict | None:
+		if self.done:
+			return None
+		row = await self.queue.get()
+		if row is None:
+			self.done = True
+		return row
+
+	async def cancel(self) -> None:
+		# rows nobody will read give their reserved bytes back
+		while not self.queue.empty():
+			row = self.queue.get_nowait()
+			if row is not None:
+				self.pool.release(row)
+		if self.done:
+			return
+		self.done = True
+		if self.worker.jobs.pop(self.qid, None) is not None:
+			await self.worker.send({"id": self.qid, "cancel": True})
+			self.pool._job_finished(self.worker)
+
+
+class _Worker:
+	def __init__(self, proc: asyncio.subprocess.Process):
+		self.proc = proc
+		self.jobs: dict[int, FetchJob] = {}
+		self.started = 0
+		self.retiring = False
+		# has sent a frame, i.e. got past loading tls_client
+		self.healthy = False
+		self.reader: asyncio.Task | None = None
+		# memory budget figures from the worker's last done frame
+		self.mem: dict = {}
+
+	@property
+	def alive(self) -> bool:
+		return self.proc.returncode is None and not self.proc.stdout.at_eof()
+
+	async def send(self, msg: dict) -> None:
+		try:
+			self.proc.stdin.write((json.dumps(msg) + "\n").encode("utf-8"))
+			await self.proc.stdin.drain()
+		except Exception:
+			logging.warning("fetch worker pid=%s stdin write failed", self.proc.pid)
+
+
+class FetchPool:
+	# budget: bytes of bodies read from the workers and not yet released by their consumer, reserved before
+	# a frame's body is read, so a full budget stalls the pipe. worker_mem: each worker's own budget.
+	def __init__(self, size: int, concurrency: int, max_jobs: int, budget: MemBudget | None = None, worker_mem: int = 0):
+		self.size = max(1, size)
+		self.concurrency = max(1, concurrency)
+		self.max_jobs = max(1, max_jobs)
+		self.budget = budget
+		self.worker_mem = max(0, int(worker_mem))
+		self.workers: list[_Worker] = []
+		self.ids = itertools.count(1)
+		self.closed = False
+		self.lock = asyncio.Lock()
+		self.crashes = 0
+		self.restart_at = 0.0
+		self.broken = False
+
+	async def start(self) -> None:
+		for _ in range(self.size):
+			await self._spawn()
+		logging.info("fetch pool started: workers=%d concurrency=%d max_jobs=%d", self.size, self.concurrency, self.max_jobs)
+
+	async def ping(self) -> None:
+		# an empty job per worker: its done frame means the process is up and tls_client is loaded
+		jobs = []
+		async with self.lock:
+			for w in self.workers:
+				job = FetchJob(self, w, next(self.ids))
+				w.jobs[job.qid] = job
+				jobs.append(job)
+		for job in jobs:
+			await job.worker.send({"id": job.qid, "urls": []})
+		await asyncio.gather(*[job.next() for job in jobs])
+
+	async def close(self) -> None:
+		self.closed = True
+		for w in list(self.workers):
+			await self._stop(w)
+		self.workers.clear()
+
+	async def submit(self, urls: list[str], per_url_timeout: int, max_bytes: int, validators: dict | None = None) -> FetchJob:
+		async with self.lock:
+			w = await self._pick()
+			qid = next(self.ids)
+			job = FetchJob(self, w, qid)
+			w.jobs[qid] = job
+			w.started += 1
+			if w.started >= self.max_jobs and not w.retiring:
+				w.retiring = True
+				self.workers.remove(w)
+				await self._spawn()
+		await w.send({"id": qid, "urls": urls, "per_url_timeout": per_url_timeout, "max_bytes": max_bytes, "validators": validators or {}})
+		return job
+
+	def release(self, row: dict) -> None:
+		if self.budget is not None and row.get("mem"):
+			self.budget.release(row["mem"])
+			row["mem"] = 0
+
+	def _reserve(self, body_len: int):
+		return self.budget.acquire(body_len * MEM_EXTRACT_FACTOR)
+
+	def mem_stats(self) -> dict:
+		# sums over the live workers; their peaks are each worker's own, so the sum is an upper bound
+		rows = [w.mem for w in self.workers if w.mem]
+		return {k: sum(r.get(k) or 0 for r in rows) for k in ("limit", "used", "peak", "waits")}
+
+	async def _pick(self) -> _Worker:
+		if self.broken:
+			raise RuntimeError(f"fetch workers crashed {self.crashes} times in a row at startup, not restarting")
+		for w in [w for w in self.workers if not w.alive]:
+			self.workers.remove(w)
+		if time.monotonic() >= self.restart_at:
+			while len(self.workers) < self.size:
+				await self._spawn()
+		if not self.workers:
+			raise RuntimeError("fetch workers are restarting after crashes")
+		return min(self.workers, key=lambda w: len(w.jobs))
+
+	async def _spawn(self) -> _Worker:
+		proc = await asyncio.create_subprocess_exec(
+			sys.executable, "-u", WORKER_PATH, str(self.concurrency), str(self.worker_mem),
+			stdin=asyncio.subprocess.PIPE,
+			stdout=asyncio.subprocess.PIPE,
+			limit=1 << 20,
+		)
+		w = _Worker(proc)
+		w.reader = asyncio.create_task(self._read(w))
+		self.workers.append(w)
+		return w
+
+	async def _stop(self, w: _Worker) -> None:
+		try:
+			if w.proc.stdin and not w.proc.stdin.is_closing():
+				w.proc.stdin.close()
+			await asyncio.wait_for(w.proc.wait(), timeout=2)
+		except Exception:
+			try:
+				w.proc.kill()
+			except Exception:
+				pass
+
+	def _job_finished(self, w: _Worker) -> None:
+		if w.retiring and not w.jobs and w.proc.stdin and not w.proc.stdin.is_closing():
+			# Let the retiring worker exit once its last job is gone
+			w.proc.stdin.close()
+
+	async def _read(self, w: _Worker) -> None:
+		stdout = w.proc.stdout
+		try:
+			while True:
+				row = await read_frame(stdout, self._reserve if self.budget is not None else None)
+				if row is None:
+					break
+				if not w.healthy:
+					w.healthy = True
+					self.crashes = 0
+				if row["shm"] and not w.proc.stdin.is_closing():
+					await w.send({"shm_taken": row["shm"]})
+				if row["status"] == "done":
+					w.mem = row["meta"].get("mem") or w.mem
+				job = w.jobs.get(row["q"])
+				if job is None or job.done:
+					self.release(row)
+					continue
+				if row["status"] == "done":
+					w.jobs.pop(job.qid, None)
+					job.queue.put_nowait(None)
+					self._job_finished(w)
+					continue
+				job.queue.put_nowait(row)
+		except Exception:
+			logging.exception("fetch worker pid=%s reader failed", w.proc.pid)
+		finally:
+			for job in list(w.jobs.values()):
+				job.queue.put_nowait(None)
+			w.jobs.clear()
+			if w.proc.returncode is None and not w.retiring:
+				try:
+					w.proc.kill()
+				except Exception:
+					pass
+			rc = await w.proc.wait()
+			shm_cleanup(w.proc.pid)
+			if w in self.workers:
+				self.workers.remove(w)
+				if not self.closed:
+					if not w.healthy:
+						self.crashes += 1
+						if self.crashes >= RESTART_LIMIT:
+							self.broken = True
+							logging.error("fetch worker pid=%s exited rc=%s before its first frame, %d times in a row; not restarting", w.proc.pid, rc, self.crashes)
+							return
+						delay = min(RESTART_MAX_DELAY_SEC, RESTART_DELAY_SEC * 2 ** (self.crashes - 1))
+						logging.error("fetch worker pid=%s exited rc=%s before its first frame (%d in a row), restarting in %.1fs", w.proc.pid, rc, self.crashes, delay)
+						self.restart_at = time.monotonic() + delay
+						await asyncio.sleep(delay)
+						if self.closed:
+							return
+					else:
+						logging.warning("fetch worker pid=%s exited rc=%s, restarting", w.proc.pid, rc)
+					async with self.lock:
+						if len(self.workers) < self.size:
+							await self._spawn()
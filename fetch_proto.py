@@ -0,0 +1,119 @@
+import os, glob, json, mmap, struct, itertools, asyncio
+
+# Worker -> main frame: fixed little-endian header followed by url, final_url, meta and payload bytes.
+# qid, index, status, flags, url_len, final_url_len, meta_len, payload_len, body_len
+FRAME = struct.Struct("<IIBBHHHII")
+
+STATUS_OK = 0
+STATUS_TIMEOUT = 1
+STATUS_FAIL = 2
+STATUS_DONE = 3
+STATUS_NOT_MODIFIED = 4
+STATUS_SKIPPED = 5
+STATUS_NAMES = {STATUS_OK: "ok", STATUS_TIMEOUT: "timeout", STATUS_FAIL: "fail", STATUS_DONE: "done", STATUS_NOT_MODIFIED: "not_modified", STATUS_SKIPPED: "skipped"}
+STATUS_CODES = {v: k for k, v in STATUS_NAMES.items()}
+
+# Payload is a path to a file holding the body instead of the body itself
+FLAG_SHM = 1
+
+SHM_DIR = os.getenv("FETCH_SHM_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else "")
+SHM_THRESHOLD = int(os.getenv("FETCH_SHM_THRESHOLD") or 1048576)
+SHM_PREFIX = "leads-fetch-"
+
+_shm_seq = itertools.count()
+
+
+def _shm_put(body) -> bytes:
+	path = os.path.join(SHM_DIR, f"{SHM_PREFIX}{os.getpid()}-{next(_shm_seq)}")
+	fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+	try:
+		view = memoryview(body)
+		while view:
+			view = view[os.write(fd, view):]
+	finally:
+		os.close(fd)
+	return path.encode("utf-8")
+
+def _shm_take(path: str, size: int) -> bytes:
+	try:
+		if size <= 0:
+			return b""
+		with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			return mm[:size]
+	except Exception:
+		return b""
+	finally:
+		try:
+			os.unlink(path)
+		except Exception:
+			pass
+
+def shm_cleanup(pid: int) -> None:
+	if not SHM_DIR:
+		return
+	for path in glob.glob(os.path.join(SHM_DIR, f"{SHM_PREFIX}{pid}-*")):
+		try:
+			os.unlink(path)
+		except Exception:
+			pass
+
+def write_frame(out, qid: int, i: int, status: int, url: str = "", final_url: str = "", body=b"", meta: dict | None = None) -> str:
+	# returns the path when the body went through a file, "" otherwise
+	u = url.encode("utf-8")[:0xFFFF]
+	fu = final_url.encode("utf-8")[:0xFFFF]
+	m = json.dumps(meta).encode("utf-8") if meta else b""
+	if len(m) > 0xFFFF:
+		m = b""
+	flags = 0
+	payload = body
+	shm = ""
+	if SHM_DIR and SHM_THRESHOLD > 0 and len(body) >= SHM_THRESHOLD:
+		try:
+			payload = _shm_put(body)
+			flags |= FLAG_SHM
+			shm = payload.decode("utf-8")
+		except Exception:
+			payload = body
+	out.write(FRAME.pack(qid or 0, i, status, flags, len(u), len(fu), len(m), len(payload), len(body)))
+	out.write(u)
+	out.write(fu)
+	out.write(m)
+	if payload:
+		out.write(payload)
+	out.flush()
+	return shm
+
+async def read_frame(reader: asyncio.StreamReader, reserve=None) -> dict | None:
+	# reserve: async fn(body_len) -> bytes reserved, awaited before the body is read; the row's "mem".
+	# The row's "shm" is the path the body was taken from, "" when it came through the pipe.
+	try:
+		head = await reader.readexactly(FRAME.size)
+	except asyncio.IncompleteReadError:
+		return None
+	qid, i, status, flags, url_len, final_len, meta_len, payload_len, body_len = FRAME.unpack(head)
+	rest = await reader.readexactly(url_len + final_len + meta_len)
+	url = rest[:url_len].decode("utf-8", errors="ignore")
+	final_url = rest[url_len:url_len + final_len].decode("utf-8", errors="ignore") or url
+	meta = {}
+	if meta_len:
+		try:
+			meta = json.loads(rest[url_len + final_len:])
+		except Exception:
+			meta = {}
+	mem = await reserve(body_len) if reserve is not None and body_len else 0
+	body = await reader.readexactly(payload_len) if payload_len else b""
+	shm = ""
+	if flags & FLAG_SHM:
+		shm = body.decode("utf-8", errors="ignore")
+		body = await asyncio.to_thread(_shm_take, shm, body_len)
+	return {
+		"q": qid,
+		"i": i,
+		"url": url,
+		"final_url": final_url,
+		"status": STATUS_NAMES.get(status, "fail"),
+		"meta": meta,
+		"body": body,
+		"mem": mem,
+		"shm": shm,
+	}
@@ -0,0 +1,126 @@
+import os, time, sqlite3, threading, logging
+
+# Shared by the fetch workers and main; empty disables adaptive timeouts, the circuit breaker and hedging hints
+STATS_PATH = os.getenv("FETCH_HOST_STATS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "host_stats.sqlite3"))
+
+# EWMA weight of the newest sample
+ALPHA = 0.2
+# Consecutive failures that open a host's circuit, and how long it stays open (doubling per reopen, capped)
+BREAKER_FAILS = 3
+BREAKER_OPEN_SEC = 300
+BREAKER_MAX_OPEN_SEC = 6 * 3600
+# Timeout = mean + DEV_MULT * mean deviation, rounded up to whole seconds so that tls_client keeps
+# only a handful of native sessions (it has one per distinct timeout)
+DEV_MULT = 4
+MIN_TIMEOUT_SEC = 2
+# Rows written by other fetch workers are picked up after this long
+REFRESH_SEC = 5
+RETAIN_SEC = 30 * 86400
+
+
+class HostStats:
+	# Per-host latency and failure record in a small SQLite file shared by all fetch workers.
+	# Reads come from an in-process copy; updates are buffered and written by flush(). Blocking: the web
+	# worker calls it through asyncio.to_thread, so the connection may be used from any thread.
+	def __init__(self, path: str):
+		self.db = sqlite3.connect(path, isolation_level=None, timeout=1, check_same_thread=False)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("PRAGMA synchronous=NORMAL")
+		self.db.execute(
+			"CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, ewma_ms REAL NOT NULL, dev_ms REAL NOT NULL,"
+			" samples INTEGER NOT NULL, fails INTEGER NOT NULL, opens INTEGER NOT NULL, open_until REAL NOT NULL, updated REAL NOT NULL)"
+		)
+		self.db.execute("DELETE FROM hosts WHERE updated < ?", (time.time() - RETAIN_SEC,))
+		self.rows: dict[str, list] = {}
+		self.loaded: dict[str, float] = {}
+		self.dirty: set[str] = set()
+		self.lock = threading.Lock()
+
+	def close(self) -> None:
+		self.flush()
+		self.db.close()
+
+	def _row(self, host: str) -> list:
+		# [ewma_ms, dev_ms, samples, fails, opens, open_until]
+		now = time.monotonic()
+		if host not in self.dirty and now - self.loaded.get(host, -REFRESH_SEC) >= REFRESH_SEC:
+			r = self.db.execute("SELECT ewma_ms, dev_ms, samples, fails, opens, open_until FROM hosts WHERE host = ?", (host,)).fetchone()
+			self.rows[host] = list(r) if r else [0.0, 0.0, 0, 0, 0, 0.0]
+			self.loaded[host] = now
+		return self.rows[host]
+
+	def is_open(self, host: str) -> bool:
+		return self._row(host)[5] > time.time()
+
+	def timeout_for(self, host: str, default: int) -> int:
+		ewma, dev, samples = self._row(host)[:3]
+		if samples < 3:
+			return default
+		t = (ewma + DEV_MULT * dev) / 1000.0
+		return int(min(default, max(MIN_TIMEOUT_SEC, -(-t // 1))))
+
+	def p_slow_ms(self, host: str) -> float:
+		# rough upper tail of this host's latency, 0 when unknown
+		ewma, dev, samples = self._row(host)[:3]
+		return ewma + 2 * dev if samples >= 3 else 0.0
+
+	def p_slow_many(self, hosts: list[str]) -> dict[str, float]:
+		# p_slow_ms for several hosts, reading the ones not loaded recently in a single query
+		now = time.monotonic()
+		with self.lock:
+			want = [h for h in set(hosts) if h not in self.dirty and now - self.loaded.get(h, -REFRESH_SEC) >= REFRESH_SEC]
+			if want:
+				found = {}
+				try:
+					found = {r[0]: list(r[1:]) for r in self.db.execute(
+						f"SELECT host, ewma_ms, dev_ms, samples, fails, opens, open_until FROM hosts WHERE host IN ({','.join('?' * len(want))})", want,
+					)}
+				except sqlite3.Error:
+					logging.warning("host stats read failed", exc_info=True)
+				for h in want:
+					self.rows[h] = found.get(h) or [0.0, 0.0, 0, 0, 0, 0.0]
+					self.loaded[h] = now
+			return {h: self.p_slow_ms(h) for h in hosts}
+
+	def record(self, host: str, ok: bool, latency_ms: float) -> None:
+		r = self._row(host)
+		if ok:
+			if r[2] == 0:
+				r[0], r[1] = latency_ms, latency_ms / 2
+			else:
+				r[1] = (1 - ALPHA) * r[1] + ALPHA * abs(latency_ms - r[0])
+				r[0] = (1 - ALPHA) * r[0] + ALPHA * latency_ms
+			r[2] += 1
+			r[3] = 0
+		else:
+			if latency_ms > 0 and r[2]:
+				# a timeout is a latency sample too, so the next adaptive timeout widens
+				r[1] = (1 - ALPHA) * r[1] + ALPHA * abs(latency_ms - r[0])
+				r[0] = (1 - ALPHA) * r[0] + ALPHA * latency_ms
+			r[3] += 1
+			if r[3] >= BREAKER_FAILS and r[5] <= time.time():
+				# a host that fails again right after its circuit half-opens is shut out for longer
+				open_sec = min(BREAKER_MAX_OPEN_SEC, BREAKER_OPEN_SEC * (2 ** r[4]))
+				r[4] += 1
+				r[5] = time.time() + open_sec
+				logging.info("host circuit open: %s fails=%d for %ds", host, r[3], open_sec)
+		if ok:
+			r[4] = 0
+		self.dirty.add(host)
+
+	def flush(self) -> None:
+		if not self.dirty:
+			return
+		now = time.time()
+		rows = [(h, *self.rows[h], now) for h in self.dirty]
+		self.dirty.clear()
+		try:
+			self.db.executemany(
+				"INSERT OR REPLACE INTO hosts (host, ewma_ms, dev_ms, samples, fails, opens, open_until, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				rows,
+			)
+		except sqlite3.Error:
+			logging.warning("host stats flush failed", exc_info=True)
+		mono = time.monotonic()
+		for h, *_ in rows:
+			self.loaded[h] = mono
@@ -0,0 +1,124 @@
+import os, re, time
+from bs4 import BeautifulSoup, Comment
+from lxml import html as lxml_html
+from lxml.etree import ParserError
+
+HTML_EXTRACTOR = (os.getenv("HTML_EXTRACTOR") or "bs4").lower()
+
+DROP_TAGS = ["script", "style", "noscript", "svg", "picture", "source", "template", "iframe"]
+DROP_SELECTORS = ["header", "footer", "nav", "aside", "form", "menu"]
+PRUNE_TAGS = frozenset(DROP_TAGS + DROP_SELECTORS)
+
+RM_RE = re.compile(r"(nav|menu|breadcrumb|footer|header|social|subscribe|comment|related|sidebar|cookie|banner|ad|promo|partner|catalog|search|rating|license|policy)", re.I)
+WS_RE = re.compile(r"\s+")
+EMAIL_RE = re.compile(r"[\w\.-]+@[\w\.-]+\.[A-Za-zА-Яа-я]{2,}")
+PHONE_RE = re.compile(r"\+?\d[\d\-\s\(\)]{8,}\d")
+DROP_RE = re.compile(r"^(Поиск|Главное|Новости|Публикации|Интервью|Спецпроекты|Подкасты|Афиша|RSS-новости|Рейтинги|Категории|Каталог|Кейсы|Ещё|Maps|Market|Contacts|Контакты|Мы в социальных сетях:|Подписывайтесь|Мы на связи|На главную|Этот сайт использует cookie|Политика конфиденциальности|Пользовательское соглашение|Положение об обработке персональных данных|Согласие на обработку персональных данных|©|Telegram|ВКонтакте|Одноклассники|Rutube|Все рейтинги|Лидеры рейтингов|Календарь событий)\b", re.I)
+CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w\-]+)""", re.I)
+
+
+def _filter_lines(text: str) -> str:
+	kept = []
+	seen = set()
+	for ln in text.splitlines():
+		ln = WS_RE.sub(" ", ln).strip()
+		if not ln:
+			continue
+		key = ln.lower()
+		if key in seen:
+			continue
+		seen.add(key)
+		if DROP_RE.search(ln):
+			continue
+		if len(ln.split()) < 3 and not (EMAIL_RE.search(ln) or PHONE_RE.search(ln)):
+			continue
+		kept.append(ln)
+	return "\n".join(kept)
+
+def _bs4_text(html_bytes: bytes) -> str:
+	soup = BeautifulSoup(html_bytes, "lxml")
+	for t in soup(DROP_TAGS):
+		t.decompose()
+	for sel in DROP_SELECTORS:
+		for t in soup.select(sel):
+			t.decompose()
+	for c in soup.find_all(string=lambda s: isinstance(s, Comment)):
+		c.extract()
+	for t in soup.find_all(True):
+		try:
+			attrs = getattr(t, 'attrs', None)
+			if not isinstance(attrs, dict):
+				continue
+			id_val = attrs.get('id')
+			classes = attrs.get('class') or []
+			if isinstance(classes, str):
+				classes = [classes]
+			ident = " ".join([
+				str(id_val or ""),
+				" ".join([str(c) for c in classes])
+			]).strip()
+			if ident and RM_RE.search(ident):
+				t.decompose()
+		except Exception:
+			continue
+	return (soup.body or soup).get_text(separator="\n")
+
+def _sniff_charset(html_bytes: bytes) -> str | None:
+	if html_bytes.startswith(b"\xef\xbb\xbf"):
+		return "utf-8"
+	m = CHARSET_RE.search(html_bytes[:4096])
+	if m:
+		return m.group(1).decode("ascii", errors="ignore").lower()
+	try:
+		html_bytes.decode("utf-8")
+		return "utf-8"
+	except UnicodeDecodeError:
+		return "windows-1251"
+
+def _pruned(el) -> bool:
+	if el.tag in PRUNE_TAGS:
+		return True
+	ident = " ".join([el.get("id") or "", " ".join((el.get("class") or "").split())]).strip()
+	return bool(ident) and RM_RE.search(ident) is not None
+
+def _lxml_text(html_bytes: bytes) -> str:
+	try:
+		parser = lxml_html.HTMLParser(remove_comments=True, remove_pis=True, encoding=_sniff_charset(html_bytes))
+		root = lxml_html.document_fromstring(html_bytes, parser=parser)
+	except LookupError:
+		root = lxml_html.document_fromstring(html_bytes, parser=lxml_html.HTMLParser(remove_comments=True, remove_pis=True))
+	body = root.find("body")
+	start = body if body is not None and not _pruned(body) and not _pruned(root) else root
+	if _pruned(start):
+		return ""
+	# one pass: text and tails in document order, skipping pruned subtrees but keeping their tails
+	out = []
+	stack = [start]
+	while stack:
+		item = stack.pop()
+		if isinstance(item, str):
+			out.append(item)
+			continue
+		if item.text and isinstance(item.tag, str):
+			out.append(item.text)
+		for ch in reversed(item):
+			if ch.tail:
+				stack.append(ch.tail)
+			if isinstance(ch.tag, str) and not _pruned(ch):
+				stack.append(ch)
+	return "\n".join(out)
+
+def strip_html_to_text(html_bytes: bytes, engine: str | None = None) -> str:
+	if (engine or HTML_EXTRACTOR) == "lxml":
+		try:
+			text = _lxml_text(html_bytes)
+		except ParserError:
+			return ""
+	else:
+		text = _bs4_text(html_bytes)
+	return _filter_lines(text)
+
+def timed_strip_html_to_text(html_bytes: bytes) -> tuple[str, float]:
+	t0 = time.perf_counter()
+	text = strip_html_to_text(html_bytes)
+	return text, time.perf_counter() - t0
@@ -0,0 +1,127 @@
+import json, time, asyncio, logging
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+
+class LlmError(Exception):
+	pass
+
+
+class LlmClient:
+	# OpenAI-compatible chat completions over one keep-alive session, streamed and cut at the first line
+	def __init__(self, base_url: str, api_key: str, model: str, concurrency: int, rpm: int, timeout: float):
+		self.url = base_url.rstrip("/") + "/chat/completions"
+		self.models_url = base_url.rstrip("/") + "/models"
+		self.api_key = api_key
+		self.model = model
+		self.timeout = timeout
+		self.sem = asyncio.Semaphore(max(1, concurrency))
+		self.interval = 60.0 / rpm if rpm > 0 else 0.0
+		self.next_slot = 0.0
+		self.slot_lock = asyncio.Lock()
+		self.session: ClientSession | None = None
+		self.draining: set[asyncio.Task] = set()
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb):
+		await self.close()
+
+	def _session(self) -> ClientSession:
+		if self.session is None or self.session.closed:
+			self.session = ClientSession(
+				connector=TCPConnector(limit=0, keepalive_timeout=120),
+				timeout=ClientTimeout(total=self.timeout),
+			)
+		return self.session
+
+	async def close(self) -> None:
+		for task in list(self.draining):
+			task.cancel()
+		if self.session is not None and not self.session.closed:
+			await self.session.close()
+		self.session = None
+
+	async def warm(self, timeout: float) -> None:
+		# a cheap authenticated call outside the rate limit: DNS, TCP and TLS are done and a keep-alive
+		# connection is left in the pool for the first completion
+		headers = {"authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+		async with self._session().get(self.models_url, headers=headers, timeout=ClientTimeout(total=timeout)) as resp:
+			await resp.read()
+
+	async def _throttle(self) -> None:
+		# spaces request starts at least 60/rpm seconds apart
+		if self.interval <= 0:
+			return
+		async with self.slot_lock:
+			now = time.monotonic()
+			wait = self.next_slot - now
+			self.next_slot = max(now, self.next_slot) + self.interval
+		if wait > 0:
+			await asyncio.sleep(wait)
+
+	async def _drain(self, resp) -> None:
+		# read the rest of the stream in the background so the connection goes back to the pool
+		try:
+			await resp.read()
+		except Exception:
+			pass
+		finally:
+			resp.release()
+
+	async def first_line(self, messages: list[dict], retries: int = 3, **params) -> str:
+		# generation stops at the end of the first line, so the rest is neither generated nor counted against
+		# the token rate limit; the stream then ends on its own and the connection is reused
+		payload = dict(params, model=self.model, messages=messages, stream=True)
+		payload.setdefault("stop", ["\n"])
+		headers = {"authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+		async with self.sem:
+			for attempt in range(retries):
+				await self._throttle()
+				resp = await self._session().post(self.url, json=payload, headers=headers)
+				if resp.status == 429:
+					try:
+						retry_after = float(resp.headers.get("retry-after") or 1)
+					except ValueError:
+						retry_after = 1.0
+					resp.release()
+					logging.warning("llm rate limited, retry_after=%.1fs attempt=%d", retry_after, attempt + 1)
+					await asyncio.sleep(min(retry_after, 30))
+					continue
+				if resp.status >= 400:
+					body = await resp.text()
+					resp.release()
+					raise LlmError(f"llm http={resp.status}: {body[:200]}")
+				return await self._read_first_line(resp)
+		raise LlmError("llm rate limited")
+
+	async def _read_first_line(self, resp) -> str:
+		buf = ""
+		finished = False
+		try:
+			async for raw in resp.content:
+				line = raw.decode("utf-8", errors="ignore").strip()
+				if not line.startswith("data:"):
+					continue
+				data = line[5:].strip()
+				if data == "[DONE]":
+					finished = True
+					break
+				try:
+					chunk = json.loads(data)
+				except Exception:
+					continue
+				for choice in chunk.get("choices") or []:
+					buf += ((choice.get("delta") or {}).get("content") or "")
+				text = buf.lstrip()
+				if "\n" in text:
+					return text.split("\n", 1)[0].strip()
+			finished = True
+		finally:
+			if finished:
+				resp.release()
+			else:
+				task = asyncio.create_task(self._drain(resp))
+				self.draining.add(task)
+				task.add_done_callback(self.draining.discard)
+		return buf.strip().split("\n", 1)[0].strip()
@@ -1,27 +1,252 @@
-import os, re, asyncio, time, sys, json, base64
-from urllib.parse import urlparse
+import os, sys, json, time, signal, asyncio, contextlib
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup, Comment
-from groq import Groq
-import tiktoken
-from aiohttp import web, ClientSession
-import requests
+# before the project modules: they read their settings from the environment when imported
+load_dotenv()
+import tokens
+from aiohttp import web
 import logging
+from fetch_pool import FetchPool
+from serp_client import SerpClient
+from page_cache import PageCache
+from extract_pool import ExtractPool
+from llm_client import LlmClient
+from query_cache import QueryCache
+from telegram import TelegramClient
+from scheduler import Scheduler, PRIO_INTERACTIVE, PRIO_BATCH, PRIO_REFRESH
+from passages import PassageIndex
+from dedup import Deduper
+from host_stats import HostStats, STATS_PATH
+from chat_state import ChatState, STATE_PATH
+from artifacts import ArtifactSink, ARTIFACTS_DIR, ARTIFACTS_MAX_QUEUE
+from membudget import MemBudget, MEM_BUDGET_BYTES, MEM_FETCH_SHARE
+from refresher import Refresher, REFRESH
+from urllib.parse import urlsplit
+import metrics
+from metrics import STAGE_SECONDS, FETCH_RESULTS, FETCH_BYTES
 
-GREETED_CHAT_IDS: set[int] = set[int]()
-
-
-load_dotenv()
 logging.basicConfig(level=getattr(logging, (os.getenv("LOG_LEVEL") or "INFO").upper(), logging.INFO), format="%(asctime)s %(levelname)s %(message)s")
 
+WEB_HOST = os.getenv("WEB_HOST") or "127.0.0.1"
+WEB_PORT = int(os.getenv("PORT") or 8000)
+# App processes sharing the port via SO_REUSEPORT under a small supervisor. Per-process pools and the
+# provider rate limits below are split between them; answers, greetings and update ids live in SQLite.
+WEB_WORKERS = max(1, int(os.getenv("WEB_WORKERS") or 1))
+WEB_STOP_TIMEOUT_SEC = 25
+# Pools, caches, the tokenizer and provider connections are set up in the background once the port is
+# bound; /_health answers 503 until that is done. 0 leaves all of it to the first query.
+STARTUP_WARMUP = (os.getenv("STARTUP_WARMUP") or "1") == "1"
+WARMUP_CONNECT_TIMEOUT_SEC = 5
+
 TOKEN_LIMIT = 6000
 SAFETY_TOKENS = 200
+# Rank passages against the query and keep the best ones instead of cutting page text in link order.
+# Fetching then stops once PASSAGE_POOL_FACTOR times the prompt budget has been collected.
+PASSAGE_RANKING = (os.getenv("PASSAGE_RANKING") or "1") == "1"
+PASSAGE_POOL_FACTOR = float(os.getenv("PASSAGE_POOL_FACTOR") or 2.5)
+PASSAGE_MIN_REL = float(os.getenv("PASSAGE_MIN_REL") or 0.1)
+# Drop paragraphs repeated (nearly) verbatim across pages, and pages that are mostly such copies
+DEDUP = (os.getenv("DEDUP") or "1") == "1"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD") or 0.7)
 
 YANDEX_SERP_TIMEOUT_SEC = 36
+SERP_CACHE_TTL_SEC = int(os.getenv("SERP_CACHE_TTL_SEC") or 3600)
+SERP_CACHE_MAX_ENTRIES = int(os.getenv("SERP_CACHE_MAX_ENTRIES") or 2048)
 
-FETCH_CONCURRENCY = 40
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY") or 40)
 FETCH_TIMEOUT_SEC = 6
 FETCH_OVERALL_TIMEOUT_SEC = 6
+FETCH_MAX_BYTES = 16777216
+FETCH_POOL_SIZE = int(os.getenv("FETCH_POOL_SIZE") or 2)
+FETCH_WORKER_MAX_JOBS = int(os.getenv("FETCH_WORKER_MAX_JOBS") or 200)
+
+# A URL with a stale cached copy that has not answered after this long (or after its host's usual
+# slow tail, when known) is served from the cache; the fetch carries on and only refreshes the cache.
+FETCH_HEDGE_AFTER_SEC = float(os.getenv("FETCH_HEDGE_AFTER_SEC") or 2.0)
+FETCH_HEDGE_MIN_SEC = 0.5
+
+FETCH_POOL: FetchPool | None = None
+HOST_STATS: HostStats | None = None
+# bodies held by this web worker (frames read, extraction, page cache) and by each of its fetch workers
+MEM_BUDGET = MemBudget(MEM_BUDGET_BYTES // WEB_WORKERS * (1 - MEM_FETCH_SHARE))
+FETCH_WORKER_MEM_BYTES = int(MEM_BUDGET_BYTES // WEB_WORKERS * MEM_FETCH_SHARE / FETCH_POOL_SIZE)
+
+async def _get_host_stats() -> HostStats | None:
+	global HOST_STATS
+	if HOST_STATS is None and STATS_PATH:
+		try:
+			stats = await asyncio.to_thread(HostStats, STATS_PATH)
+		except Exception:
+			logging.warning("host stats unavailable at %s", STATS_PATH, exc_info=True)
+			return None
+		if HOST_STATS is None:
+			HOST_STATS = stats
+		else:
+			await asyncio.to_thread(stats.close)
+	return HOST_STATS
+_FETCH_POOL_LOCK = asyncio.Lock()
+
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR") or os.path.join(os.path.dirname(__file__), "htmls")
+PAGE_CACHE_TTL_SEC = int(os.getenv("PAGE_CACHE_TTL_SEC") or 86400)
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES") or 1073741824)
+# With several web workers the first one deletes cache files for all of them, rescanning the directory this often
+PAGE_CACHE_SWEEP_SEC = 60
+
+PAGE_CACHE: PageCache | None = None
+
+async def _get_page_cache() -> PageCache:
+	global PAGE_CACHE
+	if PAGE_CACHE is None:
+		cache = await asyncio.to_thread(
+			PageCache, PAGE_CACHE_DIR, PAGE_CACHE_TTL_SEC, PAGE_CACHE_MAX_BYTES,
+			(os.environ.get("WEB_WORKER_ID") or "0") == "0", PAGE_CACHE_SWEEP_SEC if WEB_WORKERS > 1 else 0,
+		)
+		if PAGE_CACHE is None:
+			PAGE_CACHE = cache
+	return PAGE_CACHE
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS") or max(1, (os.cpu_count() or 1) // WEB_WORKERS))
+EXTRACT_MAX_PENDING = int(os.getenv("EXTRACT_MAX_PENDING") or 64)
+
+EXTRACT_POOL: ExtractPool | None = None
+_EXTRACT_POOL_LOCK = asyncio.Lock()
+
+async def _get_extract_pool() -> ExtractPool:
+	global EXTRACT_POOL
+	async with _EXTRACT_POOL_LOCK:
+		if EXTRACT_POOL is None:
+			pool = ExtractPool(EXTRACT_WORKERS, EXTRACT_MAX_PENDING)
+			await pool.start()
+			EXTRACT_POOL = pool
+	return EXTRACT_POOL
+
+ARTIFACTS: ArtifactSink | None = None
+
+def _get_artifacts() -> ArtifactSink | None:
+	global ARTIFACTS
+	if ARTIFACTS is None and ARTIFACTS_DIR:
+		ARTIFACTS = ArtifactSink(ARTIFACTS_DIR, ARTIFACTS_MAX_QUEUE)
+	return ARTIFACTS
+
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or "https://api.groq.com/openai/v1"
+LLM_MODEL = os.getenv("LLM_MODEL") or "llama-3.1-8b-instant"
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY") or 8)
+# account-wide; each web worker gets its share (0 = unlimited)
+LLM_RPM = int(os.getenv("LLM_RPM") or 30)
+LLM_RPM = max(1, LLM_RPM // WEB_WORKERS) if LLM_RPM else 0
+LLM_TIMEOUT_SEC = 30
+
+LLM_CLIENT: LlmClient | None = None
+
+def _get_llm_client() -> LlmClient:
+	global LLM_CLIENT
+	if LLM_CLIENT is None:
+		LLM_CLIENT = LlmClient(LLM_BASE_URL, os.environ.get("GROQ_API_KEY") or "", LLM_MODEL, LLM_CONCURRENCY, LLM_RPM, LLM_TIMEOUT_SEC)
+	return LLM_CLIENT
+
+RESULT_CACHE_TTL_SEC = int(os.getenv("RESULT_CACHE_TTL_SEC") or 21600)
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES") or 4096)
+# with several web workers the answers go to a shared file unless a path is given
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH") or (os.path.join(os.path.dirname(os.path.abspath(__file__)), "result_cache.sqlite3") if WEB_WORKERS > 1 else None)
+
+QUERY_CACHE: QueryCache | None = None
+
+def _get_query_cache() -> QueryCache:
+	global QUERY_CACHE
+	if QUERY_CACHE is None:
+		QUERY_CACHE = QueryCache(RESULT_CACHE_TTL_SEC, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_PATH)
+	return QUERY_CACHE
+
+TG_API_BASE = os.getenv("TG_API_BASE") or "https://api.telegram.org"
+TG_GLOBAL_RPS = float(os.getenv("TG_GLOBAL_RPS") or 25) / WEB_WORKERS
+TG_CHAT_INTERVAL_SEC = float(os.getenv("TG_CHAT_INTERVAL_SEC") or 1.0)
+
+TELEGRAM: TelegramClient | None = None
+
+def _get_telegram(bot_token: str) -> TelegramClient:
+	global TELEGRAM
+	if TELEGRAM is None:
+		TELEGRAM = TelegramClient(bot_token, TG_API_BASE, TG_GLOBAL_RPS, TG_CHAT_INTERVAL_SEC)
+		TELEGRAM.start()
+	return TELEGRAM
+
+CHAT_STATE: ChatState | None = None
+
+def _get_chat_state() -> ChatState:
+	global CHAT_STATE
+	if CHAT_STATE is None:
+		CHAT_STATE = ChatState(STATE_PATH or ":memory:")
+	return CHAT_STATE
+
+SCHED_WORKERS = int(os.getenv("SCHED_WORKERS") or 8)
+SCHED_MAX_QUEUE = int(os.getenv("SCHED_MAX_QUEUE") or 64)
+SCHED_PER_CHAT = int(os.getenv("SCHED_PER_CHAT") or 1)
+
+SCHEDULER: Scheduler | None = None
+
+def _get_scheduler() -> Scheduler:
+	global SCHEDULER
+	if SCHEDULER is None:
+		SCHEDULER = Scheduler(SCHED_WORKERS, SCHED_MAX_QUEUE, SCHED_PER_CHAT)
+		SCHEDULER.start()
+	return SCHEDULER
+
+# Hot queries are re-answered this long before their answer leaves the result cache. Only the first web
+# worker runs the refresher: it sees a fair share of the traffic and the answers land in the shared cache.
+REFRESH_AHEAD_SEC = float(os.getenv("REFRESH_AHEAD_SEC") or RESULT_CACHE_TTL_SEC / 4)
+
+REFRESHER: Refresher | None = None
+
+def _refresh_idle() -> bool:
+	# live traffic first: nothing queued, a scheduler worker to spare and no LLM call waiting for a rate slot
+	s = SCHEDULER
+	if s is None or s.queued() or s.busy() >= max(1, s.workers - 1):
+		return False
+	return LLM_CLIENT is None or LLM_CLIENT.next_slot <= time.monotonic()
+
+async def _refresh_query(query: str) -> str | None:
+	qc = _get_query_cache()
+	job = _get_scheduler().submit(lambda: qc.refresh(query, lambda: fetch_all(query)), None, PRIO_REFRESH, "refresh")
+	return None if job is None else await job
+
+def _get_refresher() -> Refresher | None:
+	global REFRESHER
+	if REFRESHER is None and REFRESH and (os.environ.get("WEB_WORKER_ID") or "0") == "0":
+		REFRESHER = Refresher(_refresh_query, _get_query_cache().expires_in, _refresh_idle, REFRESH_AHEAD_SEC)
+		REFRESHER.start()
+	return REFRESHER
+
+BUSY_TEXT = "⏳ Сейчас много запросов, попробуйте через минуту."
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY") or 4)
+BATCH_MAX_CONCURRENCY = 16
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES") or 1000)
+# SERP lookups of a batch run this many queries ahead of the ones being fetched and answered
+BATCH_SERP_AHEAD = 8
+# Batch jobs in flight across all batches; one scheduler worker always stays free for Telegram and /test
+BATCH_SLOTS: asyncio.Semaphore | None = None
+
+def _get_batch_slots() -> asyncio.Semaphore:
+	global BATCH_SLOTS
+	if BATCH_SLOTS is None:
+		BATCH_SLOTS = asyncio.Semaphore(max(1, SCHED_WORKERS - 1))
+	return BATCH_SLOTS
+
+SERP_CLIENT: SerpClient | None = None
+
+def _get_serp_client() -> SerpClient:
+	global SERP_CLIENT
+	if SERP_CLIENT is None:
+		SERP_CLIENT = SerpClient(os.environ.get("YANDEX_SERP_URL") or "", YANDEX_SERP_TIMEOUT_SEC, SERP_CACHE_TTL_SEC, SERP_CACHE_MAX_ENTRIES)
+	return SERP_CLIENT
+
+async def _get_fetch_pool() -> FetchPool:
+	global FETCH_POOL
+	async with _FETCH_POOL_LOCK:
+		if FETCH_POOL is None:
+			pool = FetchPool(FETCH_POOL_SIZE, FETCH_CONCURRENCY, FETCH_WORKER_MAX_JOBS, MEM_BUDGET, FETCH_WORKER_MEM_BYTES)
+			await pool.start()
+			FETCH_POOL = pool
+	return FETCH_POOL
 
 def _extract_links(o):
 	if isinstance(o, dict):
@@ -50,70 +275,45 @@ def _extract_texts(o):
 			yield from _extract_texts(it)
 
 
-def _strip_html_to_text(html_bytes: bytes) -> str:
-	soup = BeautifulSoup(html_bytes, "lxml")
-	for t in soup(["script", "style", "noscript", "svg", "picture", "source", "template", "iframe"]):
-		t.decompose()
-	for sel in ["header", "footer", "nav", "aside", "form", "menu"]:
-		for t in soup.select(sel):
-			t.decompose()
-	for c in soup.find_all(string=lambda s: isinstance(s, Comment)):
-		c.extract()
-	rm_re = re.compile(r"(nav|menu|breadcrumb|footer|header|social|subscribe|comment|related|sidebar|cookie|banner|ad|promo|partner|catalog|search|rating|license|policy)", re.I)
-	for t in soup.find_all(True):
-		try:
-			attrs = getattr(t, 'attrs', None)
-			if not isinstance(attrs, dict):
-				continue
-			id_val = attrs.get('id')
-			classes = attrs.get('class') or []
-			if isinstance(classes, str):
-				classes = [classes]
-			ident = " ".join([
-				str(id_val or ""),
-				" ".join([str(c) for c in classes])
-			]).strip()
-			if ident and rm_re.search(ident):
-				t.decompose()
-		except Exception:
-			continue
-	text = (soup.body or soup).get_text(separator="\n")
-	lines = [re.sub(r"\s+", " ", ln).strip() for ln in text.splitlines()]
-	email_re = re.compile(r"[\w\.-]+@[\w\.-]+\.[A-Za-zА-Яа-я]{2,}")
-	phone_re = re.compile(r"\+?\d[\d\-\s\(\)]{8,}\d")
-	drop_re = re.compile(r"^(Поиск|Главное|Новости|Публикации|Интервью|Спецпроекты|Подкасты|Афиша|RSS-новости|Рейтинги|Категории|Каталог|Кейсы|Ещё|Maps|Market|Contacts|Контакты|Мы в социальных сетях:|Подписывайтесь|Мы на связи|На главную|Этот сайт использует cookie|Политика конфиденциальности|Пользовательское соглашение|Положение об обработке персональных данных|Согласие на обработку персональных данных|©|Telegram|ВКонтакте|Одноклассники|Rutube|Все рейтинги|Лидеры рейтингов|Календарь событий)\b", re.I)
-	kept = []
-	seen = set()
-	for ln in lines:
-		if not ln:
-			continue
-		key = ln.lower()
-		if key in seen:
-			continue
-		seen.add(key)
-		if drop_re.search(ln):
-			continue
-		if len(ln.split()) < 3 and not (email_re.search(ln) or phone_re.search(ln)):
-			continue
-		kept.append(ln)
-	return "\n".join(kept)
-
 def _trim_to_token_limit(instruction_prefix: str, text: str, token_limit: int, safety: int) -> tuple[str, dict]:
-	enc = tiktoken.get_encoding("cl100k_base")
-	pref_tokens = enc.encode(instruction_prefix or "")
-	text_tokens = enc.encode(text or "")
-	budget = max(0, token_limit - len(pref_tokens) - max(0, safety))
-	keep = min(len(text_tokens), budget)
-	trimmed_text = enc.decode(text_tokens[:keep]) if keep > 0 else ""
+	pref_tokens = tokens.count(instruction_prefix or "")
+	budget = tokens.TokenBudget(token_limit - pref_tokens - max(0, safety))
+	trimmed_text = budget.take(text or "")
 	return trimmed_text, {
-		"pref_tokens": len(pref_tokens),
-		"text_tokens": len(text_tokens),
-		"budget": budget,
-		"kept": keep,
-		"total_after": len(pref_tokens) + keep,
+		"pref_tokens": pref_tokens,
+		"budget": budget.budget,
+		"kept": budget.used,
+		"total_after": pref_tokens + budget.used,
 	}
 
-async def fetch_all(query: str, save_root: bool = False, on_llm_start = None) -> None:
+PAGE_SEP = "\n\n-----\n\n"
+
+class _RankedBudget:
+	# Tracks pages by SERP rank and counts tokens over the contiguous prefix that has arrived.
+	# Once that prefix alone fills the budget, nothing ranked after it can reach the prompt.
+	def __init__(self, budget: int, head: str):
+		self.budget = tokens.TokenBudget(budget)
+		self.sep_tokens = tokens.count(PAGE_SEP)
+		self.budget.charge(head)
+		self.texts: dict[int, str] = {}
+		self.next = 0
+
+	def add(self, rank: int, text: str) -> None:
+		self.texts[rank] = text
+		while not self.full and self.next in self.texts:
+			t = self.texts[self.next]
+			if t:
+				self.budget.used += self.sep_tokens
+				self.budget.charge(t)
+			self.next += 1
+
+	@property
+	def full(self) -> bool:
+		return self.budget.full
+
+async def fetch_all(query: str, on_llm_start = None, shared: dict | None = None) -> None:
+	# shared: url -> future of its page text, common to the queries of one batch so that each URL is
+	# fetched once; the query that registers a URL first fetches it and resolves the future
 	ua = "Mozilla/5.0"
 	start_total = time.monotonic()
 	dur_ms = 0.0
@@ -124,37 +324,24 @@ async def fetch_all(query: str, save_root: bool = False, on_llm_start = None) ->
 	if not base:
 		logging.warning("YANDEX_SERP_URL not set")
 	else:
-		url = (base.rstrip("/") + "/search")
 		_ms_t0 = time.monotonic()
 		try:
-			resp = requests.get(url, params={"q": query}, timeout=YANDEX_SERP_TIMEOUT_SEC)
-			if resp.status_code >= 400:
-				logging.warning("yandex ms http=%s", resp.status_code)
-			else:
-				ct = (resp.headers.get("content-type") or "").split(";")[0].strip()
-				if ct == "application/json":
-					obj = resp.json()
-				else:
-					logging.warning("yandex ms non-json response")
-		except requests.exceptions.ConnectTimeout:
-			logging.warning("yandex ms timeout: %s", url)
-		except requests.exceptions.ConnectionError as e:
-			logging.warning("yandex ms unreachable: %s", str(e))
-		except Exception:
-			logging.exception("yandex ms request failed")
+			obj = await _get_serp_client().search(query)
 		finally:
 			dur_ms = time.monotonic() - _ms_t0
+			STAGE_SECONDS.labels("serp").observe(dur_ms)
 	links = list(dict.fromkeys(list(_extract_links(obj))))
 	serp_texts = [t.strip() for t in _extract_texts(obj)]
 	serp_block = "\n\n".join([t for t in serp_texts if t])
 	logging.info("query='%s' links=%d", query, len(links))
+	sink = _get_artifacts()
+	ns = sink.namespace() if sink is not None else ""
+	if sink is not None:
+		sink.put(ns, "serp.txt", serp_block)
 	if not links:
 		logging.info("no links to fetch for query")
-		if save_root and serp_block:
-			root_agg_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "aggregated.txt"))
-			with open(root_agg_path, "w", encoding="utf-8") as rf:
-				rf.write(serp_block)
-			logging.info("combined_text_chars=%d aggregated_path=%s", len(serp_block), root_agg_path)
+		if sink is not None:
+			sink.put(ns, "meta.json", {"query": query, "links": [], "serp_sec": round(dur_ms, 3)})
 		logging.info(
 			"timing ms=%.2fs fetch=%.2fs llm=%.2fs total=%.2fs links=%d",
 			dur_ms, dur_fetch, dur_llm, time.monotonic() - start_total, len(links)
@@ -164,211 +351,450 @@ async def fetch_all(query: str, save_root: bool = False, on_llm_start = None) ->
 		"accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
 		"accept-language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
 	}
-	out_dir = os.path.join(os.path.dirname(__file__), "htmls")
-	os.makedirs(out_dir, exist_ok=True)
+	system_prompt = (
+		"Ты помощник-экстрактор фактов. Отвечай строго одним полным именем в именительном падеже."
+		" Никаких дополнительных слов, знаков или комментариев. Если данных недостаточно — выдай пустую строку."
+	)
+	prefix = (
+		"В следующем тексте твоя задача выдать наиболее актуальную информацию, отвечающую кто сейчас \"{q}\". "
+		"Отвечай одним полным именем, например \"Иван Остапович Озёрный\" или \"Екатерина Васильевна Глухих\". "
+		"Ты не можешь вставить в ответ ничего кроме одного единственного полного имени. "
+		"Информация с более поздней датой имеет колоссальный приоритет.\n\n"
+		"Текст:\n"
+	).format(q=query)
+	cache = await _get_page_cache()
+	written_txts = []
+	prompt_budget = TOKEN_LIMIT - tokens.count(prefix) - SAFETY_TOKENS
+	index = None
+	if PASSAGE_RANKING:
+		index = PassageIndex(query)
+		index.add(-1, serp_block)
+		assembly = _RankedBudget(int(prompt_budget * PASSAGE_POOL_FACTOR), serp_block)
+	else:
+		assembly = _RankedBudget(prompt_budget, serp_block)
+	full = asyncio.Event()
+	deduper = Deduper(DEDUP_THRESHOLD) if DEDUP else None
 
+	# rank -> future this query resolves for the rest of the batch
+	owned: dict[int, asyncio.Future] = {}
+
+	# With dedup on, pages are filtered in SERP rank order, so of two near-copies the higher-ranked source
+	# is kept whichever arrives first: a page waits until those ranked above it are in (or flush_pages()).
+	pending: dict[int, str | None] = {}
+	dedup_next = 0
+
+	def add_page(i: int, txt: str | None) -> None:
+		nonlocal dedup_next
+		fut = owned.pop(i, None)
+		if fut is not None and not fut.done():
+			fut.set_result(txt)
+		if deduper is None:
+			admit_page(i, txt)
+			return
+		pending[i] = txt
+		while dedup_next in pending:
+			admit_page(dedup_next, pending.pop(dedup_next))
+			dedup_next += 1
+
+	def flush_pages() -> None:
+		# pages stuck behind a link that never came back
+		for i in sorted(pending):
+			admit_page(i, pending.pop(i))
+
+	def admit_page(i: int, txt: str | None) -> None:
+		if txt and deduper is not None:
+			txt = deduper.filter(txt)
+		if txt is not None:
+			written_txts.append((i, txt))
+			if index is not None:
+				index.add(i, txt)
+		assembly.add(i, txt or "")
+		if assembly.full:
+			full.set()
+
+	counters = {"ok": 0, "timeout": 0, "cancel": 0, "fail": 0, "skipped": 0}
+	peak_body = {"raw": 0, "kept": 0}
+	cache_stats = {"hit": 0, "revalidated": 0, "saved_bytes": 0, "hedged": 0, "stale_used": 0, "shared": 0}
+	# links that still need the network; worker indices point into this list
+	to_fetch = []
+	validators = {}
+	# worker index -> cache meta of an expired copy, the fallback/hedge for that URL
+	stale: dict[int, dict] = {}
+	# rank -> page another query of the batch is fetching
+	borrowed: dict[int, asyncio.Future] = {}
+	for i, url in enumerate(links):
+		if shared is not None and url in shared:
+			borrowed[i] = shared[url]
+			continue
+		meta = await asyncio.to_thread(cache.lookup, url)
+		if meta is not None and meta["fresh"]:
+			txt = await asyncio.to_thread(cache.read_text, meta)
+			if txt is not None:
+				add_page(i, txt)
+				cache_stats["hit"] += 1
+				cache_stats["saved_bytes"] += int(meta.get("body_size") or 0)
+				continue
+		if assembly.full:
+			break
+		if meta is not None:
+			stale[len(to_fetch)] = meta
+			if meta.get("etag") or meta.get("last_modified"):
+				validators[str(len(to_fetch))] = {"etag": meta.get("etag") or "", "last_modified": meta.get("last_modified") or ""}
+		to_fetch.append(i)
+		if shared is not None:
+			owned[i] = shared[url] = asyncio.get_running_loop().create_future()
+
+	if assembly.full:
+		to_fetch = []
 	logging.info(
-		"fetch config: links=%d concurrency=%d per_url_timeout=%ds overall_timeout=%ds",
-		len(links), FETCH_CONCURRENCY, FETCH_TIMEOUT_SEC, FETCH_OVERALL_TIMEOUT_SEC
+		"fetch config: links=%d cached=%d concurrency=%d per_url_timeout=%ds overall_timeout=%ds",
+		len(links), cache_stats["hit"], FETCH_CONCURRENCY, FETCH_TIMEOUT_SEC, FETCH_OVERALL_TIMEOUT_SEC
 	)
-	written_txts = []
-	counters = {"ok": 0, "timeout": 0, "cancel": 0, "fail": 0}
 	_fetch_t0 = time.monotonic()
-	proc = None
+	extract_pool = await _get_extract_pool()
+	extracting: set[asyncio.Task] = set()
+	async def extract_page(i: int, url: str, final_url: str, body: bytes, meta: dict, late: bool = False) -> None:
+		# late: the page was already served from its stale copy, so only the cache is refreshed
+		try:
+			txt = await extract_pool.extract(body, f"i={i}")
+		except Exception:
+			logging.exception("extract failed: %s", url)
+			if not late:
+				add_page(i, None)
+			return
+		if not late:
+			add_page(i, txt)
+		await asyncio.to_thread(cache.store, url, final_url, body, txt, meta.get("etag") or "", meta.get("last_modified") or "")
+
+	hedged: set[int] = set()
+	answered: set[int] = set()
+
+	async def borrow(i: int, fut: asyncio.Future) -> None:
+		# bounded by this query's own deadline in case the owner is cancelled before resolving it
+		try:
+			txt = await asyncio.wait_for(asyncio.shield(fut), max(0.0, _fetch_t0 + FETCH_OVERALL_TIMEOUT_SEC - time.monotonic()) + 1)
+		except asyncio.TimeoutError:
+			txt = None
+		if txt is not None:
+			cache_stats["shared"] += 1
+		add_page(i, txt)
+
+	for i, fut in borrowed.items():
+		task = asyncio.create_task(borrow(i, fut))
+		extracting.add(task)
+		task.add_done_callback(extracting.discard)
+
+	async def use_stale(j: int) -> bool:
+		txt = await asyncio.to_thread(cache.read_text, stale[j])
+		if txt is None:
+			return False
+		hedged.add(j)
+		add_page(to_fetch[j], txt)
+		return True
+
+	# hedge deadlines for URLs with a stale copy, from the host's recent slow tail where there is one
+	hedge_at: dict[int, float] = {}
+	host_stats = await _get_host_stats() if stale else None
+	stale_hosts = {j: (urlsplit(links[to_fetch[j]]).hostname or "").lower() for j in stale}
+	slow = await asyncio.to_thread(host_stats.p_slow_many, list(stale_hosts.values())) if host_stats is not None else {}
+	for j in stale:
+		delay = FETCH_HEDGE_AFTER_SEC
+		if host_stats is not None:
+			slow_ms = slow.get(stale_hosts[j]) or 0.0
+			if slow_ms > 0:
+				delay = min(FETCH_TIMEOUT_SEC, max(FETCH_HEDGE_MIN_SEC, slow_ms / 1000.0))
+		hedge_at[j] = _fetch_t0 + delay
+
+	job = None
+	full_wait = asyncio.create_task(full.wait())
 	try:
-		worker = os.path.abspath(os.path.join(os.path.dirname(__file__), "fetch_batch_worker.py"))
-		proc = await asyncio.create_subprocess_exec(
-			sys.executable, "-u", worker,
-			stdin=asyncio.subprocess.PIPE,
-			stdout=asyncio.subprocess.PIPE,
-			stderr=asyncio.subprocess.PIPE,
-		)
-		cfg = {
-			"urls": links,
-			"concurrency": FETCH_CONCURRENCY,
-			"per_url_timeout": FETCH_TIMEOUT_SEC,
-			"max_bytes": 16777216,
-		}
-		proc.stdin.write((json.dumps(cfg) + "\n").encode("utf-8"))
-		await proc.stdin.drain()
-		proc.stdin.close()
-		while True:
-			remaining = FETCH_OVERALL_TIMEOUT_SEC - (time.monotonic() - _fetch_t0)
-			if remaining <= 0:
+		if to_fetch:
+			pool = await _get_fetch_pool()
+			job = await pool.submit([links[i] for i in to_fetch], FETCH_TIMEOUT_SEC, FETCH_MAX_BYTES, validators)
+		while job is not None:
+			if assembly.full:
+				logging.info("token budget full after %d pages, cancelling %d outstanding", assembly.next, len(to_fetch) - len(answered))
 				break
-			try:
-				line = await asyncio.wait_for(proc.stdout.readline(), timeout=remaining)
-			except asyncio.TimeoutError:
-				break
-			if not line:
+			now = time.monotonic()
+			remaining = FETCH_OVERALL_TIMEOUT_SEC - (now - _fetch_t0)
+			if remaining <= 0:
 				break
-			try:
-				row = json.loads(line.decode("utf-8", errors="ignore"))
-			except Exception:
+			wait = remaining
+			if hedge_at:
+				wait = min(wait, max(0.0, min(hedge_at.values()) - now))
+			nxt = asyncio.create_task(job.next())
+			done, _ = await asyncio.wait({nxt, full_wait}, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+			# nxt may finish after wait() gave up on it; its row must not be dropped (it holds reserved bytes)
+			if not nxt.done():
+				nxt.cancel()
+				if full_wait in done:
+					continue
+				now = time.monotonic()
+				for j in [j for j, t in hedge_at.items() if t <= now]:
+					del hedge_at[j]
+					if await use_stale(j):
+						cache_stats["hedged"] += 1
 				continue
-			i = int(row.get("i") or 0)
+			row = nxt.result()
+			if row is None:
+				break
+			j = int(row.get("i") or 0)
+			answered.add(j)
+			hedge_at.pop(j, None)
+			late = j in hedged
+			i = to_fetch[j]
 			url = row.get("url") or ""
 			final_url = row.get("final_url") or url
 			status = (row.get("status") or "fail").lower()
-			content_len = int(row.get("content_len") or 0)
-			body = b""
-			if content_len > 0:
-				# read exact base64 payload and trailing newline
-				payload = await proc.stdout.readexactly(content_len + 1)
-				content_b64 = payload[:-1].decode("ascii", errors="ignore")
-				try:
-					body = base64.b64decode(content_b64)
-				except Exception:
-					body = b""
-			if status == "ok":
-				p = urlparse(final_url)
-				host = (p.netloc or "site").replace(":", "_")
-				path_part = (p.path or "/").strip("/").replace("/", "_")
-				if not path_part:
-					path_part = "index"
-				if len(path_part) > 80:
-					path_part = path_part[:80]
-				bname = f"{i+1:02d}_{host}_{path_part}"
-				html_path = os.path.join(out_dir, bname + ".html")
-				with open(html_path, "wb") as wf:
-					wf.write(body)
-				txt = _strip_html_to_text(body) if body else ""
-				txt_path = os.path.join(out_dir, bname + ".txt")
-				with open(txt_path, "w", encoding="utf-8") as tf:
-					tf.write(txt)
-				try:
-					written_txts.append((i, txt_path))
-				except Exception:
-					pass
+			body = row.get("body") or b""
+			meta = row.get("meta") or {}
+			if status != "ok" or not body:
+				pool.release(row)
+			if status == "not_modified":
+				if late:
+					await asyncio.to_thread(cache.touch, url)
+					counters["ok"] += 1
+					continue
+				cached = await asyncio.to_thread(cache.lookup, url)
+				txt = await asyncio.to_thread(cache.read_text, cached) if cached else None
+				if txt is None:
+					add_page(i, None)
+					counters["fail"] += 1
+					continue
+				await asyncio.to_thread(cache.touch, url)
+				add_page(i, txt)
+				cache_stats["revalidated"] += 1
+				cache_stats["saved_bytes"] += int(cached.get("body_size") or 0)
+				counters["ok"] += 1
+			elif status == "ok":
 				counters["ok"] += 1
-			elif status == "timeout":
-				counters["timeout"] += 1
+				peak_body["raw"] = max(peak_body["raw"], int(meta.get("raw_bytes") or 0))
+				peak_body["kept"] = max(peak_body["kept"], len(body))
+				FETCH_BYTES.inc(len(body))
+				if not body:
+					if not late:
+						add_page(i, "")
+					continue
+				task = asyncio.create_task(extract_page(i, url, final_url, body, meta, late))
+				extracting.add(task)
+				task.add_done_callback(extracting.discard)
+				# the body's bytes are given back once extraction and the cache write are done with it
+				task.add_done_callback(lambda _, r=row: pool.release(r))
 			else:
-				counters["fail"] += 1
+				if status == "timeout":
+					counters["timeout"] += 1
+				elif status == "skipped":
+					logging.info("fetch skipped (%s %s): %s", meta.get("skipped") or "", meta.get("content_type") or "", url)
+					counters["skipped"] += 1
+				else:
+					counters["fail"] += 1
+				if late:
+					continue
+				if j in stale and await use_stale(j):
+					cache_stats["stale_used"] += 1
+					continue
+				add_page(i, None)
 	finally:
-		if proc and (proc.returncode is None):
-			try:
-				proc.kill()
-			except Exception:
-				pass
+		full_wait.cancel()
+		if job is not None:
+			await job.cancel()
+	# URLs cut off by the overall timeout fall back to their stale copies
+	for j in stale:
+		if j not in answered and j not in hedged and not assembly.full and await use_stale(j):
+			cache_stats["stale_used"] += 1
+	# pages already handed to extraction are waited for unless the budget is already full
+	while extracting and not assembly.full:
+		await asyncio.wait(set(extracting), return_when=asyncio.FIRST_COMPLETED)
+	for task in list(extracting):
+		task.cancel()
+	flush_pages()
+	# URLs this query gave up on: queries waiting for them get nothing, later ones fetch them themselves
+	for i, fut in owned.items():
+		if shared is not None and shared.get(links[i]) is fut:
+			del shared[links[i]]
+		if not fut.done():
+			fut.set_result(None)
 	dur_fetch = time.monotonic() - _fetch_t0
-	counters["cancel"] = max(0, len(links) - (counters["ok"] + counters["timeout"] + counters["fail"]))
-	logging.info("fetch summary: ok=%d timeout=%d cancel=%d fail=%d", counters["ok"], counters["timeout"], counters["cancel"], counters["fail"])
-	combined_path = os.path.join(out_dir, "_combined.txt")
-	parts = []
-	for _, pth in sorted(written_txts, key=lambda x: x[0]):
-		try:
-			with open(pth, "r", encoding="utf-8") as rf:
-				content = rf.read().strip()
-				if content:
-					parts.append(content)
-		except Exception:
-			continue
-	with open(combined_path, "w", encoding="utf-8") as wf:
-		wf.write("\n\n-----\n\n".join(parts))
-
-	with open(combined_path, "r", encoding="utf-8") as rf:
-		combined_text = rf.read()
-	if serp_block:
-		prefix_sep = "\n\n-----\n\n" if combined_text else ""
-		combined_text = serp_block + prefix_sep + combined_text
-	if save_root:
-		root_agg_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "aggregated.txt"))
-		with open(root_agg_path, "w", encoding="utf-8") as rf:
-			rf.write(combined_text)
-		logging.info("combined_text_chars=%d aggregated_path=%s", len(combined_text), root_agg_path)
-	else:
-		logging.info("combined_text_chars=%d", len(combined_text))
-	system_prompt = (
-		"Ты помощник-экстрактор фактов. Отвечай строго одним полным именем в именительном падеже."
-		" Никаких дополнительных слов, знаков или комментариев. Если данных недостаточно — выдай пустую строку."
+	STAGE_SECONDS.labels("fetch").observe(dur_fetch)
+	counters["cancel"] = max(0, len(to_fetch) - len(answered))
+	for k, n in counters.items():
+		if n:
+			FETCH_RESULTS.labels(k).inc(n)
+	for k in ("hit", "revalidated", "hedged", "stale_used", "shared"):
+		if cache_stats[k]:
+			FETCH_RESULTS.labels("cache_" + k).inc(cache_stats[k])
+	cache_served = cache_stats["hit"] + cache_stats["revalidated"] + cache_stats["hedged"] + cache_stats["stale_used"] + cache_stats["shared"]
+	logging.info(
+		"fetch summary: ok=%d timeout=%d cancel=%d fail=%d skipped=%d cache_hit=%d revalidated=%d hedged=%d stale_used=%d shared=%d hit_ratio=%.2f saved_bytes=%d peak_raw_bytes=%d peak_kept_bytes=%d",
+		counters["ok"], counters["timeout"], counters["cancel"], counters["fail"], counters["skipped"],
+		cache_stats["hit"], cache_stats["revalidated"], cache_stats["hedged"], cache_stats["stale_used"], cache_stats["shared"],
+		cache_served / len(links), cache_stats["saved_bytes"], peak_body["raw"], peak_body["kept"]
 	)
-	prefix = (
-		"В следующем тексте твоя задача выдать наиболее актуальную информацию, отвечающую кто сейчас \"{q}\". "
-		"Отвечай одним полным именем, например \"Иван Остапович Озёрный\" или \"Екатерина Васильевна Глухих\". "
-		"Ты не можешь вставить в ответ ничего кроме одного единственного полного имени. "
-		"Информация с более поздней датой имеет колоссальный приоритет.\n\n"
-		"Текст:\n"
-	).format(q=query)
-	trimmed_text, _ = _trim_to_token_limit(prefix, combined_text, TOKEN_LIMIT, SAFETY_TOKENS)
+	if deduper is not None and deduper.dropped_paragraphs:
+		saved = await asyncio.to_thread(tokens.count, deduper.dropped_text())
+		logging.info(
+			"dedup: paragraphs=%d dropped=%d pages_dropped=%d tokens_saved=%d",
+			deduper.paragraphs, deduper.dropped_paragraphs, deduper.dropped_pages, saved
+		)
+	parts = [t.strip() for _, t in sorted(written_txts, key=lambda x: x[0]) if t.strip()]
+	combined_text = PAGE_SEP.join(([serp_block] if serp_block else []) + parts)
+	logging.info("combined_text_chars=%d", len(combined_text))
+	if sink is not None:
+		sink.put(ns, "combined.txt", combined_text)
+	_tok_t0 = time.monotonic()
+	if index is not None:
+		trimmed_text, info = await asyncio.to_thread(index.select, prompt_budget, PAGE_SEP, PASSAGE_MIN_REL)
+		logging.info(
+			"passages: indexed=%d matched=%d kept=%d tokens=%d budget=%d",
+			info["passages"], info["matched"], info["kept"], info["tokens"], prompt_budget
+		)
+	else:
+		trimmed_text, _ = _trim_to_token_limit(prefix, combined_text, TOKEN_LIMIT, SAFETY_TOKENS)
+	STAGE_SECONDS.labels("tokenize").observe(time.monotonic() - _tok_t0)
 	user_prompt = prefix + trimmed_text
+	if sink is not None:
+		sink.put(ns, "prompt.txt", user_prompt)
 	if callable(on_llm_start):
 		try:
 			await on_llm_start()
 		except Exception:
 			pass
 	_llm_t0 = time.monotonic()
-	client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-	resp = client.chat.completions.create(
-		model="llama-3.1-8b-instant",
-		messages=[
+	answer = await _get_llm_client().first_line(
+		[
 			{"role": "system", "content": system_prompt},
 			{"role": "user", "content": user_prompt},
 		],
 		temperature=1,
 		max_tokens=512,
 		top_p=1,
-		stream=False,
 	)
-	answer = (resp.choices[0].message.content or "").strip()
 	dur_llm = time.monotonic() - _llm_t0
-	answer_path = os.path.join(out_dir, "_answer.txt")
-	with open(answer_path, "w", encoding="utf-8") as wf:
-		wf.write(answer)
+	STAGE_SECONDS.labels("llm").observe(dur_llm)
+	if sink is not None:
+		sink.put(ns, "answer.txt", answer)
+		sink.put(ns, "meta.json", {
+			"query": query,
+			"links": links,
+			"pages": len(written_txts),
+			"fetch": counters,
+			"cache": cache_stats,
+			"serp_sec": round(dur_ms, 3),
+			"fetch_sec": round(dur_fetch, 3),
+			"llm_sec": round(dur_llm, 3),
+		})
 	logging.info(
 		"answer_len=%d pages=%d links=%d timing ms=%.2fs fetch=%.2fs llm=%.2fs total=%.2fs",
 		len(answer), len(written_txts), len(links), dur_ms, dur_fetch, dur_llm, time.monotonic() - start_total
 	)
+	STAGE_SECONDS.labels("total").observe(time.monotonic() - start_total)
 	return answer
 
-async def _send_message(session: ClientSession, bot_token: str, chat_id: int, text: str) -> None:
-	url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-	await session.post(url, json={"chat_id": chat_id, "text": text})
+async def answer_query(query: str, on_llm_start = None, fresh: bool = False, shared: dict | None = None) -> str:
+	# fetch_all behind the result cache; concurrent identical queries share one pipeline run
+	qc = _get_query_cache()
+	if REFRESHER is not None:
+		REFRESHER.record(query)
+	if fresh:
+		ans = await fetch_all(query, on_llm_start, shared)
+		if ans:
+			await qc.put(query, ans)
+		return ans
+	return await qc.get_or_compute(query, lambda: fetch_all(query, on_llm_start, shared))
 
-async def _send_message_get_id(session: ClientSession, bot_token: str, chat_id: int, text: str) -> int | None:
-	url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-	try:
-		resp = await session.post(url, json={"chat_id": chat_id, "text": text})
-		data = await resp.json()
-		return ((data or {}).get("result") or {}).get("message_id")
-	except Exception:
-		return None
+def _batch_queries(text: str) -> list[str]:
+	# {"queries": [...]}, or one query per line: {"query": ...} ("q" or "text" also work) or plain text
+	text = (text or "").strip()
+	if text.startswith("{"):
+		try:
+			obj = json.loads(text)
+		except ValueError:
+			obj = None
+		if isinstance(obj, dict) and isinstance(obj.get("queries"), list):
+			return [q.strip() for q in obj["queries"] if isinstance(q, str) and q.strip()]
+	out = []
+	for line in text.splitlines():
+		line = line.strip()
+		if not line:
+			continue
+		try:
+			obj = json.loads(line)
+		except ValueError:
+			obj = line
+		if isinstance(obj, dict):
+			obj = obj.get("query") or obj.get("q") or obj.get("text") or ""
+		if isinstance(obj, str) and obj.strip():
+			out.append(obj.strip())
+	return out
 
-async def _edit_message_text(session: ClientSession, bot_token: str, chat_id: int, message_id: int, text: str) -> None:
-	url = f"https://api.telegram.org/bot{bot_token}/editMessageText"
-	try:
-		await session.post(url, json={"chat_id": chat_id, "message_id": message_id, "text": text})
-	except Exception:
-		pass
+async def run_batch(queries: list[str], concurrency: int, fresh: bool = False):
+	# Yields {"i", "query", "answer" | "error", "ms"} per query as each one finishes. Up to `concurrency`
+	# queries are in the fetch/LLM stages at once, with SERP lookups running ahead of them; all of them share
+	# one URL map, so a page several queries link to is fetched once. Jobs go through the scheduler at
+	# batch priority, so Telegram users are served first.
+	shared: dict = {}
+	sem = asyncio.Semaphore(max(1, concurrency))
+	window = asyncio.Semaphore(max(1, concurrency) + BATCH_SERP_AHEAD)
+	qc = _get_query_cache()
+	serp = _get_serp_client()
+
+	async def one(k: int, q: str) -> dict:
+		t0 = time.monotonic()
+		row = {"i": k, "query": q}
+		async with window:
+			try:
+				cached = None if fresh else await qc.get(q)
+				if cached is not None:
+					row["answer"] = cached
+					return row
+				# warms the SERP cache; fetch_all's own search() then finds it there or joins it in flight
+				# shielded: the lookup may be shared with live queries, so a disconnecting batch client must not cancel it
+				ahead = asyncio.create_task(serp.search(q))
+				ahead.add_done_callback(lambda t: t.cancelled() or t.exception())
+				async with sem:
+					with contextlib.suppress(Exception):
+						await asyncio.shield(ahead)
+					async with _get_batch_slots():
+						while True:
+							job = _get_scheduler().submit(lambda: answer_query(q, fresh=fresh, shared=shared), None, PRIO_BATCH, "batch")
+							if job is not None:
+								break
+							await asyncio.sleep(1)
+						row["answer"] = await job
+			except Exception as e:
+				logging.exception("batch query failed: %s", q[:200])
+				row["error"] = str(e) or type(e).__name__
+			finally:
+				row["ms"] = int((time.monotonic() - t0) * 1000)
+		return row
 
-async def _delete_message(session: ClientSession, bot_token: str, chat_id: int, message_id: int) -> None:
-	url = f"https://api.telegram.org/bot{bot_token}/deleteMessage"
+	tasks = [asyncio.create_task(one(k, q)) for k, q in enumerate(queries)]
 	try:
-		await session.post(url, json={"chat_id": chat_id, "message_id": message_id})
-	except Exception:
-		pass
+		for fut in asyncio.as_completed(tasks):
+			yield await fut
+	finally:
+		for task in tasks:
+			task.cancel()
 
-async def _process_update(bot_token: str, chat_id: int, text: str) -> None:
+async def _process_update(tg: TelegramClient, chat_id: int, text: str) -> None:
 	logging.info("process_update chat_id=%s text='%s'", str(chat_id), (text or "")[:200])
-	async with ClientSession() as session:
-		if chat_id not in GREETED_CHAT_IDS:
-			await _send_message(session, bot_token, chat_id, "👋 Hi! Send me a query.")
-			GREETED_CHAT_IDS.add(chat_id)
-		status_id = await _send_message_get_id(session, bot_token, chat_id, "Ищу")
-		async def on_llm_start():
-			if status_id:
-				await _edit_message_text(session, bot_token, chat_id, status_id, "Думаю")
-		try:
-			answer = await fetch_all(text, False, on_llm_start)
-		except Exception:
-			logging.exception("processing failed")
-			answer = ""
-		try:
-			if answer and answer.strip():
-				await _send_message(session, bot_token, chat_id, answer.strip())
-		finally:
-			if status_id:
-				await _delete_message(session, bot_token, chat_id, status_id)
+	if await asyncio.to_thread(_get_chat_state().first_greeting, chat_id):
+		await tg.send_message(chat_id, "👋 Hi! Send me a query.")
+	status_id = await tg.send_message(chat_id, "Ищу")
+	async def on_llm_start():
+		if status_id:
+			tg.edit_message_text(chat_id, status_id, "Думаю")
+	try:
+		answer = await answer_query(text, on_llm_start)
+	except Exception:
+		logging.exception("processing failed")
+		answer = ""
+	try:
+		if answer and answer.strip():
+			await tg.send_message(chat_id, answer.strip())
+	finally:
+		if status_id:
+			tg.delete_message(chat_id, status_id)
 
 async def handle_webhook(request: web.Request) -> web.Response:
 	logging.info("webhook hit")
@@ -382,22 +808,101 @@ async def handle_webhook(request: web.Request) -> web.Response:
 		update = await request.json()
 	except Exception:
 		return web.Response(status=400)
+	update_id = update.get("update_id")
+	if isinstance(update_id, int) and not await asyncio.to_thread(_get_chat_state().claim_update, update_id):
+		# a redelivery, or already taken by another web worker
+		logging.info("update %d already handled", update_id)
+		return web.json_response({"ok": True})
 	message = (update.get("message") or update.get("edited_message") or {})
 	chat = message.get("chat") or {}
 	chat_id = chat.get("id")
 	text = (message.get("text") or "").strip()
 	logging.info("update chat_id=%s text_len=%d", str(chat_id), len(text))
 	if chat_id:
-		asyncio.create_task(_process_update(bot_token, chat_id, text))
+		tg = _get_telegram(bot_token)
+		job = _get_scheduler().submit(lambda: _process_update(tg, chat_id, text), chat_id, PRIO_INTERACTIVE, "tg")
+		if job is None:
+			asyncio.create_task(tg.send_message(chat_id, BUSY_TEXT))
 	return web.json_response({"ok": True})
 
+WARMUP: asyncio.Task | None = None
+# seconds per warm-up step, and "total"
+WARMUP_SEC: dict[str, float] = {}
+
+def _ready() -> bool:
+	return WARMUP is None or WARMUP.done()
+
+async def _warm_up() -> None:
+	# steps run side by side; a failed one is logged and left to the first query that needs it
+	t0 = time.monotonic()
+
+	async def step(name: str, fn) -> None:
+		t = time.monotonic()
+		try:
+			await fn()
+		except Exception:
+			logging.warning("warm-up %s failed", name, exc_info=True)
+		WARMUP_SEC[name] = round(time.monotonic() - t, 3)
+
+	async def fetch_pool() -> None:
+		await (await _get_fetch_pool()).ping()
+
+	steps = [
+		step("tokenizer", lambda: asyncio.to_thread(tokens.prewarm)),
+		step("page_cache", _get_page_cache),
+		step("fetch_pool", fetch_pool),
+		step("extract_pool", _get_extract_pool),
+		step("llm", lambda: _get_llm_client().warm(WARMUP_CONNECT_TIMEOUT_SEC)),
+	]
+	if os.environ.get("YANDEX_SERP_URL"):
+		steps.append(step("serp", lambda: _get_serp_client().warm(WARMUP_CONNECT_TIMEOUT_SEC)))
+	if os.environ.get("TG_BOT_TOKEN"):
+		steps.append(step("telegram", lambda: _get_telegram(os.environ["TG_BOT_TOKEN"]).warm(WARMUP_CONNECT_TIMEOUT_SEC)))
+	await asyncio.gather(*steps)
+	WARMUP_SEC["total"] = round(time.monotonic() - t0, 3)
+	logging.info("warm-up done in %.2fs: %s", WARMUP_SEC["total"], " ".join(f"{k}={v:.2f}s" for k, v in WARMUP_SEC.items() if k != "total"))
+
+# Scraped from the live objects; values are 0 until the corresponding component has started
+metrics.Gauge("leads_ready", "1 once start-up warm-up has finished.", fn=lambda: 1 if _ready() else 0)
+metrics.Gauge("leads_scheduler_queued", "Jobs waiting in the scheduler queue.", fn=lambda: SCHEDULER.queued() if SCHEDULER else 0)
+metrics.Gauge("leads_scheduler_running", "Jobs currently running.", fn=lambda: SCHEDULER.busy() if SCHEDULER else 0)
+metrics.Counter("leads_scheduler_rejected_total", "Jobs refused because the queue was full.", fn=lambda: SCHEDULER.rejected if SCHEDULER else 0)
+metrics.Gauge("leads_fetch_jobs_active", "Fetch jobs in flight across fetch workers.", fn=lambda: sum(len(w.jobs) for w in FETCH_POOL.workers) if FETCH_POOL else 0)
+metrics.Gauge("leads_extract_pending", "Pages waiting for or in HTML extraction.", fn=lambda: EXTRACT_POOL.pending if EXTRACT_POOL else 0)
+metrics.Gauge("leads_telegram_queue_depth", "Telegram calls waiting to be sent.", fn=lambda: TELEGRAM.queue_depth() if TELEGRAM else 0)
+metrics.Counter("leads_query_cache_total", "Result cache lookups by outcome.", ("outcome",), fn=lambda: {"hit": QUERY_CACHE.hits, "miss": QUERY_CACHE.misses, "shared": QUERY_CACHE.flight.shared} if QUERY_CACHE else {})
+metrics.Gauge("leads_mem_used_bytes", "Page body bytes held under the memory budget.", ("part",), fn=lambda: {"app": MEM_BUDGET.used, "fetch": FETCH_POOL.mem_stats()["used"] if FETCH_POOL else 0})
+metrics.Gauge("leads_mem_peak_bytes", "Highest page body bytes held since start (fetch: sum of worker peaks).", ("part",), fn=lambda: {"app": MEM_BUDGET.peak, "fetch": FETCH_POOL.mem_stats()["peak"] if FETCH_POOL else 0})
+metrics.Gauge("leads_mem_limit_bytes", "Memory budget for page bodies.", ("part",), fn=lambda: {"app": MEM_BUDGET.limit, "fetch": FETCH_WORKER_MEM_BYTES * FETCH_POOL_SIZE})
+metrics.Counter("leads_mem_waits_total", "Reservations that had to wait for budget.", ("part",), fn=lambda: {"app": MEM_BUDGET.waits, "fetch": FETCH_POOL.mem_stats()["waits"] if FETCH_POOL else 0})
+metrics.Counter("leads_refresh_total", "Background refreshes of hot queries by outcome.", ("outcome",), fn=lambda: {"refreshed": REFRESHER.refreshed, "empty": REFRESHER.empty, "failed": REFRESHER.failed, "deferred": REFRESHER.deferred} if REFRESHER else {})
+metrics.Gauge("leads_refresh_tracked", "Queries whose hit counts the refresher keeps.", fn=lambda: len(REFRESHER.queries) if REFRESHER else 0)
+metrics.Counter("leads_artifacts_dropped_total", "Debug artifact files dropped because the writer queue was full.", fn=lambda: ARTIFACTS.dropped if ARTIFACTS else 0)
+metrics.Counter("leads_serp_cache_total", "SERP cache lookups by outcome.", ("outcome",), fn=lambda: {"hit": SERP_CLIENT.cache.hits, "miss": SERP_CLIENT.cache.misses, "shared": SERP_CLIENT.flight.shared} if SERP_CLIENT else {})
+
 def create_app() -> web.Application:
 	app = web.Application()
 	app.router.add_post("/tg/{token}", handle_webhook)
 
 	async def health(_: web.Request) -> web.Response:
+		if not _ready():
+			return web.Response(status=503, text="starting")
 		return web.Response(text="ok")
 
+	async def stats(_: web.Request) -> web.Response:
+		serp = _get_serp_client()
+		return web.json_response({
+			"query_cache": _get_query_cache().stats(),
+			"serp_cache": {"hits": serp.cache.hits, "misses": serp.cache.misses, "shared": serp.flight.shared, "entries": len(serp.cache)},
+			"scheduler": _get_scheduler().stats(),
+			"memory": {"app": MEM_BUDGET.stats(), "fetch": FETCH_POOL.mem_stats() if FETCH_POOL else {}},
+			"startup": {"ready": _ready(), "warmup_sec": WARMUP_SEC},
+			"refresher": REFRESHER.stats() if REFRESHER else {},
+		})
+
+
+	async def metrics_route(_: web.Request) -> web.Response:
+		return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
 
 	async def test(request: web.Request) -> web.Response:
 		q = (request.query.get("q") or "").strip()
@@ -409,8 +914,12 @@ def create_app() -> web.Application:
 				"error": "YANDEX_SERP_URL missing",
 				"hint": "Set YANDEX_SERP_URL in .env, e.g. http://127.0.0.1:3000",
 			}, status=500)
+		fresh = request.query.get("fresh") == "1"
+		job = _get_scheduler().submit(lambda: answer_query(q, fresh=fresh), None, PRIO_BATCH, "test")
+		if job is None:
+			return web.json_response({"error": "busy"}, status=503, headers={"retry-after": "30"})
 		try:
-			ans = await fetch_all(q, True)
+			ans = await job
 		except Exception as e:
 			logging.exception("test failed")
 			return web.json_response({
@@ -424,9 +933,144 @@ def create_app() -> web.Application:
 			}, status=502)
 		return web.Response(text=ans)
 
+	async def batch(request: web.Request) -> web.StreamResponse:
+		if not os.environ.get("YANDEX_SERP_URL"):
+			return web.json_response({"error": "YANDEX_SERP_URL missing"}, status=500)
+		queries = _batch_queries(await request.text())
+		if not queries:
+			return web.json_response({"error": "no queries"}, status=400)
+		if len(queries) > BATCH_MAX_QUERIES:
+			return web.json_response({"error": f"at most {BATCH_MAX_QUERIES} queries per batch"}, status=413)
+		try:
+			concurrency = min(BATCH_MAX_CONCURRENCY, max(1, int(request.query.get("concurrency") or BATCH_CONCURRENCY)))
+		except ValueError:
+			return web.json_response({"error": "bad concurrency"}, status=400)
+		resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+		await resp.prepare(request)
+		async with contextlib.aclosing(run_batch(queries, concurrency, request.query.get("fresh") == "1")) as rows:
+			async for row in rows:
+				await resp.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+		await resp.write_eof()
+		return resp
+
+	async def on_startup(_: web.Application) -> None:
+		# runs before the port is bound, so only the cheap parts; the rest is _warm_up in the background
+		global WARMUP
+		_get_query_cache()
+		_get_scheduler()
+		_get_refresher()
+		if STARTUP_WARMUP:
+			WARMUP = asyncio.create_task(_warm_up())
+
+	async def on_cleanup(_: web.Application) -> None:
+		global FETCH_POOL, SERP_CLIENT, EXTRACT_POOL, LLM_CLIENT, QUERY_CACHE, TELEGRAM, SCHEDULER, HOST_STATS, CHAT_STATE, ARTIFACTS, WARMUP, REFRESHER
+		if WARMUP is not None:
+			# waited for rather than cancelled: a pool cut off half-way through starting would be left behind
+			await asyncio.gather(WARMUP, return_exceptions=True)
+			WARMUP = None
+		if REFRESHER is not None:
+			await REFRESHER.close()
+			REFRESHER = None
+		if SCHEDULER is not None:
+			await SCHEDULER.close()
+			SCHEDULER = None
+		if FETCH_POOL is not None:
+			await FETCH_POOL.close()
+			FETCH_POOL = None
+		if EXTRACT_POOL is not None:
+			await EXTRACT_POOL.close()
+			EXTRACT_POOL = None
+		if SERP_CLIENT is not None:
+			await SERP_CLIENT.close()
+			SERP_CLIENT = None
+		if LLM_CLIENT is not None:
+			await LLM_CLIENT.close()
+			LLM_CLIENT = None
+		if TELEGRAM is not None:
+			await TELEGRAM.close()
+			TELEGRAM = None
+		if QUERY_CACHE is not None:
+			QUERY_CACHE.close()
+			QUERY_CACHE = None
+		if HOST_STATS is not None:
+			await asyncio.to_thread(HOST_STATS.close)
+			HOST_STATS = None
+		if CHAT_STATE is not None:
+			CHAT_STATE.close()
+			CHAT_STATE = None
+		if ARTIFACTS is not None:
+			await asyncio.to_thread(ARTIFACTS.close)
+			ARTIFACTS = None
+
+	app.on_startup.append(on_startup)
+	app.on_cleanup.append(on_cleanup)
 	app.router.add_get("/_health", health)
+	app.router.add_get("/_stats", stats)
+	app.router.add_get("/metrics", metrics_route)
 	app.router.add_get("/test", test)
+	app.router.add_post("/batch", batch)
 	return app
 
+def _supervise(workers: int) -> None:
+	# Starts `workers` copies of this script bound to one port and restarts any that exit; SIGTERM/SIGINT
+	# are passed on and the workers get WEB_STOP_TIMEOUT_SEC to finish what they are doing.
+	import subprocess
+	stopping = False
+
+	def stop(*_) -> None:
+		nonlocal stopping
+		stopping = True
+
+	def spawn(k: int) -> subprocess.Popen:
+		return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=dict(os.environ, WEB_WORKER_ID=str(k)))
+
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+	procs = {k: spawn(k) for k in range(workers)}
+	logging.info("supervisor: %d web workers on %s:%d pids=%s", workers, WEB_HOST, WEB_PORT, [p.pid for p in procs.values()])
+	while not stopping:
+		time.sleep(1)
+		for k, p in procs.items():
+			if p.poll() is not None and not stopping:
+				logging.warning("supervisor: web worker %d (pid %d) exited with %s, restarting", k, p.pid, p.returncode)
+				procs[k] = spawn(k)
+	for p in procs.values():
+		if p.poll() is None:
+			p.send_signal(signal.SIGTERM)
+	deadline = time.monotonic() + WEB_STOP_TIMEOUT_SEC
+	for p in procs.values():
+		try:
+			p.wait(timeout=max(0.1, deadline - time.monotonic()))
+		except subprocess.TimeoutExpired:
+			p.kill()
+
+async def _batch_cli(argv: list[str]) -> None:
+	# python main.py batch queries.jsonl: the /batch pipeline in this process, NDJSON on stdout
+	import argparse
+	ap = argparse.ArgumentParser(prog="main.py batch", description="Answer a file of queries, one NDJSON line per answer")
+	ap.add_argument("path", help="JSONL/text file with one query per line, - for stdin")
+	ap.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+	ap.add_argument("--fresh", action="store_true", help="skip the result cache")
+	args = ap.parse_args(argv)
+	if args.path == "-":
+		text = sys.stdin.read()
+	else:
+		with open(args.path, "r", encoding="utf-8") as f:
+			text = f.read()
+	runner = web.AppRunner(create_app())
+	await runner.setup()
+	try:
+		async with contextlib.aclosing(run_batch(_batch_queries(text), args.concurrency, args.fresh)) as rows:
+			async for row in rows:
+				sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+				sys.stdout.flush()
+	finally:
+		await runner.cleanup()
+
 if __name__ == "__main__":
-	web.run_app(create_app(), host="127.0.0.1", port=8000)
+	if len(sys.argv) > 1 and sys.argv[1] == "batch":
+		asyncio.run(_batch_cli(sys.argv[2:]))
+	elif WEB_WORKERS > 1 and not os.environ.get("WEB_WORKER_ID"):
+		_supervise(WEB_WORKERS)
+	else:
+		web.run_app(create_app(), host=WEB_HOST, port=WEB_PORT, reuse_port=WEB_WORKERS > 1)
@@ -0,0 +1,93 @@
+import os, time, asyncio, collections
+
+# Bytes of page bodies one instance may hold at once (split between web workers like the other limits)
+MEM_BUDGET_BYTES = int(os.getenv("MEM_BUDGET_BYTES") or 1 << 30)
+# Part of it for bodies inside the fetch workers, split evenly between them. The rest covers bodies in the
+# app process from the moment their frame is read until extraction and the page cache are done with them.
+MEM_FETCH_SHARE = float(os.getenv("MEM_FETCH_SHARE") or 0.5)
+# A body being extracted also exists pickled for the extract worker and as its parse tree there
+MEM_EXTRACT_FACTOR = 3
+# What a fetch reserves before its response arrives (capped by the request's max_bytes); the reservation is
+# then set to the real body size. Reserving the full max_bytes would cap a worker at budget / 16 MiB fetches.
+MEM_FETCH_RESERVE_BYTES = int(os.getenv("MEM_FETCH_RESERVE_BYTES") or 1 << 20)
+
+
+class MemBudget:
+	# Byte budget for one process. acquire() waits (first come, first served) while the bytes are taken;
+	# a single reservation over the whole limit is let through once nothing else is held, so it cannot
+	# wait forever.
+	def __init__(self, limit: int):
+		self.limit = max(1, int(limit))
+		self.used = 0
+		self.peak = 0
+		self.waiting: collections.deque = collections.deque()
+		self.waits = 0
+		self.wait_sec = 0.0
+
+	def _fits(self, n: int) -> bool:
+		return self.used + n <= self.limit or self.used == 0
+
+	def _take(self, n: int) -> None:
+		self.used += n
+		if self.used > self.peak:
+			self.peak = self.used
+
+	async def acquire(self, n: int) -> int:
+		if n <= 0:
+			return 0
+		if not self.waiting and self._fits(n):
+			self._take(n)
+			return n
+		fut = asyncio.get_running_loop().create_future()
+		self.waiting.append((n, fut))
+		self.waits += 1
+		t0 = time.monotonic()
+		try:
+			await fut
+		except asyncio.CancelledError:
+			if fut.done() and not fut.cancelled():
+				# granted just before the cancellation landed
+				self.release(n)
+			else:
+				self._wake()
+			raise
+		finally:
+			self.wait_sec += time.monotonic() - t0
+		return n
+
+	def release(self, n: int) -> None:
+		if n <= 0:
+			return
+		self.used = max(0, self.used - n)
+		self._wake()
+
+	def resize(self, held: int, n: int) -> int:
+		# set a reservation to n bytes once the real body size is known; growing does not wait, since the
+		# bytes are already in memory, so later reservations wait for it instead
+		if n < held:
+			self.release(held - n)
+		elif n > held:
+			self._take(n - held)
+		return n
+
+	def _wake(self) -> None:
+		while self.waiting:
+			n, fut = self.waiting[0]
+			if fut.done():
+				self.waiting.popleft()
+				continue
+			if not self._fits(n):
+				break
+			self.waiting.popleft()
+			self._take(n)
+			fut.set_result(None)
+
+	def stats(self) -> dict:
+		return {
+			"limit": self.limit,
+			"used": self.used,
+			"peak": self.peak,
+			"waiting": len(self.waiting),
+			"waits": self.waits,
+			"wait_sec": round(self.wait_sec, 3),
+		}
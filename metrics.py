@@ -0,0 +1,185 @@
+import time, bisect
+
+# Minimal Prometheus text exposition (format 0.0.4): counters, gauges and histograms with fixed label names.
+# Updates are plain attribute arithmetic on the event loop thread, so instrumenting a hot path costs well
+# under a microsecond.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_REGISTRY: list["_Metric"] = []
+
+
+def _fmt(v: float) -> str:
+	if v == float("inf"):
+		return "+Inf"
+	return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+def _escape(v: str) -> str:
+	return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+	parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+	if extra:
+		parts.append(extra)
+	return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+	kind = ""
+
+	def __init__(self, name: str, help: str, labels: tuple = (), fn=None):
+		self.name = name
+		self.help = help
+		self.label_names = tuple(labels)
+		self.children: dict[tuple, object] = {}
+		# fn() -> value, or {label values tuple: value}; read at scrape time instead of stored children
+		self.fn = fn
+		_REGISTRY.append(self)
+
+	def labels(self, *values):
+		child = self.children.get(values)
+		if child is None:
+			child = self.children[values] = self._child()
+		return child
+
+	def _child(self):
+		raise NotImplementedError
+
+	def _samples(self) -> list[str]:
+		if self.fn is None:
+			return [line for values, child in self.children.items() for line in self._render(values, child)]
+		try:
+			v = self.fn()
+		except Exception:
+			return []
+		if isinstance(v, dict):
+			return [f"{self.name}{_labels(self.label_names, k if isinstance(k, tuple) else (k,))} {_fmt(x)}" for k, x in v.items()]
+		return [f"{self.name} {_fmt(v)}"]
+
+	def render(self) -> str:
+		return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples())
+
+
+class _Value:
+	__slots__ = ("value",)
+
+	def __init__(self):
+		self.value = 0.0
+
+	def inc(self, amount: float = 1.0) -> None:
+		self.value += amount
+
+	def dec(self, amount: float = 1.0) -> None:
+		self.value -= amount
+
+	def set(self, value: float) -> None:
+		self.value = value
+
+
+class Counter(_Metric):
+	kind = "counter"
+
+	def _child(self):
+		return _Value()
+
+	def inc(self, amount: float = 1.0) -> None:
+		self.labels().inc(amount)
+
+	def _render(self, values: tuple, child: _Value) -> list[str]:
+		return [f"{self.name}{_labels(self.label_names, values)} {_fmt(child.value)}"]
+
+
+class Gauge(Counter):
+	kind = "gauge"
+
+	def set(self, value: float) -> None:
+		self.labels().set(value)
+
+
+class _Timer:
+	__slots__ = ("hist", "t0")
+
+	def __init__(self, hist: "_Hist"):
+		self.hist = hist
+
+	def __enter__(self):
+		self.t0 = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.hist.observe(time.perf_counter() - self.t0)
+		return False
+
+
+class _Hist:
+	__slots__ = ("bounds", "counts", "sum", "count", "samples")
+
+	def __init__(self, bounds: tuple, samples: list | None = None):
+		self.bounds = bounds
+		self.counts = [0] * len(bounds)
+		self.sum = 0.0
+		self.count = 0
+		# raw values for exact percentiles; only the benchmarks turn this on
+		self.samples = samples
+
+	def observe(self, value: float) -> None:
+		k = bisect.bisect_left(self.bounds, value)
+		if k < len(self.counts):
+			self.counts[k] += 1
+		self.sum += value
+		self.count += 1
+		if self.samples is not None:
+			self.samples.append(value)
+
+	def time(self) -> _Timer:
+		return _Timer(self)
+
+
+class Histogram(_Metric):
+	kind = "histogram"
+
+	def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+		self.buckets = tuple(sorted(buckets))
+		self.keep = False
+		super().__init__(name, help, labels)
+
+	def _child(self):
+		return _Hist(self.buckets, [] if self.keep else None)
+
+	def keep_samples(self) -> None:
+		self.keep = True
+		for h in self.children.values():
+			if h.samples is None:
+				h.samples = []
+
+	def samples(self) -> dict[tuple, list[float]]:
+		return {values: list(h.samples or ()) for values, h in self.children.items()}
+
+	def observe(self, value: float) -> None:
+		self.labels().observe(value)
+
+	def _render(self, values: tuple, h: _Hist) -> list[str]:
+		out = []
+		acc = 0
+		for bound, n in zip(self.buckets, h.counts):
+			acc += n
+			le = 'le="%s"' % _fmt(bound)
+			out.append(f"{self.name}_bucket{_labels(self.label_names, values, le)} {acc}")
+		le = 'le="+Inf"'
+		out.append(f"{self.name}_bucket{_labels(self.label_names, values, le)} {h.count}")
+		out.append(f"{self.name}_sum{_labels(self.label_names, values)} {_fmt(h.sum)}")
+		out.append(f"{self.name}_count{_labels(self.label_names, values)} {h.count}")
+		return out
+
+
+def render() -> str:
+	return "\n".join(m.render() for m in _REGISTRY) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Pipeline metrics shared by main and the helper modules
+STAGE_SECONDS = Histogram("leads_stage_seconds", "Latency of pipeline stages.", ("stage",))
+QUEUE_WAIT_SECONDS = Histogram("leads_queue_wait_seconds", "Time jobs spent in the scheduler queue.", ("priority",))
+FETCH_RESULTS = Counter("leads_fetch_results_total", "Fetched URLs by outcome.", ("outcome",))
+FETCH_BYTES = Counter("leads_fetch_bytes_total", "Body bytes received from fetch workers.")
@@ -0,0 +1,225 @@
+import os, json, time, hashlib, threading, logging
+from collections import OrderedDict
+
+# On-disk page cache. <url_sha>.json holds per-URL metadata (final url, validators, timestamps) and
+# points at content-addressed <body_sha>.html / <body_sha>.txt files, so mirrored pages share storage.
+# When several web workers share the directory only the one built with evict=True deletes files: every
+# sweep_sec, or when its index goes over max_bytes, it rescans the directory to see what the others
+# stored and evicts against that. The others only trim their in-memory index.
+
+# a body file no metadata points at is removed by a sweep once it is this old (a store writes it first)
+ORPHAN_GRACE_SEC = 600
+
+
+def _sha(data: bytes) -> str:
+	return hashlib.sha256(data).hexdigest()
+
+def _write_atomic(path: str, data: bytes) -> None:
+	# a private temp name: two threads may write the same content-addressed file at once
+	tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	with open(tmp, "wb") as f:
+		f.write(data)
+	os.replace(tmp, path)
+
+def _unlink(path: str) -> None:
+	try:
+		os.unlink(path)
+	except FileNotFoundError:
+		pass
+
+
+class PageCache:
+	def __init__(self, root: str, ttl: float, max_bytes: int, evict: bool = True, sweep_sec: float = 0):
+		self.root = root
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self.evict = evict
+		self.sweep_sec = sweep_sec
+		self.next_sweep = 0.0
+		self.sweeping = False
+		self.index: OrderedDict[str, dict] = OrderedDict()
+		self.bodies: dict[str, dict] = {}
+		self.total = 0
+		self.lock = threading.Lock()
+		os.makedirs(root, exist_ok=True)
+		self._load()
+
+	@staticmethod
+	def key(url: str) -> str:
+		return _sha(url.encode("utf-8"))
+
+	def _path(self, name: str) -> str:
+		return os.path.join(self.root, name)
+
+	def _scan(self) -> tuple[list[dict], dict[str, float]]:
+		# metadata of every entry whose body is on disk, and body sha -> mtime of every body file
+		metas = []
+		htmls = {}
+		for name in os.listdir(self.root):
+			if name.endswith(".html"):
+				try:
+					htmls[name[:-5]] = os.stat(self._path(name)).st_mtime
+				except OSError:
+					pass
+			elif name.endswith(".json"):
+				try:
+					with open(self._path(name), "r", encoding="utf-8") as f:
+						metas.append(json.load(f))
+				except Exception:
+					continue
+		return [m for m in metas if isinstance(m, dict) and m.get("body") in htmls and m.get("key")], htmls
+
+	def _load(self) -> None:
+		metas, _ = self._scan()
+		for meta in sorted(metas, key=lambda m: m.get("stored_at") or 0):
+			self._link(meta)
+		logging.info("page cache loaded: entries=%d bytes=%d root=%s", len(self.index), self.total, self.root)
+
+	def _link(self, meta: dict) -> None:
+		k = meta["key"]
+		self.index[k] = meta
+		b = self.bodies.get(meta["body"])
+		if b is None:
+			b = self.bodies[meta["body"]] = {"size": int(meta.get("size") or 0), "refs": set()}
+			self.total += b["size"]
+		b["refs"].add(k)
+
+	def _drop(self, k: str) -> list[str]:
+		# forgets k; returns the body files nothing in the index points at any more
+		meta = self.index.pop(k, None)
+		if meta is None:
+			return []
+		b = self.bodies.get(meta["body"])
+		if b is None:
+			return []
+		b["refs"].discard(k)
+		if b["refs"]:
+			return []
+		del self.bodies[meta["body"]]
+		self.total -= b["size"]
+		return [self._path(meta["body"] + ".html"), self._path(meta["body"] + ".txt")]
+
+	def _load_key(self, k: str) -> dict | None:
+		# an entry another web worker stored after this index was loaded
+		try:
+			with open(self._path(k + ".json"), "r", encoding="utf-8") as f:
+				meta = json.load(f)
+		except (OSError, ValueError):
+			return None
+		if meta.get("key") != k or not os.path.exists(self._path(meta["body"] + ".html")):
+			return None
+		return meta
+
+	def lookup(self, url: str) -> dict | None:
+		# blocking (a miss reads the entry's JSON): call it off the event loop
+		k = self.key(url)
+		with self.lock:
+			meta = self.index.get(k)
+			if meta is not None:
+				self.index.move_to_end(k)
+		if meta is None:
+			loaded = self._load_key(k)
+			if loaded is None:
+				return None
+			with self.lock:
+				meta = self.index.get(k)
+				if meta is None:
+					self._link(loaded)
+					meta = loaded
+		if not os.path.exists(self._path(meta["body"] + ".txt")):
+			# evicted by another worker: forget it, so the page is fetched in full rather than revalidated
+			with self.lock:
+				if self.index.get(k) is meta:
+					self._drop(k)
+			return None
+		return dict(meta, fresh=(time.time() - meta["stored_at"]) < self.ttl)
+
+	def read_text(self, meta: dict) -> str | None:
+		try:
+			with open(self._path(meta["body"] + ".txt"), "r", encoding="utf-8") as f:
+				return f.read()
+		except Exception:
+			return None
+
+	def store(self, url: str, final_url: str, body: bytes, text: str, etag: str = "", last_modified: str = "") -> None:
+		# the files are written before the lock is taken, so lookups never wait on disk writes
+		k = self.key(url)
+		body_sha = _sha(body)
+		text_b = text.encode("utf-8")
+		html_path = self._path(body_sha + ".html")
+		txt_path = self._path(body_sha + ".txt")
+		if not (os.path.exists(html_path) and os.path.exists(txt_path)):
+			_write_atomic(html_path, body)
+			_write_atomic(txt_path, text_b)
+		meta = {
+			"key": k,
+			"url": url,
+			"final_url": final_url,
+			"body": body_sha,
+			"size": len(body) + len(text_b),
+			"body_size": len(body),
+			"etag": etag,
+			"last_modified": last_modified,
+			"stored_at": time.time(),
+		}
+		_write_atomic(self._path(k + ".json"), json.dumps(meta).encode("utf-8"))
+		sweep = False
+		with self.lock:
+			garbage = [p for p in self._drop(k) if p not in (html_path, txt_path)]
+			self._link(meta)
+			if self.sweep_sec > 0:
+				# other workers may still point at these files; the sweep removes them once nothing does
+				garbage = []
+				while self.total > self.max_bytes and len(self.index) > 1:
+					self._drop(next(iter(self.index)))
+				if self.evict and not self.sweeping and (self.total > self.max_bytes or time.monotonic() >= self.next_sweep):
+					self.sweeping = sweep = True
+			elif self.evict:
+				while self.total > self.max_bytes and len(self.index) > 1:
+					old = next(iter(self.index))
+					garbage.append(self._path(old + ".json"))
+					garbage += self._drop(old)
+		for path in garbage:
+			_unlink(path)
+		if sweep:
+			self._sweep()
+
+	def _sweep(self) -> None:
+		# rebuilds the index from disk (entries this worker knows keep their LRU place, the others go first,
+		# oldest first), evicts down to max_bytes and removes orphaned bodies
+		try:
+			metas, htmls = self._scan()
+			disk = {m["key"]: m for m in metas}
+			now = time.time()
+			with self.lock:
+				order = sorted((k for k in disk if k not in self.index), key=lambda k: disk[k].get("stored_at") or 0)
+				order += [k for k in self.index if k in disk]
+				self.index = OrderedDict()
+				self.bodies = {}
+				self.total = 0
+				for k in order:
+					self._link(disk[k])
+				garbage = []
+				while self.total > self.max_bytes and len(self.index) > 1:
+					old = next(iter(self.index))
+					garbage.append(self._path(old + ".json"))
+					garbage += self._drop(old)
+				for body_sha, mtime in htmls.items():
+					if body_sha not in self.bodies and now - mtime > ORPHAN_GRACE_SEC:
+						garbage += [self._path(body_sha + ".html"), self._path(body_sha + ".txt")]
+				self.next_sweep = time.monotonic() + self.sweep_sec
+			for path in garbage:
+				_unlink(path)
+			logging.info("page cache sweep: entries=%d bytes=%d removed_files=%d", len(self.index), self.total, len(garbage))
+		finally:
+			self.sweeping = False
+
+	def touch(self, url: str) -> None:
+		k = self.key(url)
+		with self.lock:
+			meta = self.index.get(k)
+			if meta is None:
+				return
+			meta["stored_at"] = time.time()
+			data = json.dumps(meta).encode("utf-8")
+		_write_atomic(self._path(k + ".json"), data)
@@ -0,0 +1,128 @@
+import re, math
+import tokens
+
+WORD_RE = re.compile(r"\w+", re.U)
+
+# Words are cut to this many chars: a crude stemmer that folds most Russian inflections together
+STEM_CHARS = 6
+PASSAGE_MIN_CHARS = 300
+PASSAGE_MAX_CHARS = 1200
+
+STOPWORDS = frozenset((
+	"и", "в", "во", "не", "на", "с", "со", "по", "о", "об", "от", "до", "из", "у", "за", "для", "к", "ко",
+	"что", "кто", "как", "это", "или", "а", "но", "же", "ли", "бы", "сейчас",
+	"the", "of", "a", "an", "and", "or", "in", "on", "at", "to", "for", "is", "who",
+))
+
+
+def _terms(text: str) -> list[str]:
+	return [w[:STEM_CHARS] for w in WORD_RE.findall(text.lower()) if w not in STOPWORDS]
+
+def _split(text: str) -> list[str]:
+	# consecutive lines are glued into passages of at least PASSAGE_MIN_CHARS; overlong lines are cut on sentence ends
+	out = []
+	cur = []
+	size = 0
+	for ln in text.splitlines():
+		ln = ln.strip()
+		if not ln:
+			continue
+		while len(ln) > PASSAGE_MAX_CHARS:
+			cut = ln.rfind(". ", 0, PASSAGE_MAX_CHARS)
+			cut = cut + 1 if cut > 0 else PASSAGE_MAX_CHARS
+			if cur:
+				out.append("\n".join(cur))
+				cur, size = [], 0
+			out.append(ln[:cut].strip())
+			ln = ln[cut:].strip()
+		if not ln:
+			continue
+		cur.append(ln)
+		size += len(ln) + 1
+		if size >= PASSAGE_MIN_CHARS:
+			out.append("\n".join(cur))
+			cur, size = [], 0
+	if cur:
+		out.append("\n".join(cur))
+	return out
+
+
+class PassageIndex:
+	# BM25 over passages of the pages collected for one query. add() only counts query terms, so pages can be
+	# indexed as they arrive; scores use the collection statistics at select() time.
+	def __init__(self, query: str, k1: float = 1.2, b: float = 0.75):
+		self.qterms = frozenset(_terms(query))
+		self.k1 = k1
+		self.b = b
+		self.passages: list[tuple[int, int, str, dict, int]] = []
+		self.df: dict[str, int] = {}
+		self.total_len = 0
+
+	def __len__(self) -> int:
+		return len(self.passages)
+
+	def add(self, rank: int, text: str) -> None:
+		for pos, p in enumerate(_split(text or "")):
+			terms = _terms(p)
+			tf: dict[str, int] = {}
+			for t in terms:
+				if t in self.qterms:
+					tf[t] = tf.get(t, 0) + 1
+			for t in tf:
+				self.df[t] = self.df.get(t, 0) + 1
+			self.passages.append((rank, pos, p, tf, len(terms)))
+			self.total_len += len(terms)
+
+	def scores(self) -> list[float]:
+		n = len(self.passages)
+		if not n:
+			return []
+		avg = self.total_len / n or 1.0
+		idf = {t: math.log(1 + (n - df + 0.5) / (df + 0.5)) for t, df in self.df.items()}
+		out = []
+		for _, _, _, tf, length in self.passages:
+			s = 0.0
+			norm = self.k1 * (1 - self.b + self.b * length / avg)
+			for t, f in tf.items():
+				s += idf[t] * f * (self.k1 + 1) / (f + norm)
+			out.append(s)
+		return out
+
+	def select(self, budget: int, sep: str, min_rel: float = 0.1) -> tuple[str, dict]:
+		# best-scoring passages that fit in `budget` tokens, put back in page/position order. Passages scoring
+		# under min_rel of the best one are left out so the prompt stays small; with no matches at all the
+		# budget is filled in link order as before.
+		scores = self.scores()
+		top = max(scores, default=0.0)
+		order = sorted(range(len(self.passages)), key=lambda k: (-scores[k], self.passages[k][0], self.passages[k][1]))
+		if top > 0:
+			order = [k for k in order if scores[k] >= top * min_rel and scores[k] > 0]
+		left = tokens.TokenBudget(budget)
+		sep_tokens = tokens.count(sep)
+		chosen = []
+		ranks = set()
+		for k in order:
+			if left.remaining <= 0:
+				break
+			p = self.passages[k]
+			cost = tokens.count(p[2]) + (0 if p[0] in ranks else sep_tokens)
+			if cost > left.remaining:
+				continue
+			left.used += cost
+			ranks.add(p[0])
+			chosen.append(k)
+		chosen.sort(key=lambda k: (self.passages[k][0], self.passages[k][1]))
+		pages: list[list[str]] = []
+		last = None
+		for k in chosen:
+			rank, _, text, _, _ = self.passages[k]
+			if rank != last:
+				pages.append([])
+				last = rank
+			pages[-1].append(text)
+		return sep.join("\n".join(p) for p in pages), {
+			"passages": len(self.passages),
+			"kept": len(chosen),
+			"matched": sum(1 for s in scores if s > 0),
+			"tokens": left.used,
+		}
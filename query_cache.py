@@ -0,0 +1,96 @@
+import time, sqlite3, asyncio, threading, logging
+from cache import TtlCache, SingleFlight
+from serp_client import normalize_query
+
+
+class QueryCache:
+	# Final answers keyed by normalized query: in-memory TTL/LRU in front of an optional SQLite file
+	def __init__(self, ttl: float, max_entries: int, path: str | None = None):
+		self.ttl = ttl
+		self.max_entries = max(1, max_entries)
+		self.mem = TtlCache(ttl, max_entries)
+		self.flight = SingleFlight()
+		self.hits = 0
+		self.misses = 0
+		self.db: sqlite3.Connection | None = None
+		self.db_lock = threading.Lock()
+		if path:
+			self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+			self.db.execute("PRAGMA journal_mode=WAL")
+			self.db.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT NOT NULL, stored_at REAL NOT NULL)")
+			logging.info("query cache persistent at %s", path)
+
+	def close(self) -> None:
+		if self.db is not None:
+			with self.db_lock:
+				self.db.close()
+			self.db = None
+
+	def _db_get(self, key: str) -> tuple[str, float] | None:
+		with self.db_lock:
+			row = self.db.execute("SELECT answer, stored_at FROM answers WHERE key = ?", (key,)).fetchone()
+		if row is None or row[1] + self.ttl < time.time():
+			return None
+		return row[0], row[1]
+
+	def _db_put(self, key: str, answer: str) -> None:
+		with self.db_lock:
+			self.db.execute("INSERT OR REPLACE INTO answers (key, answer, stored_at) VALUES (?, ?, ?)", (key, answer, time.time()))
+			self.db.execute(
+				"DELETE FROM answers WHERE stored_at < ? OR key NOT IN (SELECT key FROM answers ORDER BY stored_at DESC LIMIT ?)",
+				(time.time() - self.ttl, self.max_entries),
+			)
+
+	async def get(self, query: str) -> str | None:
+		key = normalize_query(query)
+		ans = self.mem.get(key)
+		if ans is None and self.db is not None:
+			row = await asyncio.to_thread(self._db_get, key)
+			if row is not None:
+				ans = row[0]
+				self.mem.set(key, ans, ttl=row[1] + self.ttl - time.time())
+		return ans
+
+	async def put(self, query: str, answer: str) -> None:
+		key = normalize_query(query)
+		self.mem.set(key, answer)
+		if self.db is not None:
+			await asyncio.to_thread(self._db_put, key, answer)
+
+	async def expires_in(self, query: str) -> float | None:
+		# seconds the cached answer has left, None when there is none
+		key = normalize_query(query)
+		left = self.mem.ttl_left(key)
+		if left is None and self.db is not None:
+			row = await asyncio.to_thread(self._db_get, key)
+			if row is not None:
+				left = row[1] + self.ttl - time.time()
+		return left
+
+	async def get_or_compute(self, query: str, compute) -> str:
+		ans = await self.get(query)
+		if ans is not None:
+			self.hits += 1
+			logging.info("query cache hit: '%s'", normalize_query(query)[:200])
+			return ans
+		self.misses += 1
+		return await self.refresh(query, compute)
+
+	async def refresh(self, query: str, compute) -> str:
+		# computes and stores the answer whether or not one is cached; joins a computation already in flight
+		async def run() -> str:
+			res = await compute()
+			if res:
+				await self.put(query, res)
+			return res
+
+		return await self.flight.do(normalize_query(query), run)
+
+	def stats(self) -> dict:
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"shared": self.flight.shared,
+			"in_flight": len(self.flight.calls),
+			"entries": len(self.mem),
+		}
@@ -0,0 +1,173 @@
+import os, time, asyncio, logging
+from serp_client import normalize_query
+
+# Recompute the answers of the most asked queries before they drop out of the result cache
+REFRESH = (os.getenv("REFRESH") or "1") == "1"
+REFRESH_TOP_N = int(os.getenv("REFRESH_TOP_N") or 50)
+# A query counts as hot from this decayed hit count on; hits lose half their weight every half-life
+REFRESH_MIN_SCORE = float(os.getenv("REFRESH_MIN_SCORE") or 2)
+REFRESH_HALF_LIFE_SEC = float(os.getenv("REFRESH_HALF_LIFE_SEC") or 86400)
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY") or 1)
+# Average share of one CPU the refreshes may take (this process's CPU time around each refresh), and
+# the load average per CPU above which no refresh starts (covers the fetch and extract workers too)
+REFRESH_CPU_SHARE = float(os.getenv("REFRESH_CPU_SHARE") or 0.2)
+REFRESH_MAX_LOAD = float(os.getenv("REFRESH_MAX_LOAD") or 0.7)
+REFRESH_INTERVAL_SEC = float(os.getenv("REFRESH_INTERVAL_SEC") or 30)
+# queries tracked at most; the coldest are forgotten past twice this
+REFRESH_TRACK_MAX = 10000
+
+
+class Refresher:
+	# Counts hits per normalized query and, every `interval`, re-runs the top_n hottest whose cached answer
+	# expires within `ahead` seconds (or is gone). A refresh only starts while idle() says live traffic
+	# leaves room for it and the load is low, after waiting out the CPU budget; otherwise the round ends
+	# and the next one retries.
+	# refresh(query) runs the pipeline and stores the answer; expires_in(query) -> seconds left or None.
+	def __init__(self, refresh, expires_in, idle, ahead: float, top_n: int = REFRESH_TOP_N, min_score: float = REFRESH_MIN_SCORE,
+			half_life: float = REFRESH_HALF_LIFE_SEC, concurrency: int = REFRESH_CONCURRENCY, cpu_share: float = REFRESH_CPU_SHARE,
+			max_load: float = REFRESH_MAX_LOAD, interval: float = REFRESH_INTERVAL_SEC):
+		self.refresh = refresh
+		self.expires_in = expires_in
+		self.idle = idle
+		self.ahead = ahead
+		self.top_n = max(1, top_n)
+		self.min_score = min_score
+		self.half_life = max(1.0, half_life)
+		self.concurrency = max(1, concurrency)
+		self.cpu_share = max(0.01, cpu_share)
+		self.max_load = max_load
+		self.interval = interval
+		# key -> [score, scored_at, query text, last refresh attempt]
+		self.queries: dict[str, list] = {}
+		self.resume_at = 0.0
+		self.task: asyncio.Task | None = None
+		self.rounds = 0
+		self.refreshed = 0
+		self.empty = 0
+		self.failed = 0
+		self.deferred = 0
+		self.cpu_sec = 0.0
+
+	def start(self) -> None:
+		self.task = asyncio.create_task(self._run())
+
+	async def close(self) -> None:
+		if self.task is not None:
+			self.task.cancel()
+			await asyncio.gather(self.task, return_exceptions=True)
+			self.task = None
+
+	def _score(self, row: list, now: float) -> float:
+		return row[0] * 0.5 ** ((now - row[1]) / self.half_life)
+
+	def record(self, query: str) -> None:
+		key = normalize_query(query)
+		if not key:
+			return
+		now = time.time()
+		row = self.queries.get(key)
+		if row is None:
+			self.queries[key] = [1.0, now, query, 0.0]
+			if len(self.queries) > 2 * REFRESH_TRACK_MAX:
+				keep = sorted(self.queries.items(), key=lambda kv: self._score(kv[1], now), reverse=True)[:REFRESH_TRACK_MAX]
+				self.queries = dict(keep)
+			return
+		row[0] = self._score(row, now) + 1
+		row[1] = now
+		row[2] = query
+
+	async def due(self) -> list[str]:
+		# hottest first; a query tried within `ahead` is left alone, so one that keeps coming back empty
+		# is not re-run every round
+		now = time.time()
+		hot = sorted(((self._score(row, now), key) for key, row in self.queries.items()), reverse=True)[:self.top_n]
+		out = []
+		for score, key in hot:
+			if score < self.min_score:
+				break
+			row = self.queries[key]
+			if now - row[3] < self.ahead:
+				continue
+			left = await self.expires_in(row[2])
+			if left is None or left < self.ahead:
+				out.append(key)
+		return out
+
+	def _may_start(self) -> bool:
+		if time.monotonic() < self.resume_at or not self.idle():
+			return False
+		if self.max_load > 0:
+			try:
+				load = os.getloadavg()[0] / (os.cpu_count() or 1)
+			except OSError:
+				load = 0.0
+			if load > self.max_load:
+				return False
+		return True
+
+	async def _one(self, key: str) -> None:
+		row = self.queries.get(key)
+		if row is None:
+			return
+		row[3] = time.time()
+		t0 = time.monotonic()
+		c0 = time.process_time()
+		failed = False
+		try:
+			ans = await self.refresh(row[2])
+		except asyncio.CancelledError:
+			raise
+		except Exception:
+			logging.warning("refresh failed: '%s'", key[:200], exc_info=True)
+			failed = True
+			ans = ""
+		wall = time.monotonic() - t0
+		cpu = time.process_time() - c0
+		self.cpu_sec += cpu
+		if failed:
+			self.failed += 1
+		elif ans is None:
+			# refused (the scheduler was full): not an attempt, the next round tries again
+			row[3] = 0.0
+			self.deferred += 1
+		elif ans:
+			self.refreshed += 1
+		else:
+			self.empty += 1
+		# the CPU budget: no new refresh until this one's CPU time is at most cpu_share of the time since it started
+		self.resume_at = max(self.resume_at, time.monotonic() + cpu / self.cpu_share - wall)
+		logging.info("refresh '%s' answer=%s wall_ms=%d cpu_ms=%d", key[:200], bool(ans), int(wall * 1000), int(cpu * 1000))
+
+	async def _drain(self, keys: list[str]) -> None:
+		while keys:
+			wait = self.resume_at - time.monotonic()
+			if 0 < wait < self.interval:
+				await asyncio.sleep(wait)
+			if not self._may_start() or not keys:
+				self.deferred += len(keys)
+				keys.clear()
+				return
+			await self._one(keys.pop(0))
+
+	async def _run(self) -> None:
+		while True:
+			await asyncio.sleep(self.interval)
+			self.rounds += 1
+			try:
+				keys = await self.due()
+				await asyncio.gather(*[self._drain(keys) for _ in range(self.concurrency)])
+			except asyncio.CancelledError:
+				raise
+			except Exception:
+				logging.exception("refresh round failed")
+
+	def stats(self) -> dict:
+		return {
+			"tracked": len(self.queries),
+			"rounds": self.rounds,
+			"refreshed": self.refreshed,
+			"empty": self.empty,
+			"failed": self.failed,
+			"deferred": self.deferred,
+			"cpu_sec": round(self.cpu_sec, 3),
+		}
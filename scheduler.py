@@ -0,0 +1,145 @@
+import time, heapq, asyncio, logging
+from metrics import QUEUE_WAIT_SECONDS
+
+PRIO_INTERACTIVE = 0
+PRIO_BATCH = 1
+PRIO_REFRESH = 2
+PRIO_NAMES = {PRIO_INTERACTIVE: "interactive", PRIO_BATCH: "batch", PRIO_REFRESH: "refresh"}
+
+
+class _Job:
+	__slots__ = ("prio", "seq", "key", "fn", "label", "future", "queued_at")
+
+	def __init__(self, prio: int, seq: int, key, fn, label: str):
+		self.prio = prio
+		self.seq = seq
+		self.key = key
+		self.fn = fn
+		self.label = label
+		self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+		self.queued_at = time.monotonic()
+
+	def __lt__(self, other: "_Job") -> bool:
+		return (self.prio, self.seq) < (other.prio, other.seq)
+
+
+class Scheduler:
+	# Fixed set of worker tasks draining a bounded priority queue; at most per_key jobs run for one key
+	# (chat) at a time, and submit() refuses work instead of queueing past max_queue.
+	def __init__(self, workers: int, max_queue: int, per_key: int):
+		self.workers = max(1, workers)
+		self.max_queue = max(0, max_queue)
+		self.per_key = max(1, per_key)
+		self.heap: list[_Job] = []
+		self.running: dict = {}
+		self.seq = 0
+		self.wake = asyncio.Event()
+		self.tasks: list[asyncio.Task] = []
+		self.submitted = 0
+		self.rejected = 0
+		self.done = 0
+		self.wait_ms_max = 0
+		self.wait_ms_total = 0
+
+	def start(self) -> None:
+		self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+	async def close(self) -> None:
+		for task in self.tasks:
+			task.cancel()
+		await asyncio.gather(*self.tasks, return_exceptions=True)
+		self.tasks = []
+		for job in self.heap:
+			if not job.future.done():
+				job.future.cancel()
+		self.heap.clear()
+
+	def queued(self) -> int:
+		return len(self.heap)
+
+	def busy(self) -> int:
+		return sum(self.running.values())
+
+	def submit(self, fn, key=None, prio: int = PRIO_INTERACTIVE, label: str = "") -> asyncio.Future | None:
+		# fn is a zero-arg coroutine function; returns None when the queue is full
+		if len(self.heap) >= self.max_queue:
+			self.rejected += 1
+			logging.warning("scheduler shed key=%s prio=%d queue=%d running=%d", str(key), prio, len(self.heap), self.busy())
+			return None
+		self.seq += 1
+		job = _Job(prio, self.seq, key, fn, label)
+		heapq.heappush(self.heap, job)
+		self.submitted += 1
+		self.wake.set()
+		return job.future
+
+	def _pop(self) -> _Job | None:
+		# best job whose key is under its running limit; jobs skipped for their key keep their place
+		skipped = []
+		job = None
+		while self.heap:
+			cand = heapq.heappop(self.heap)
+			if cand.future.cancelled():
+				continue
+			if cand.key is not None and self.running.get(cand.key, 0) >= self.per_key:
+				skipped.append(cand)
+				continue
+			job = cand
+			break
+		for cand in skipped:
+			heapq.heappush(self.heap, cand)
+		return job
+
+	async def _worker(self) -> None:
+		while True:
+			job = self._pop()
+			if job is None:
+				self.wake.clear()
+				await self.wake.wait()
+				continue
+			self.running[job.key] = self.running.get(job.key, 0) + 1
+			wait_ms = int((time.monotonic() - job.queued_at) * 1000)
+			self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+			self.wait_ms_total += wait_ms
+			QUEUE_WAIT_SECONDS.labels(PRIO_NAMES.get(job.prio, str(job.prio))).observe(wait_ms / 1000.0)
+			t0 = time.monotonic()
+			try:
+				res = await job.fn()
+				if not job.future.done():
+					job.future.set_result(res)
+			except asyncio.CancelledError as e:
+				# only the worker being cancelled ends the loop; a job that raised CancelledError just fails
+				if asyncio.current_task().cancelling():
+					if not job.future.done():
+						job.future.cancel()
+					raise
+				if not job.future.done():
+					job.future.set_exception(e)
+			except Exception as e:
+				if not job.future.done():
+					job.future.set_exception(e)
+			finally:
+				self.done += 1
+				n = self.running.get(job.key, 0) - 1
+				if n > 0:
+					self.running[job.key] = n
+				else:
+					self.running.pop(job.key, None)
+				logging.info(
+					"scheduler job=%s key=%s prio=%d wait_ms=%d run_ms=%d queue=%d",
+					job.label, str(job.key), job.prio, wait_ms, int((time.monotonic() - t0) * 1000), len(self.heap),
+				)
+				# a finished job may unblock a queued job for the same key
+				if job.key is not None and self.heap:
+					self.wake.set()
+
+	def stats(self) -> dict:
+		return {
+			"queued": len(self.heap),
+			"running": self.busy(),
+			"submitted": self.submitted,
+			"rejected": self.rejected,
+			"done": self.done,
+			"wait_ms_max": self.wait_ms_max,
+			"wait_ms_avg": int(self.wait_ms_total / self.done) if self.done else 0,
+		}
@@ -0,0 +1,71 @@
+import time, asyncio, logging
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, ClientConnectorError
+from cache import TtlCache, SingleFlight
+
+
+def normalize_query(query: str) -> str:
+	return " ".join((query or "").lower().split())
+
+
+class SerpClient:
+	def __init__(self, base_url: str, timeout: float, ttl: float, max_entries: int, pool_size: int = 16):
+		self.base = base_url.rstrip("/")
+		self.url = self.base + "/search"
+		self.timeout = timeout
+		self.pool_size = pool_size
+		self.cache = TtlCache(ttl, max_entries)
+		self.flight = SingleFlight()
+		self.session: ClientSession | None = None
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb):
+		await self.close()
+
+	def _session(self) -> ClientSession:
+		if self.session is None or self.session.closed:
+			self.session = ClientSession(
+				connector=TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+				timeout=ClientTimeout(total=self.timeout),
+			)
+		return self.session
+
+	async def close(self) -> None:
+		if self.session is not None and not self.session.closed:
+			await self.session.close()
+		self.session = None
+
+	async def warm(self, timeout: float) -> None:
+		# leaves a keep-alive connection in the pool; the status does not matter
+		async with self._session().head(self.base + "/", timeout=ClientTimeout(total=timeout)) as resp:
+			await resp.read()
+
+	async def search(self, query: str):
+		key = normalize_query(query)
+		obj = self.cache.get(key)
+		if obj is not None:
+			return obj
+		return await self.flight.do(key, lambda: self._fetch(key, query))
+
+	async def _fetch(self, key: str, query: str):
+		obj = []
+		t0 = time.monotonic()
+		try:
+			async with self._session().get(self.url, params={"q": query}) as resp:
+				if resp.status >= 400:
+					logging.warning("yandex ms http=%s", resp.status)
+				elif resp.content_type == "application/json":
+					obj = await resp.json()
+					if obj:
+						self.cache.set(key, obj)
+				else:
+					logging.warning("yandex ms non-json response")
+		except asyncio.TimeoutError:
+			logging.warning("yandex ms timeout: %s", self.url)
+		except ClientConnectorError as e:
+			logging.warning("yandex ms unreachable: %s", str(e))
+		except Exception:
+			logging.exception("yandex ms request failed")
+		logging.debug("yandex ms fetched in %.2fs cached=%d", time.monotonic() - t0, len(self.cache))
+		return obj
@@ -0,0 +1,157 @@
+import os, ssl, json, zlib, random, asyncio, subprocess
+from aiohttp import web
+
+# Local stand-ins for the external services, used by bench.py
+
+
+def serp_app(delay: float = 0.5, links: int = 10, site_base: str | list[str] = "http://127.0.0.1:1", common: int = 0) -> web.Application:
+	# links are spread over the site_base list round-robin, like results from different hosts; the first
+	# `common` links are the same for every query, like the registries that show up for any company name
+	app = web.Application()
+	app["hits"] = 0
+	bases = [site_base] if isinstance(site_base, str) else list(site_base)
+
+	async def search(request: web.Request) -> web.Response:
+		app["hits"] += 1
+		q = (request.query.get("q") or "").strip()
+		await asyncio.sleep(delay)
+		h = zlib.crc32(q.encode("utf-8")) % 1000
+		return web.json_response([
+			{"link": f"{bases[k % len(bases)]}/common/{k}.html" if k < common else f"{bases[(h + k) % len(bases)]}/{h}/{k}.html", "text": f"{q} snippet {k}"}
+			for k in range(links)
+		])
+
+	app.router.add_get("/search", search)
+	return app
+
+def llm_app(answer: str = "Иван Петрович Сидоров", tail_tokens: int = 200, token_delay: float = 0.01, reject_every: int = 0) -> web.Application:
+	# OpenAI-compatible /chat/completions that streams the answer, a newline and then a long tail
+	app = web.Application()
+	app["hits"] = 0
+	app["rejected"] = 0
+
+	async def completions(request: web.Request) -> web.StreamResponse:
+		app["hits"] += 1
+		if reject_every and app["hits"] % reject_every == 0:
+			app["rejected"] += 1
+			return web.json_response({"error": {"message": "rate limited"}}, status=429, headers={"retry-after": "0.2"})
+		req = await request.json()
+		pieces = answer.split(" ")
+		pieces = [p + " " for p in pieces[:-1]] + [pieces[-1], "\n"] + ["lorem "] * tail_tokens
+		# like the real API, generation ends before the first stop sequence, which is not sent
+		stop = req.get("stop") or []
+		for k, p in enumerate(pieces):
+			if any(s in p for s in stop):
+				pieces = pieces[:k]
+				break
+		if not req.get("stream"):
+			await asyncio.sleep(token_delay * len(pieces))
+			return web.json_response({"choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)}}]})
+		resp = web.StreamResponse(headers={"content-type": "text/event-stream"})
+		await resp.prepare(request)
+		try:
+			for p in pieces:
+				await asyncio.sleep(token_delay)
+				chunk = {"choices": [{"index": 0, "delta": {"content": p}}]}
+				await resp.write(("data: " + json.dumps(chunk, ensure_ascii=False) + "\n\n").encode("utf-8"))
+			await resp.write(b"data: [DONE]\n\n")
+		except (ConnectionResetError, asyncio.CancelledError):
+			pass
+		return resp
+
+	async def models(_: web.Request) -> web.Response:
+		return web.json_response({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+	app.router.add_post("/chat/completions", completions)
+	app.router.add_get("/models", models)
+	return app
+
+def telegram_app(chat_interval: float = 1.0, global_rps: float = 30) -> web.Application:
+	# Bot API stand-in that answers 429 with retry_after when a chat or the bot goes over the limits
+	app = web.Application()
+	app["calls"] = 0
+	app["rejected"] = 0
+	app["methods"] = {}
+	last_chat: dict = {}
+	recent: list = []
+	ids = iter(range(1, 1 << 31))
+
+	async def method(request: web.Request) -> web.Response:
+		loop = asyncio.get_running_loop()
+		now = loop.time()
+		app["calls"] += 1
+		body = await request.json()
+		chat_id = body.get("chat_id")
+		name = request.match_info["method"]
+		app["methods"][name] = app["methods"].get(name, 0) + 1
+		while recent and recent[0] < now - 1.0:
+			recent.pop(0)
+		gap = now - last_chat.get(chat_id, -1e9)
+		if gap < chat_interval * 0.9 or len(recent) >= global_rps:
+			app["rejected"] += 1
+			return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": 1}})
+		last_chat[chat_id] = now
+		recent.append(now)
+		if name == "sendMessage":
+			return web.json_response({"ok": True, "result": {"message_id": next(ids), "chat": {"id": chat_id}}})
+		return web.json_response({"ok": True, "result": True})
+
+	app.router.add_post("/bot{token}/{method}", method)
+	return app
+
+def load_corpus(root: str, limit: int = 500) -> list[bytes]:
+	# recorded pages, e.g. the page cache directory with its <sha>.html bodies
+	out = []
+	for name in sorted(os.listdir(root)) if os.path.isdir(root) else ():
+		if name.endswith((".html", ".htm")):
+			with open(os.path.join(root, name), "rb") as f:
+				out.append(f.read())
+			if len(out) >= limit:
+				break
+	return out
+
+def site_app(page_bytes: int = 50000, delay: float = 0.05, delay_sigma: float = 0.0, size_sigma: float = 0.0, corpus: list[bytes] | None = None) -> web.Application:
+	# Any path returns an HTML page after a delay. With a corpus the page is one of the recorded ones, else a
+	# generated page of about page_bytes. delay_sigma/size_sigma > 0 draw delay and size from a lognormal
+	# around the given median, seeded by the path so a replay sees the same page each time.
+	app = web.Application()
+	app["hits"] = 0
+	filler = ("<p>" + "Генеральный директор компании Иван Петрович Сидоров. " * 8 + "</p>\n").encode("utf-8")
+
+	async def page(request: web.Request) -> web.Response:
+		# ?size= and ?type= override the page size and content type for one request
+		app["hits"] += 1
+		rnd = random.Random(request.path)
+		await asyncio.sleep(delay * rnd.lognormvariate(0, delay_sigma) if delay_sigma else delay)
+		ctype = request.query.get("type") or "text/html"
+		charset = "utf-8" if ctype.startswith("text/") else None
+		if corpus and "size" not in request.query:
+			# recorded bytes as they were served; the extractor sniffs their encoding
+			body = corpus[rnd.randrange(len(corpus))]
+			charset = None
+		else:
+			size = int(request.query.get("size") or (page_bytes * rnd.lognormvariate(0, size_sigma) if size_sigma else page_bytes))
+			body = b"<html><head><title>" + request.path.encode("utf-8") + b"</title></head><body>" + filler * max(1, size // len(filler)) + b"</body></html>"
+		return web.Response(body=body, content_type=ctype, charset=charset)
+
+	app.router.add_get("/{path:.*}", page)
+	return app
+
+def self_signed_context(workdir: str) -> ssl.SSLContext:
+	cert, key = os.path.join(workdir, "stub.crt"), os.path.join(workdir, "stub.key")
+	if not os.path.exists(cert):
+		subprocess.run(
+			["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert],
+			check=True, capture_output=True,
+		)
+	ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+	ctx.load_cert_chain(cert, key)
+	return ctx
+
+async def start(app: web.Application, host: str = "127.0.0.1", port: int = 0, ssl_context: ssl.SSLContext | None = None) -> tuple[web.AppRunner, str]:
+	runner = web.AppRunner(app, access_log=None)
+	await runner.setup()
+	site = web.TCPSite(runner, host, port, ssl_context=ssl_context)
+	await site.start()
+	sock = site._server.sockets[0]
+	return runner, ("https" if ssl_context else "http") + "://%s:%d" % sock.getsockname()[:2]
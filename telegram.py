@@ -0,0 +1,155 @@
+import time, asyncio, logging
+from collections import deque
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from metrics import STAGE_SECONDS
+
+
+class _Op:
+	__slots__ = ("method", "payload", "future", "key", "attempts")
+
+	def __init__(self, method: str, payload: dict, key: tuple | None = None):
+		self.method = method
+		self.payload = payload
+		self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+		self.key = key
+		self.attempts = 0
+
+
+class TelegramClient:
+	# One app-lifetime session; every Bot API call goes through a dispatcher that keeps calls to a chat
+	# in order, spaces them by chat_interval, caps the global rate and retries 429s after retry_after.
+	def __init__(self, bot_token: str, api_base: str, global_rps: float, chat_interval: float, max_attempts: int = 5):
+		self.base = f"{api_base.rstrip('/')}/bot{bot_token}"
+		self.global_interval = 1.0 / global_rps if global_rps > 0 else 0.0
+		self.chat_interval = chat_interval
+		self.max_attempts = max_attempts
+		self.queues: dict[int, deque] = {}
+		self.next_at: dict[int, float] = {}
+		self.busy: set[int] = set()
+		self.global_next = 0.0
+		self.wake = asyncio.Event()
+		self.session: ClientSession | None = None
+		self.runner: asyncio.Task | None = None
+		self.inflight: set[asyncio.Task] = set()
+		self.sent = 0
+		self.retried = 0
+		self.coalesced = 0
+
+	def start(self) -> None:
+		self.session = ClientSession(connector=TCPConnector(limit=32, keepalive_timeout=120), timeout=ClientTimeout(total=30))
+		self.runner = asyncio.create_task(self._run())
+
+	async def close(self) -> None:
+		if self.runner is not None:
+			self.runner.cancel()
+			self.runner = None
+		for q in self.queues.values():
+			for op in q:
+				if not op.future.done():
+					op.future.set_result(None)
+		self.queues.clear()
+		if self.session is not None:
+			await self.session.close()
+			self.session = None
+
+	async def warm(self, timeout: float) -> None:
+		# getMe costs nothing against the send limits and leaves a connection to the Bot API in the pool
+		async with self.session.get(f"{self.base}/getMe", timeout=ClientTimeout(total=timeout)) as resp:
+			data = await resp.json(content_type=None)
+		if isinstance(data, dict) and not data.get("ok", False):
+			logging.warning("telegram getMe failed: %s", str(data.get("description") or "")[:200])
+
+	def queue_depth(self) -> int:
+		return sum(len(q) for q in self.queues.values())
+
+	def _enqueue(self, chat_id: int, op: _Op) -> asyncio.Future:
+		self.queues.setdefault(chat_id, deque()).append(op)
+		self.wake.set()
+		return op.future
+
+	async def send_message(self, chat_id: int, text: str) -> int | None:
+		data = await self._enqueue(chat_id, _Op("sendMessage", {"chat_id": chat_id, "text": text}))
+		return ((data or {}).get("result") or {}).get("message_id")
+
+	def edit_message_text(self, chat_id: int, message_id: int, text: str) -> asyncio.Future:
+		key = ("edit", message_id)
+		for op in self.queues.get(chat_id, ()):
+			if op.key == key:
+				# a newer text replaces the queued one instead of costing a second call
+				op.payload["text"] = text
+				self.coalesced += 1
+				return op.future
+		return self._enqueue(chat_id, _Op("editMessageText", {"chat_id": chat_id, "message_id": message_id, "text": text}, key))
+
+	def delete_message(self, chat_id: int, message_id: int) -> asyncio.Future:
+		q = self.queues.get(chat_id)
+		if q:
+			for op in [op for op in q if op.key == ("edit", message_id)]:
+				q.remove(op)
+				op.future.set_result(None)
+				self.coalesced += 1
+		return self._enqueue(chat_id, _Op("deleteMessage", {"chat_id": chat_id, "message_id": message_id}))
+
+	async def _run(self) -> None:
+		loop = asyncio.get_running_loop()
+		while True:
+			now = loop.time()
+			chosen = None
+			wait = None
+			for chat_id, q in list(self.queues.items()):
+				if chat_id in self.busy:
+					continue
+				if not q:
+					del self.queues[chat_id]
+					if self.next_at.get(chat_id, 0.0) <= now:
+						self.next_at.pop(chat_id, None)
+					continue
+				t = self.next_at.get(chat_id, 0.0)
+				if t <= now:
+					if chosen is None or t < self.next_at.get(chosen, 0.0):
+						chosen = chat_id
+				else:
+					wait = t - now if wait is None else min(wait, t - now)
+			if chosen is None:
+				self.wake.clear()
+				try:
+					await asyncio.wait_for(self.wake.wait(), timeout=wait)
+				except asyncio.TimeoutError:
+					pass
+				continue
+			if self.global_next > now:
+				await asyncio.sleep(self.global_next - now)
+				continue
+			self.global_next = now + self.global_interval
+			self.next_at[chosen] = now + self.chat_interval
+			self.busy.add(chosen)
+			task = asyncio.create_task(self._send(chosen, self.queues[chosen].popleft()))
+			self.inflight.add(task)
+			task.add_done_callback(self.inflight.discard)
+
+	async def _send(self, chat_id: int, op: _Op) -> None:
+		loop = asyncio.get_running_loop()
+		data = None
+		try:
+			op.attempts += 1
+			t0 = time.perf_counter()
+			async with self.session.post(f"{self.base}/{op.method}", json=op.payload) as resp:
+				data = await resp.json(content_type=None)
+			STAGE_SECONDS.labels("telegram").observe(time.perf_counter() - t0)
+			self.sent += 1
+			if isinstance(data, dict) and data.get("error_code") == 429 and op.attempts < self.max_attempts:
+				retry_after = float(((data.get("parameters") or {}).get("retry_after")) or 1)
+				logging.warning("telegram 429 method=%s chat_id=%s retry_after=%.1fs", op.method, str(chat_id), retry_after)
+				self.retried += 1
+				self.next_at[chat_id] = loop.time() + retry_after
+				self.queues.setdefault(chat_id, deque()).appendleft(op)
+				return
+			if isinstance(data, dict) and not data.get("ok", False):
+				logging.warning("telegram %s failed: %s", op.method, str(data.get("description") or "")[:200])
+		except Exception:
+			logging.warning("telegram %s request failed", op.method, exc_info=True)
+		finally:
+			self.busy.discard(chat_id)
+			self.wake.set()
+		if not op.future.done():
+			op.future.set_result(data)
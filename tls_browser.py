@@ -1,16 +1,83 @@
-import os, asyncio
+import os, time, asyncio, inspect, functools
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 import tls_client
+from membudget import MemBudget, MEM_FETCH_RESERVE_BYTES
+
+# Links that are never worth downloading as pages; the check is on the URL path before any request
+SKIP_EXTENSIONS = (
+	".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".rtf", ".odt",
+	".zip", ".rar", ".7z", ".gz", ".tar", ".exe", ".apk", ".dmg", ".iso",
+	".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".bmp", ".ico",
+	".mp3", ".mp4", ".avi", ".mov", ".mkv", ".webm", ".wav",
+)
+
+
+def _skip_by_extension(url: str) -> bool:
+	return urlsplit(url).path.lower().endswith(SKIP_EXTENSIONS)
+
+def _can_stream(session) -> bool:
+	# tls_client builds that stream bodies take stream= on the request method or on execute_request,
+	# which get()/post() pass their keyword arguments to
+	for name in ("get", "execute_request"):
+		try:
+			if "stream" in inspect.signature(getattr(session, name)).parameters:
+				return True
+		except (AttributeError, TypeError, ValueError):
+			pass
+	return False
+
+def _is_text_type(content_type: str) -> bool:
+	# no header means we can't tell, so the body is read; 304s carry none either
+	ct = content_type.split(";", 1)[0].strip().lower()
+	return not ct or ct.startswith("text/") or ct.endswith(("+xml", "/xml", "/xhtml", "/json")) or ct == "application/xhtml+xml"
+
+def _read_capped(resp, max_bytes: int, content_length) -> tuple[bytearray, int, bool]:
+	# streams into one buffer sized from content-length (when known and under the cap) and stops at max_bytes
+	try:
+		size = min(int(content_length), max_bytes)
+	except (TypeError, ValueError):
+		size = 0
+	buf = bytearray(size)
+	n = 0
+	raw = 0
+	for chunk in resp.iter_content(chunk_size=65536):
+		if not chunk:
+			break
+		raw += len(chunk)
+		take = min(len(chunk), max_bytes - n)
+		# in place while inside the preallocated part, appends past it
+		buf[n:n + take] = memoryview(chunk)[:take]
+		n += take
+		if n >= max_bytes:
+			del buf[n:]
+			return buf, raw, True
+	del buf[n:]
+	return buf, raw, False
 
 
 class TlsBrowser:
-	def __init__(self, user_agent: str, proxy: str | None):
+	# Blocking tls_client calls run on an executor owned by the browser and sized to `concurrency`,
+	# so that many fetches are really in flight; per_host caps parallel requests to one host.
+	# With a budget, each request first reserves MEM_FETCH_RESERVE_BYTES (tls_client hands over whole bodies,
+	# so the size is only known afterwards), resized to the body; the result's 'reserved' bytes are the
+	# caller's to release.
+	def __init__(self, user_agent: str, proxy: str | None, concurrency: int = 10, per_host: int = 6, insecure: bool = False, budget: MemBudget | None = None):
 		self.user_agent = user_agent
+		self.budget = budget
 		self.proxy = proxy
-		profile = "chrome_140"
+		self.insecure = insecure
+		profile = os.getenv("TLS_CLIENT_PROFILE") or "chrome_140"
 		self.session = tls_client.Session(
 			client_identifier=profile,
 			random_tls_extension_order=True,
 		)
+		self.stream = _can_stream(self.session)
+		self.concurrency = max(1, concurrency)
+		self.per_host = max(1, per_host)
+		self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="tls")
+		self.sem = asyncio.Semaphore(self.concurrency)
+		self.hosts: dict[str, list] = {}
 
 	async def __aenter__(self):
 		return self
@@ -19,6 +86,9 @@ class TlsBrowser:
 		await self.aclose()
 
 	def close(self) -> None:
+		executor = getattr(self, 'executor', None)
+		if executor is not None:
+			executor.shutdown(wait=False, cancel_futures=True)
 		try:
 			close = getattr(self.session, 'close', None)
 			if callable(close):
@@ -45,96 +115,133 @@ class TlsBrowser:
 		except Exception:
 			pass
 
-	async def _do(self, method: str, url: str, headers: dict, timeout: int, follow: bool, max_bytes: int | None = None) -> dict:
+	async def _call(self, busy: list, fn, *args, **kwargs):
+		# busy collects the executor futures, so get() can tell whether a thread is still on the call
+		cf = self.executor.submit(functools.partial(fn, *args, **kwargs))
+		busy.append(cf)
+		return await asyncio.wrap_future(cf)
+
+	async def _host_slot(self, host: str):
+		# [semaphore, users]; dropped once nobody holds or waits for it so the map stays small
+		slot = self.hosts.get(host)
+		if slot is None:
+			slot = self.hosts[host] = [asyncio.Semaphore(self.per_host), 0]
+		slot[1] += 1
+		try:
+			await slot[0].acquire()
+		except BaseException:
+			self._host_release(host, slot, False)
+			raise
+		return slot
+
+	def _host_release(self, host: str, slot: list, acquired: bool = True) -> None:
+		if acquired:
+			slot[0].release()
+		slot[1] -= 1
+		if slot[1] == 0 and self.hosts.get(host) is slot:
+			del self.hosts[host]
+
+	async def _do(self, busy: list, method: str, url: str, headers: dict, timeout: int, follow: bool, max_bytes: int | None = None) -> dict:
 		h = dict(headers)
 		h['User-Agent'] = self.user_agent
 		kwargs = {
 			'headers': h,
 			'allow_redirects': follow,
+			# tls_client keeps a native client, with its own keep-alive pool, per distinct timeout value,
+			# so callers should stick to one timeout to share connections across hosts and requests
 			'timeout_seconds': timeout,
 		}
+		if self.insecure:
+			kwargs['insecure_skip_verify'] = True
 		if self.proxy:
 			kwargs['proxy'] = self.proxy
 		try:
 			MAX_BYTES = int(max_bytes if max_bytes is not None else int(os.environ.get('HTTP_MAX_BYTES', '8192')))
 		except Exception:
 			MAX_BYTES = 8192
+		fn = getattr(self.session, method)
+		t0 = time.monotonic()
+		if self.stream:
+			kwargs['stream'] = True
+		# without streaming support the body arrives in one piece and is capped below
+		resp = await self._call(busy, fn, url, **kwargs)
+		try:
+			resp_headers = {str(k).lower(): (v if isinstance(v, str) else ", ".join(map(str, v))) for k, v in (resp.headers or {}).items()}
+		except Exception:
+			resp_headers = {}
+		skipped = None
+		raw_bytes = 0
 		body = b''
-		resp = None
 		aborted_at_cap = False
-		if follow:
-			resp = await asyncio.to_thread(getattr(self.session, method), url, **kwargs)
+		if not _is_text_type(resp_headers.get('content-type') or ''):
+			skipped = 'content_type'
+		elif callable(getattr(resp, 'iter_content', None)):
+			body, raw_bytes, aborted_at_cap = await self._call(busy, _read_capped, resp, MAX_BYTES, resp_headers.get('content-length'))
+		else:
 			try:
 				content = resp.content if getattr(resp, 'content', None) is not None else b''
 			except Exception:
 				content = b''
-			try:
-				body = bytes(content[:MAX_BYTES])
-			except Exception:
-				body = b''
-			try:
-				aborted_at_cap = isinstance(content, (bytes, bytearray)) and len(content) > MAX_BYTES
-			except Exception:
-				aborted_at_cap = False
-			try:
-				close = getattr(resp, 'close', None)
-				if callable(close):
-					close()
-			except Exception:
-				pass
-		else:
-			try:
-				resp = await asyncio.to_thread(getattr(self.session, method), url, stream=True, **kwargs)
-				iter_content = getattr(resp, 'iter_content', None)
-				if callable(iter_content):
-					for chunk in iter_content(chunk_size=2048):
-						if not chunk:
-							break
-						remaining = MAX_BYTES - len(body)
-						if remaining <= 0:
-							aborted_at_cap = True
-							break
-						body += bytes(chunk[:remaining])
-						if len(body) >= MAX_BYTES:
-							aborted_at_cap = True
-							break
-					try:
-						close = getattr(resp, 'close', None)
-						if callable(close):
-							close()
-					except Exception:
-						pass
-				else:
-					raise RuntimeError('streaming_not_supported')
-			except Exception:
-				# Fallback to non-streaming fetch
-				resp = await asyncio.to_thread(getattr(self.session, method), url, **kwargs)
-				try:
-					content = resp.content if getattr(resp, 'content', None) is not None else b''
-				except Exception:
-					content = b''
-				try:
-					body = bytes(content[:MAX_BYTES])
-				except Exception:
-					body = b''
-				try:
-					aborted_at_cap = isinstance(content, (bytes, bytearray)) and len(content) > MAX_BYTES
-				except Exception:
-					aborted_at_cap = False
-				try:
-					close = getattr(resp, 'close', None)
-					if callable(close):
-						close()
-				except Exception:
-					pass
+			raw_bytes = len(content)
+			aborted_at_cap = raw_bytes > MAX_BYTES
+			# slicing copies, so only do it when the body is actually over the cap
+			body = content[:MAX_BYTES] if aborted_at_cap else content
+		try:
+			close = getattr(resp, 'close', None)
+			if callable(close):
+				close()
+		except Exception:
+			pass
 		try:
 			final_url = str(resp.url)
 		except Exception:
 			final_url = url
 		status = getattr(resp, 'status_code', None)
-		return {'status': status, 'url': final_url, 'content': body, 'aborted_at_cap': aborted_at_cap}
+		elapsed_ms = (time.monotonic() - t0) * 1000
+		return {'status': status, 'url': final_url, 'content': body, 'headers': resp_headers, 'aborted_at_cap': aborted_at_cap, 'skipped': skipped, 'raw_bytes': raw_bytes, 'elapsed_ms': elapsed_ms}
 
 	async def get(self, url: str, headers: dict, timeout: int = 10, follow: bool = False, max_bytes: int | None = None) -> dict:
-		return await self._do('get', url, headers, timeout, follow=follow, max_bytes=max_bytes)
+		if _skip_by_extension(url):
+			return {'status': None, 'url': url, 'content': b'', 'headers': {}, 'aborted_at_cap': False, 'skipped': 'extension', 'raw_bytes': 0}
+		host = (urlsplit(url).hostname or "").lower()
+		slot = await self._host_slot(host)
+		try:
+			await self.sem.acquire()
+		except BaseException:
+			self._host_release(host, slot)
+			raise
+		busy: list = []
+		held = 0
+		try:
+			held = await self.budget.acquire(min(max_bytes or MEM_FETCH_RESERVE_BYTES, MEM_FETCH_RESERVE_BYTES)) if self.budget is not None else 0
+			# guard in case the native timeout does not fire; raises asyncio.TimeoutError
+			res = await asyncio.wait_for(self._do(busy, 'get', url, headers, timeout, follow=follow, max_bytes=max_bytes), timeout + 1)
+			res['reserved'] = self.budget.resize(held, len(res['content'])) if held else 0
+			held = 0
+			return res
+		finally:
+			self._release_after(busy, host, slot, held)
+
+	def _release_after(self, busy: list, host: str, slot: list, held: int) -> None:
+		# A cancelled or timed-out call leaves its thread running. Its slots stay taken until the thread
+		# returns, so the next fetches wait for a free thread before their deadline starts instead of
+		# timing out queued behind it.
+		def release() -> None:
+			if held:
+				self.budget.release(held)
+			self.sem.release()
+			self._host_release(host, slot)
+		# the calls of one get() run one after another, so only the last can still be running
+		if not busy or busy[-1].done():
+			release()
+			return
+		loop = asyncio.get_running_loop()
+		def done(_) -> None:
+			try:
+				loop.call_soon_threadsafe(release)
+			except RuntimeError:
+				# the loop is gone, and the semaphores with it
+				pass
+		busy[-1].add_done_callback(done)
 
 
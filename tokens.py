@@ -0,0 +1,65 @@
+import functools
+import tiktoken
+
+ENCODING = "cl100k_base"
+
+# Initial slice is this many chars per wanted token; doubled until enough tokens come out.
+# cl100k averages ~2-4 chars per token on Russian/English text, so one or two rounds usually suffice.
+CHARS_PER_TOKEN_GUESS = 6
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoder() -> tiktoken.Encoding:
+	return tiktoken.get_encoding(ENCODING)
+
+def prewarm() -> None:
+	get_encoder().encode("прогрев токенизатора")
+
+def count(text: str) -> int:
+	return len(get_encoder().encode(text)) if text else 0
+
+def encode_prefix(text: str, limit: int) -> tuple[list[int], bool]:
+	# Encodes just enough of text to yield `limit` tokens. Returns (tokens[:limit], whole_text_encoded).
+	if not text or limit <= 0:
+		return [], not text
+	enc = get_encoder()
+	n = limit * CHARS_PER_TOKEN_GUESS
+	while n < len(text):
+		# cut on a line break so the slice tokenizes the same as the full text would
+		cut = text.rfind("\n", 0, n)
+		if cut <= 0:
+			cut = n
+		toks = enc.encode(text[:cut])
+		if len(toks) >= limit:
+			return toks[:limit], False
+		n *= 2
+	toks = enc.encode(text)
+	return toks[:limit], len(toks) <= limit
+
+
+class TokenBudget:
+	def __init__(self, budget: int):
+		self.budget = max(0, budget)
+		self.used = 0
+
+	@property
+	def remaining(self) -> int:
+		return max(0, self.budget - self.used)
+
+	@property
+	def full(self) -> bool:
+		return self.used >= self.budget
+
+	def charge(self, text: str) -> int:
+		# counts tokens of text against the budget, never encoding past what is left
+		toks, _ = encode_prefix(text, self.remaining)
+		self.used += len(toks)
+		return len(toks)
+
+	def take(self, text: str) -> str:
+		# returns the part of text that fits and charges it
+		toks, whole = encode_prefix(text, self.remaining)
+		self.used += len(toks)
+		if whole:
+			return text
+		return get_encoder().decode(toks) if toks else ""